@@ -0,0 +1,195 @@
+import asyncio
+import heapq
+import itertools
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from DomainScheduler import KeywordQuota, RetryLater
+from RetryPolicy import RetryPolicy
+
+
+class AsyncDownloader:
+    # 名额被其他进程占用时的重试间隔
+    QUOTA_DELAY = 0.2
+    # items 暂时没有新任务时 (例如边采集边下载) 产出 IDLE，引擎在这段时间后再读取
+    IDLE = object()
+    IDLE_DELAY = 0.05
+
+    def __init__(self, n_inflight=16, scheduler=None, key_fn=None, max_deferred=1024, max_requeue=5,
+                 retry_policy=None, breaker=None, quota=None, quota_key=None, metrics=None):
+        """
+        基于 asyncio 的并发下载引擎
+        n_inflight: 每个进程同时进行中的请求数
+        scheduler: DomainScheduler (或共享的代理)，按 key_fn(item) 得到的域名限速
+        max_deferred: 因限速暂缓的任务上限，超过后不再读取新任务
+        max_requeue: download_fn 抛出 RetryLater 时最多重新排队的次数
+        retry_policy: download_fn 抛出临时错误 (超时、连接失败、5xx) 时按 RetryPolicy 退避重试
+        breaker: CircuitBreaker (或共享的代理)，熔断中的域名的任务直接跳过
+        quota: KeywordQuota 的共享代理，同一个关键词的多个块在不同进程中下载时共用 quota_key 的名额
+        metrics: Metrics，按域名记录下载结果，并记录进行中和暂缓的任务数
+        """
+        self.n_inflight = max(1, int(n_inflight))
+        self.scheduler = scheduler
+        self.key_fn = key_fn
+        self.max_deferred = max_deferred
+        self.max_requeue = max_requeue
+        self.retry_policy = retry_policy
+        self.breaker = breaker
+        self.quota = quota
+        self.quota_key = quota_key
+        self.metrics = metrics
+        self.requeued = 0
+        self.retried = 0
+        self.short_circuited = 0
+
+    def run(self, items, download_fn, max_count=0):
+        """
+        对 items 中的每一项并发调用 download_fn(item)，返回成功数量
+        download_fn 返回 True 表示成功，max_count 为成功数量上限 (0: 不限)
+        items 产出 AsyncDownloader.IDLE 表示暂时没有新任务，不会阻塞正在进行的下载
+        正在进行的请求也计入上限，所以成功数量不会超过 max_count
+        被限速的域名的任务暂缓执行，其他域名的任务继续下载
+        """
+        return asyncio.run(self._run(items, download_fn, max_count))
+
+    def _has_slot(self, pending, success_count, max_count):
+        return len(pending) < self.n_inflight and (max_count == 0 or success_count + len(pending) < max_count)
+
+    def _record(self, key, result):
+        if self.metrics is not None:
+            self.metrics.inc('downloads_total', domain=key, result=result)
+
+    def _release_probe(self, key):
+        # allow() 可能刚放行了试探请求，任务被暂缓时要结束试探，否则该域名之后一直被跳过
+        if key is not None and self.breaker is not None:
+            self.breaker.release_probe(key)
+
+    def _next_item(self, deferred, iterator, now):
+        if deferred and deferred[0][0] <= now:
+            return heapq.heappop(deferred)[2]
+        if iterator is not None and len(deferred) < self.max_deferred:
+            return next(iterator)
+        return None
+
+    async def _run(self, items, download_fn, max_count):
+        loop = asyncio.get_running_loop()
+        iterator = iter(items)
+        pending = {}  # future -> (item, key, started)
+        deferred = []  # heap of (not_before, seq, item)
+        requeue_count = {}
+        retry_count = {}
+        seq = itertools.count()
+        success_count = 0
+
+        executor = ThreadPoolExecutor(max_workers=self.n_inflight)
+        try:
+            while True:
+                # 补满空闲的并发槽位
+                now = time.monotonic()
+                idle = False
+                while self._has_slot(pending, success_count, max_count):
+                    try:
+                        item = self._next_item(deferred, iterator, now)
+                    except StopIteration:
+                        iterator = None
+                        continue
+                    if item is None:
+                        break
+                    if item is self.IDLE:
+                        idle = True
+                        break
+
+                    key = self.key_fn(item) if self.key_fn is not None else None
+                    if key is not None and self.breaker is not None and not self.breaker.allow(key):
+                        self.short_circuited += 1
+                        self._record(key, 'short_circuited')
+                        continue
+                    if self.quota is not None:
+                        state = self.quota.acquire(self.quota_key)
+                        if state == KeywordQuota.EXHAUSTED:
+                            iterator, deferred = None, []
+                            break
+                        if state == KeywordQuota.BUSY:
+                            self._release_probe(key)
+                            heapq.heappush(deferred, (now + self.QUOTA_DELAY, next(seq), item))
+                            break
+                    if key is not None and self.scheduler is not None:
+                        wait = self.scheduler.try_acquire(key)
+                        if wait > 0:
+                            if self.quota is not None:
+                                self.quota.finish(self.quota_key, False)
+                            self._release_probe(key)
+                            heapq.heappush(deferred, (now + wait, next(seq), item))
+                            continue
+
+                    pending[loop.run_in_executor(executor, download_fn, item)] = (item, key, time.monotonic())
+
+                if self.metrics is not None:
+                    self.metrics.gauge('downloader_inflight', len(pending))
+                    self.metrics.gauge('downloader_deferred', len(deferred))
+
+                limit_reached = max_count and success_count >= max_count
+                if not pending and (limit_reached or (iterator is None and not deferred)):
+                    break
+
+                # 有空闲槽位时，等到最早的暂缓任务可以执行为止
+                timeout = None
+                if deferred and self._has_slot(pending, success_count, max_count):
+                    timeout = max(0.0, deferred[0][0] - time.monotonic())
+                if idle:
+                    timeout = self.IDLE_DELAY if timeout is None else min(timeout, self.IDLE_DELAY)
+                if not pending:
+                    await asyncio.sleep(timeout or 0)
+                    continue
+
+                done, _ = await asyncio.wait(pending.keys(), timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                for future in done:
+                    item, key, started = pending.pop(future)
+                    if key is not None and self.scheduler is not None:
+                        self.scheduler.release(key)
+                    success = False
+                    try:
+                        result = future.result()
+                        if key is not None and self.breaker is not None:
+                            self.breaker.record_success(key)
+                        if result:
+                            success = True
+                            success_count += 1
+                        self._record(key, 'ok' if result else 'failed')
+                    except RetryLater as e:
+                        if key is not None and self.scheduler is not None:
+                            self.scheduler.penalize(key, e.delay)
+                        # 被限流的试探请求不改变熔断状态
+                        self._release_probe(key)
+                        self._record(key, 'throttled')
+                        requeue_count[item] = requeue_count.get(item, 0) + 1
+                        if requeue_count[item] <= self.max_requeue:
+                            self.requeued += 1
+                            heapq.heappush(deferred, (time.monotonic() + e.delay, next(seq), item))
+                        else:
+                            print('Download failed - {}'.format(e))
+                            self._record(key, 'error')
+                    except Exception as e:
+                        if self.retry_policy is None or not RetryPolicy.is_transient(e):
+                            print('Download failed - ', e)
+                            self._record(key, 'error')
+                            self._release_probe(key)
+                            continue
+                        if key is not None and self.breaker is not None:
+                            self.breaker.record_failure(key, time.monotonic() - started)
+                        retry_count[item] = retry_count.get(item, 0) + 1
+                        if retry_count[item] <= self.retry_policy.max_retries:
+                            self.retried += 1
+                            self._record(key, 'retry')
+                            delay = self.retry_policy.backoff(retry_count[item])
+                            heapq.heappush(deferred, (time.monotonic() + delay, next(seq), item))
+                            continue
+                        print('Download failed - ', e)
+                        self._record(key, 'error')
+                    finally:
+                        if self.quota is not None:
+                            self.quota.finish(self.quota_key, success)
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+        return success_count
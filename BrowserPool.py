@@ -0,0 +1,214 @@
+import os
+import threading
+
+from selenium import webdriver
+from selenium.webdriver.chrome.options import Options
+from selenium.webdriver.chrome.service import Service
+from webdriver_manager.chrome import ChromeDriverManager
+
+from Metrics import Metrics
+
+
+class BrowserPool:
+    _workers = {}
+    _workers_lock = threading.Lock()
+    _driver_path = None
+
+    def __init__(self, no_gui=False, proxy=None, max_tasks=50, performance_log=False):
+        """
+        每个进程保留常驻的 Chrome 会话，多个关键词复用，避免每个任务都重新启动浏览器
+        任务之间清空 cookie、缓存和存储并回到 about:blank，取出时检查会话是否可用
+        max_tasks: 一个会话最多执行的任务数，之后重新启动以限制内存增长 (0: 不限)
+        performance_log: 记录网络事件 (get_log('performance'))，供 NetworkHarvester 读取响应
+        """
+        self.no_gui = no_gui
+        self.proxy = proxy
+        self.performance_log = performance_log
+        self.max_tasks = max_tasks
+        self._lock = threading.Lock()
+        self.idle = []  # [(browser, 已执行的任务数)]
+        self.in_use = {}  # id(browser) -> (browser, 已执行的任务数)
+        self.started = 0
+        self.reused = 0
+        self.discarded = 0
+
+    @classmethod
+    def for_worker(cls, no_gui=False, proxy=None, performance_log=False):
+        """每个进程每种配置共用一个实例"""
+        key = (os.getpid(), no_gui, proxy, performance_log)
+        with cls._workers_lock:
+            if key not in cls._workers:
+                cls._workers[key] = cls(no_gui, proxy, performance_log=performance_log)
+            return cls._workers[key]
+
+    @classmethod
+    def close_worker(cls):
+        """退出本进程的所有浏览器"""
+        with cls._workers_lock:
+            pools = [pool for key, pool in cls._workers.items() if key[0] == os.getpid()]
+        for pool in pools:
+            pool.print_summary()
+            pool.close()
+
+    @classmethod
+    def driver_path(cls):
+        """chromedriver 路径只解析一次，ChromeDriverManager().install() 每次都会检查版本"""
+        with cls._workers_lock:
+            if cls._driver_path is None:
+                cls._driver_path = ChromeDriverManager().install()
+            return cls._driver_path
+
+    @classmethod
+    def set_driver_path(cls, path):
+        """主进程解析好的路径传给工作进程 (Pool 的 initializer 中调用)"""
+        with cls._workers_lock:
+            cls._driver_path = path
+
+    def _create(self):
+        chrome_options = Options()
+        chrome_options.add_argument('--no-sandbox')  # To maintain user cookies
+        chrome_options.add_argument('--disable-dev-shm-usage')
+        if self.no_gui:
+            chrome_options.add_argument('--headless')
+        # CollectLinks.collect_tabs 同时滚动多个窗口，不在前台的窗口也不能降低定时器和渲染的频率
+        chrome_options.add_argument('--disable-background-timer-throttling')
+        chrome_options.add_argument('--disable-backgrounding-occluded-windows')
+        chrome_options.add_argument('--disable-renderer-backgrounding')
+        if self.proxy:
+            chrome_options.add_argument("--proxy-server={}".format(self.proxy))
+        if self.performance_log:
+            # 只记录网络事件，日志在读取前由 chromedriver 缓存
+            chrome_options.set_capability('goog:loggingPrefs', {'performance': 'ALL'})
+            chrome_options.add_experimental_option('perfLoggingPrefs', {'enableNetwork': True, 'enablePage': False})
+        browser = webdriver.Chrome(service=Service(self.driver_path()), options=chrome_options)
+        self._time_webdriver_calls(browser)
+        self._print_versions(browser)
+        with self._lock:
+            self.started += 1
+        return browser
+
+    @staticmethod
+    def _time_webdriver_calls(browser):
+        # find_element、execute_script、WebElement 的操作最终都调用 WebDriver.execute，按命令记录耗时
+        execute = browser.execute
+        metrics = Metrics.for_worker()
+
+        def timed_execute(driver_command, params=None):
+            with metrics.timer('webdriver_seconds', command=driver_command):
+                return execute(driver_command, params)
+
+        browser.execute = timed_execute
+
+    @staticmethod
+    def _print_versions(browser):
+        browser_version = 'Failed to detect version'
+        chromedriver_version = 'Failed to detect version'
+        major_version_different = False
+
+        if 'browserVersion' in browser.capabilities:
+            browser_version = str(browser.capabilities['browserVersion'])
+
+        if 'chrome' in browser.capabilities:
+            if 'chromedriverVersion' in browser.capabilities['chrome']:
+                chromedriver_version = str(browser.capabilities['chrome']['chromedriverVersion']).split(' ')[0]
+
+        if browser_version.split('.')[0] != chromedriver_version.split('.')[0]:
+            major_version_different = True
+
+        print('_________________________________')
+        print('Current web-browser version:\t{}'.format(browser_version))
+        print('Current chrome-driver version:\t{}'.format(chromedriver_version))
+        if major_version_different:
+            print('warning: Version different')
+            print(
+                'Download correct version at "http://chromedriver.chromium.org/downloads" and place in "./chromedriver"')
+        print('_________________________________')
+
+    @staticmethod
+    def is_healthy(browser):
+        try:
+            return len(browser.window_handles) > 0 and browser.execute_script('return 1;') == 1
+        except Exception:
+            return False
+
+    @staticmethod
+    def _quit(browser):
+        try:
+            browser.quit()
+        except Exception as e:
+            print('Failed to quit browser - {}'.format(e))
+
+    def acquire(self):
+        """取出一个可用的浏览器，没有空闲的或已失效时启动新的"""
+        while True:
+            with self._lock:
+                browser, tasks = self.idle.pop() if self.idle else (None, 0)
+            if browser is None:
+                browser = self._create()
+                break
+            if self.is_healthy(browser):
+                with self._lock:
+                    self.reused += 1
+                break
+            print('Browser session is broken, starting a new one')
+            with self._lock:
+                self.discarded += 1
+            self._quit(browser)
+
+        with self._lock:
+            self.in_use[id(browser)] = (browser, tasks + 1)
+        return browser
+
+    def reset(self, browser):
+        """清除上一个任务留下的状态"""
+        handles = browser.window_handles
+        for handle in handles[1:]:
+            browser.switch_to.window(handle)
+            browser.close()
+        browser.switch_to.window(handles[0])
+        browser.switch_to.default_content()
+        try:
+            browser.execute_script('window.localStorage.clear(); window.sessionStorage.clear();')
+        except Exception:
+            # about:blank 或 data: 页面没有存储
+            pass
+        # 缩略图模式的资源屏蔽只对当前任务有效
+        browser.execute_cdp_cmd('Network.setBlockedURLs', {'urls': []})
+        browser.execute_cdp_cmd('Network.clearBrowserCookies', {})
+        browser.execute_cdp_cmd('Network.clearBrowserCache', {})
+        browser.get('about:blank')
+        if self.performance_log:
+            # 丢弃上一个任务未读取的网络事件
+            browser.get_log('performance')
+
+    def release(self, browser):
+        """任务结束后重置浏览器并放回池中，重置失败或达到 max_tasks 时退出"""
+        with self._lock:
+            browser, tasks = self.in_use.pop(id(browser), (browser, 1))
+
+        if 0 < self.max_tasks <= tasks:
+            self._quit(browser)
+            return
+        try:
+            self.reset(browser)
+        except Exception as e:
+            print('Failed to reset browser, quitting it - {}'.format(e))
+            with self._lock:
+                self.discarded += 1
+            self._quit(browser)
+            return
+        with self._lock:
+            self.idle.append((browser, tasks))
+
+    def close(self):
+        with self._lock:
+            browsers = [browser for browser, _ in self.idle] + [browser for browser, _ in self.in_use.values()]
+            self.idle = []
+            self.in_use = {}
+        for browser in browsers:
+            self._quit(browser)
+
+    def print_summary(self):
+        with self._lock:
+            print('Browsers - started: {}, reused: {}, discarded: {}'.format(self.started, self.reused,
+                                                                           self.discarded))
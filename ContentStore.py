@@ -0,0 +1,101 @@
+import json
+import os
+import shutil
+import threading
+import uuid
+
+
+class ContentStore:
+    _workers = {}
+    _workers_lock = threading.Lock()
+
+    def __init__(self, root):
+        """
+        内容寻址的图片存储，相同内容只保存一份
+        root: 存储目录，blob 保存在 root/objects/<sha256 前两位>/<sha256>
+        关键词目录下的文件是指向 blob 的硬链接，无法建立硬链接时写入 manifest.jsonl 引用
+        """
+        self.root = root
+        self.objects_dir = os.path.join(root, 'objects')
+        self.tmp_dir = os.path.join(root, 'tmp')
+        os.makedirs(self.objects_dir, exist_ok=True)
+        os.makedirs(self.tmp_dir, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self.blobs_new = 0
+        self.blobs_reused = 0
+        self.bytes_written = 0
+        self.bytes_saved = 0
+
+    @classmethod
+    def for_worker(cls, root):
+        """每个进程共用一个实例"""
+        key = (os.getpid(), root)
+        with cls._workers_lock:
+            if key not in cls._workers:
+                cls._workers[key] = cls(root)
+            return cls._workers[key]
+
+    def temp_path(self):
+        """下载中的文件先写到临时文件，哈希确定后再放入 objects"""
+        return os.path.join(self.tmp_dir, '{}.tmp'.format(uuid.uuid4().hex))
+
+    def blob_path(self, digest):
+        return os.path.join(self.objects_dir, digest[:2], digest)
+
+    def commit(self, temp_path, digest, dest_path):
+        """把临时文件存为 blob，并在 dest_path 建立引用，返回 blob 路径"""
+        blob = self.blob_path(digest)
+        size = os.path.getsize(temp_path)
+
+        if os.path.exists(blob):
+            os.remove(temp_path)
+            reused = True
+        else:
+            os.makedirs(os.path.dirname(blob), exist_ok=True)
+            # 临时文件可能在其他文件系统上 (例如 .part 文件)
+            shutil.move(temp_path, blob)
+            reused = False
+
+        with self._lock:
+            if reused:
+                self.blobs_reused += 1
+                self.bytes_saved += size
+            else:
+                self.blobs_new += 1
+                self.bytes_written += size
+
+        self.link(blob, dest_path, digest, size)
+        return blob
+
+    def link(self, blob, dest_path, digest, size):
+        if os.path.lexists(dest_path):
+            os.remove(dest_path)
+        try:
+            os.link(blob, dest_path)
+        except OSError:
+            # 文件系统不支持硬链接时记录引用
+            manifest = os.path.join(os.path.dirname(dest_path), 'manifest.jsonl')
+            with self._lock, open(manifest, 'a', encoding='utf-8') as f:
+                f.write(json.dumps({'name': os.path.basename(dest_path), 'sha256': digest, 'size': size}) + '\n')
+
+    def referenced_blob(self, dest_path):
+        """dest_path 没有硬链接、只记录在 manifest.jsonl 中时返回其 blob 路径，找不到时返回 None"""
+        manifest = os.path.join(os.path.dirname(dest_path), 'manifest.jsonl')
+        if not os.path.exists(manifest):
+            return None
+        digest = None
+        with self._lock, open(manifest, 'r', encoding='utf-8') as f:
+            for line in f:
+                entry = json.loads(line)
+                # 同名文件重新下载时以最后一行为准
+                if entry['name'] == os.path.basename(dest_path):
+                    digest = entry['sha256']
+        if digest is None or not os.path.exists(self.blob_path(digest)):
+            return None
+        return self.blob_path(digest)
+
+    def print_summary(self, title='Content store'):
+        with self._lock:
+            print('{} - new blobs: {}, deduplicated: {}, bytes written: {}, bytes saved: {}'
+                  .format(title, self.blobs_new, self.blobs_reused, self.bytes_written, self.bytes_saved))
@@ -0,0 +1,177 @@
+import email.utils
+import threading
+import time
+from multiprocessing.managers import BaseManager
+
+from RetryPolicy import CircuitBreaker
+
+
+class RetryLater(Exception):
+    def __init__(self, delay):
+        """服务器要求稍后重试 (429 / 503)，delay 为等待秒数"""
+        super().__init__('retry after {:.1f}s'.format(delay))
+        self.delay = delay
+
+    @staticmethod
+    def from_response(response, default=5.0):
+        """解析 Retry-After (秒数或 HTTP 日期)"""
+        value = response.headers.get('Retry-After')
+        if value:
+            try:
+                return RetryLater(max(0.0, float(value)))
+            except ValueError:
+                try:
+                    return RetryLater(max(0.0, email.utils.parsedate_to_datetime(value).timestamp() - time.time()))
+                except (TypeError, ValueError):
+                    pass
+        return RetryLater(default)
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        """rate: 每秒补充的令牌数 (0: 不限速), burst: 桶容量"""
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+
+    def take(self, now):
+        """拿到令牌返回 0，否则返回需要等待的秒数"""
+        if self.rate <= 0:
+            return 0.0
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class DomainScheduler:
+    # 并发数已满时的重试间隔
+    BUSY_DELAY = 0.05
+
+    def __init__(self, rate=0.0, max_concurrency=0, domain_config=None):
+        """
+        按域名限速和限制并发数
+        rate: 每个域名每秒请求数 (0: 不限)
+        max_concurrency: 每个域名同时进行的请求数 (0: 不限)
+        domain_config: 按域名覆盖，例如 {'images.pexels.com': (5, 4)} 表示每秒 5 个请求、最多 4 个并发
+        通过 SchedulerManager 共享时，所有下载进程使用同一份状态
+        """
+        self.rate = rate
+        self.max_concurrency = max_concurrency
+        self.domain_config = domain_config or {}
+        self._lock = threading.Lock()
+        self.domains = {}
+
+    def get_config(self, domain):
+        # 支持按上级域名配置，例如 pexels.com 对 images.pexels.com 生效
+        host = domain
+        while host:
+            if host in self.domain_config:
+                return self.domain_config[host]
+            host = host.partition('.')[2]
+        return self.rate, self.max_concurrency
+
+    def _get(self, domain):
+        state = self.domains.get(domain)
+        if state is None:
+            rate, max_concurrency = self.get_config(domain)
+            state = {'bucket': TokenBucket(rate, rate), 'max_concurrency': max_concurrency,
+                     'inflight': 0, 'blocked_until': 0.0, 'requests': 0, 'throttled': 0}
+            self.domains[domain] = state
+        return state
+
+    def try_acquire(self, domain):
+        """可以发起请求时返回 0 并占用一个并发名额，否则返回建议等待的秒数"""
+        with self._lock:
+            state = self._get(domain)
+            now = time.monotonic()
+            if state['blocked_until'] > now:
+                return state['blocked_until'] - now
+            if 0 < state['max_concurrency'] <= state['inflight']:
+                return self.BUSY_DELAY
+            wait = state['bucket'].take(now)
+            if wait > 0:
+                return wait
+            state['inflight'] += 1
+            state['requests'] += 1
+            return 0.0
+
+    def release(self, domain):
+        with self._lock:
+            state = self._get(domain)
+            state['inflight'] = max(0, state['inflight'] - 1)
+
+    def penalize(self, domain, seconds):
+        """收到 429 后暂停该域名，其他域名不受影响"""
+        with self._lock:
+            state = self._get(domain)
+            state['blocked_until'] = max(state['blocked_until'], time.monotonic() + seconds)
+            state['throttled'] += 1
+
+    def stats(self):
+        with self._lock:
+            return {domain: {'requests': state['requests'], 'throttled': state['throttled'],
+                             'inflight': state['inflight']}
+                    for domain, state in self.domains.items()}
+
+    @staticmethod
+    def parse_domain_config(text):
+        """解析 "images.pexels.com=5/4,cloudfront.net=20/8" 格式的配置 (每秒请求数/最大并发)"""
+        config = {}
+        for item in str(text).split(','):
+            if '=' in item:
+                domain, value = item.split('=', 1)
+                rate, _, max_concurrency = value.partition('/')
+                config[domain.strip().lower()] = (float(rate or 0), int(max_concurrency or 0))
+        return config
+
+
+class KeywordQuota:
+    ACQUIRED = 0
+    BUSY = 1  # 剩余名额都被进行中的下载占用，等它们结束再决定
+    EXHAUSTED = 2
+
+    def __init__(self):
+        """
+        关键词的链接被分成多个块由不同进程下载时，保证成功数量正好不超过 limit
+        每个下载开始前占用一个名额，失败时归还
+        """
+        self._lock = threading.Lock()
+        self.quotas = {}
+
+    def set(self, key, limit):
+        with self._lock:
+            self.quotas[key] = {'limit': limit, 'success': 0, 'reserved': 0}
+
+    def acquire(self, key):
+        with self._lock:
+            quota = self.quotas[key]
+            if quota['success'] >= quota['limit']:
+                return self.EXHAUSTED
+            if quota['success'] + quota['reserved'] >= quota['limit']:
+                return self.BUSY
+            quota['reserved'] += 1
+            return self.ACQUIRED
+
+    def finish(self, key, success):
+        with self._lock:
+            quota = self.quotas[key]
+            quota['reserved'] = max(0, quota['reserved'] - 1)
+            if success:
+                quota['success'] += 1
+
+    def success(self, key):
+        with self._lock:
+            return self.quotas[key]['success']
+
+
+class SchedulerManager(BaseManager):
+    """在独立进程中保存 DomainScheduler、CircuitBreaker 和 KeywordQuota，供所有下载进程共享"""
+
+
+SchedulerManager.register('DomainScheduler', DomainScheduler)
+SchedulerManager.register('CircuitBreaker', CircuitBreaker)
+SchedulerManager.register('KeywordQuota', KeywordQuota)
@@ -0,0 +1,262 @@
+import argparse
+import html
+import json
+import threading
+from http.server import BaseHTTPRequestHandler
+from urllib.parse import parse_qs, urlparse
+
+from SyntheticImageServer import QuietHTTPServer
+
+# 结果页: 第一批结果由服务器渲染 (或在页面内嵌的数据中)，接近底部时按站点的接口格式请求下一批并插入结果节点
+PAGE = '''<!DOCTYPE html><html><head><style>img {{ display: block; height: 200px; }}</style></head>
+<body>{inline}<div id="results">{first}</div><script>
+var page = {page}, pages = {pages}, loading = false;
+function render(text) {{ {render} }}
+function loadNext() {{
+    if (loading || page >= pages) return;
+    loading = true;
+    fetch({next_url}).then(function (r) {{ return r.text(); }}).then(function (text) {{
+        render(text); page++; loading = false;
+    }});
+}}
+window.addEventListener('scroll', function () {{
+    if (window.innerHeight + window.scrollY >= document.body.scrollHeight - 400) loadNext();
+}});
+if (page == 0) loadNext();
+</script></body></html>'''
+
+# google: 点击结果打开原图，方向键切换到下一张 (CollectLinks.google_full_click)
+GOOGLE_VIEWER = '''<div jsname="figiqf" id="viewer" style="position: fixed; top: 0; right: 0;"></div><script>
+var current = -1;
+function show(i) {
+    var items = document.querySelectorAll('.eA0Zlc');
+    if (i >= items.length) return;
+    current = i;
+    document.getElementById('viewer').innerHTML = '<img src="' + items[i].getAttribute('data-original') + '">';
+    items[i].scrollIntoView();
+}
+document.addEventListener('click', function (e) {
+    var images = Array.prototype.slice.call(document.querySelectorAll('.YQ4gaf'));
+    if (images.indexOf(e.target) >= 0) show(images.indexOf(e.target));
+});
+document.addEventListener('keydown', function (e) { if (e.key === 'ArrowRight' && current >= 0) show(current + 1); });
+</script>'''
+
+# 站点 -> 结果页的路径
+PAGE_PATHS = {
+    'google': '/search?q=cat&udm=2',
+    'naver': '/search.naver?where=image&query=cat',
+    'bing': '/images/search?first=1&q=cat',
+    'pexels': '/search/cat/',
+}
+
+
+def original_url(site, i):
+    """第 i 个结果的原图，也是 NetworkHarvester 应该取出的链接"""
+    if site == 'pexels':
+        return 'https://images.pexels.com/photos/{0}/pexels-photo-{0}.jpeg'.format(i)
+    if site == 'google':
+        return 'https://example.com/google/{}.jpg?size=large&id={}'.format(i, i)
+    return 'https://example.com/{}/{}.jpg'.format(site, i)
+
+
+def thumbnail_url(site, i):
+    if site == 'google':
+        return 'https://encrypted-tbn0.gstatic.com/images?q=tbn:{}&s=10'.format(i)
+    if site == 'naver':
+        return 'https://search.pstatic.net/common/?src={}&type=a340'.format(original_url(site, i))
+    if site == 'bing':
+        return 'https://tse1.mm.bing.net/th?id=OIP.{}'.format(i)
+    return original_url(site, i) + '?auto=compress&cs=tinysrgb&w=500'
+
+
+class HarvestFixtureServer:
+    def __init__(self, host='127.0.0.1', port=0, total=200, batch=50):
+        """
+        本地页面，按各站点的数据格式返回结果，用于离线检查 CollectLinks 的 network 模式
+        google: 页面内嵌 AF_initDataCallback (\\u003d 转义)，之后的批次来自 batchexecute (双层 JSON 字符串)
+        naver: 全部批次来自 JSON 接口 (originalUrl，\\/ 转义)
+        bing: 服务器渲染的 a.iusc[m]，之后的批次来自 /images/async 的 HTML 片段
+        pexels: 页面内嵌 __NEXT_DATA__，之后的批次来自 /api/v3/search/photos
+        total: 每个站点的结果数，batch: 每批的结果数
+        """
+        self.total = total
+        self.batch = batch
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                server.handle(self)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = QuietHTTPServer((host, port), Handler)
+        self.thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return 'http://{}:{}'.format(host, port)
+
+    def page_url(self, site):
+        return self.base_url + PAGE_PATHS[site]
+
+    def expected_links(self, site):
+        return [original_url(site, i) for i in range(self.total)]
+
+    @property
+    def pages(self):
+        return (self.total + self.batch - 1) // self.batch
+
+    def indexes(self, page):
+        return range(page * self.batch, min(self.total, (page + 1) * self.batch))
+
+    # 每个站点: 结果节点、一批数据的接口响应、结果页
+
+    @staticmethod
+    def google_item(i):
+        return '<div class="eA0Zlc" data-original="{}"><img class="YQ4gaf" src="{}"></div>'.format(
+            html.escape(original_url('google', i)), html.escape(thumbnail_url('google', i)))
+
+    def google_data(self, page):
+        return [[[thumbnail_url('google', i), 194, 259], [original_url('google', i), 1200, 800]]
+                for i in self.indexes(page)]
+
+    def google_payload(self, page):
+        # batchexecute: 前缀 + JSON，结果数据本身是其中的一个 JSON 字符串
+        data = json.dumps(self.google_data(page), separators=(',', ':'))
+        return ")]}'\n\n" + json.dumps([['wrb.fr', 'HoAMBc', data, None]], separators=(',', ':'))
+
+    def google_page(self):
+        data = json.dumps(self.google_data(0), separators=(',', ':')).replace('=', '\\u003d').replace('&', '\\u0026')
+        return PAGE.format(
+            inline="<script>AF_initDataCallback({{key: 'ds:1', data: {}}});</script>{}".format(data, GOOGLE_VIEWER),
+            first=''.join(self.google_item(i) for i in self.indexes(0)), page=1, pages=self.pages,
+            next_url="'/_/VisualFrontendUi/data/batchexecute?page=' + page",
+            render="var data = JSON.parse(JSON.parse(text.slice(text.indexOf('\\n\\n') + 2))[0][2]); "
+                   "var html = ''; data.forEach(function (item) { html += '<div class=\"eA0Zlc\" "
+                   "data-original=\"' + item[1][0] + '\"><img class=\"YQ4gaf\" src=\"' + item[0][0] + '\"></div>'; }); "
+                   "document.getElementById('results').insertAdjacentHTML('beforeend', html);")
+
+    def naver_payload(self, page):
+        items = [{'originalUrl': original_url('naver', i), 'thumb': thumbnail_url('naver', i)}
+                 for i in self.indexes(page)]
+        return json.dumps({'items': items}).replace('/', '\\/')
+
+    def naver_page(self):
+        return PAGE.format(
+            inline='', first='', page=0, pages=self.pages,
+            next_url="'/p/c/image/search.naver?where=image&query=cat&start=' + page",
+            render="var html = ''; JSON.parse(text).items.forEach(function (item) { "
+                   "html += '<div class=\"tile_item _fe_image_tab_content_tile\"><img "
+                   "class=\"_fe_image_tab_content_thumbnail_image\" src=\"' + item.thumb + '\"></div>'; }); "
+                   "document.getElementById('results').insertAdjacentHTML('beforeend', html);")
+
+    def bing_payload(self, page):
+        items = []
+        for i in self.indexes(page):
+            m = json.dumps({'murl': original_url('bing', i), 'turl': thumbnail_url('bing', i)})
+            items.append('<div class="imgpt"><a class="iusc" m="{}" href="/images/search?view=detailV2&amp;id={}">'
+                         '</a></div>'.format(html.escape(m), i))
+        return ''.join(items)
+
+    def bing_page(self):
+        return PAGE.format(
+            inline='', first=self.bing_payload(0), page=1, pages=self.pages,
+            next_url="'/images/async?q=cat&first=' + (page * {})".format(self.batch),
+            render="document.getElementById('results').insertAdjacentHTML('beforeend', text);")
+
+    def pexels_data(self, page):
+        return {'data': [{'id': i, 'attributes': {'image': {
+            'small': original_url('pexels', i) + '?auto=compress&cs=tinysrgb&h=130',
+            'medium': thumbnail_url('pexels', i),
+            'large': original_url('pexels', i) + '?auto=compress&cs=tinysrgb&h=650&w=940'}}}
+            for i in self.indexes(page)]}
+
+    def pexels_payload(self, page):
+        return json.dumps(self.pexels_data(page))
+
+    def pexels_page(self):
+        next_data = json.dumps({'props': {'pageProps': {'initialData': self.pexels_data(0)}}})
+        first = ''.join('<a href="/photo/{}/"><img class="spacing_noMargin__F5u9R" src="{}"></a>'.format(
+            i, html.escape(thumbnail_url('pexels', i))) for i in self.indexes(0))
+        return PAGE.format(
+            inline='<script id="__NEXT_DATA__" type="application/json">{}</script>'.format(next_data),
+            first=first, page=1, pages=self.pages,
+            next_url="'/en-us/api/v3/search/photos?query=cat&page=' + (page + 1)",
+            render="var html = ''; JSON.parse(text).data.forEach(function (item) { "
+                   "html += '<a href=\"/photo/' + item.id + '/\"><img class=\"spacing_noMargin__F5u9R\" src=\"' + "
+                   "item.attributes.image.medium + '\"></a>'; }); "
+                   "document.getElementById('results').insertAdjacentHTML('beforeend', html);")
+
+    def route(self, path):
+        """返回 (Content-Type, 正文)，没有对应的页面时返回 None"""
+        url = urlparse(path)
+        query = {key: values[0] for key, values in parse_qs(url.query).items()}
+        if url.path == '/search':
+            return 'text/html', self.google_page()
+        if url.path == '/_/VisualFrontendUi/data/batchexecute':
+            return 'application/json', self.google_payload(int(query.get('page', 0)))
+        if url.path == '/search.naver':
+            return 'text/html', self.naver_page()
+        if url.path == '/p/c/image/search.naver':
+            return 'application/json', self.naver_payload(int(query.get('start', 0)))
+        if url.path == '/images/search':
+            return 'text/html', self.bing_page()
+        if url.path == '/images/async':
+            return 'text/html', self.bing_payload(int(query.get('first', 0)) // self.batch)
+        if url.path.startswith('/search/'):
+            return 'text/html', self.pexels_page()
+        if url.path == '/en-us/api/v3/search/photos':
+            return 'application/json', self.pexels_payload(int(query.get('page', 1)) - 1)
+        return None
+
+    def handle(self, request):
+        response = self.route(request.path)
+        if response is None:
+            request.send_error(404)
+            return
+        content_type, text = response
+        body = text.encode('utf-8')
+        request.send_response(200)
+        request.send_header('Content-Type', '{}; charset=utf-8'.format(content_type))
+        request.send_header('Content-Length', str(len(body)))
+        request.end_headers()
+        try:
+            request.wfile.write(body)
+        except ConnectionError:
+            pass
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--port', type=int, default=8001, help='Port to listen on. (0: any free port)')
+    parser.add_argument('--total', type=int, default=200, help='Number of results of every site.')
+    parser.add_argument('--batch', type=int, default=50, help='Results per page of the site payload.')
+    args = parser.parse_args()
+
+    with HarvestFixtureServer(port=args.port, total=args.total, batch=args.batch) as server:
+        for site in PAGE_PATHS:
+            print('{:<7} {}'.format(site, server.page_url(site)), flush=True)
+        try:
+            server.thread.join()
+        except KeyboardInterrupt:
+            pass
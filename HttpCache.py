@@ -0,0 +1,170 @@
+import argparse
+import os
+import sqlite3
+import threading
+import time
+
+from ContentStore import ContentStore
+
+
+class HttpCache:
+    _workers = {}
+    _workers_lock = threading.Lock()
+
+    def __init__(self, root, max_age_days=30, max_bytes=0):
+        """
+        按 URL 记录 ETag / Last-Modified / sha256 的磁盘缓存，用于条件请求
+        图片内容保存在 root/objects (ContentStore)，元数据保存在 root/http_cache.sqlite
+        服务器返回 304 时直接从 blob 建立硬链接，不再传输图片
+        max_age_days: 超过该天数没有验证过的条目会被淘汰 (0: 不按时间淘汰)
+        max_bytes: blob 总大小上限，超过时淘汰最久没有验证的条目 (0: 不限)
+        """
+        self.root = root
+        self.max_age_days = max_age_days
+        self.max_bytes = max_bytes
+        self.store = ContentStore(root)
+
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(os.path.join(root, 'http_cache.sqlite'), timeout=30, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS entries (
+                url TEXT PRIMARY KEY,
+                etag TEXT,
+                last_modified TEXT,
+                digest TEXT NOT NULL,
+                ext TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                validated REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS entries_validated ON entries (validated);
+            CREATE INDEX IF NOT EXISTS entries_digest ON entries (digest);
+        """)
+        self.conn.commit()
+
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+
+    @classmethod
+    def for_worker(cls, root, max_age_days=30, max_bytes=0):
+        """sqlite 连接不能跨进程使用，每个进程单独打开"""
+        key = (os.getpid(), root)
+        with cls._workers_lock:
+            if key not in cls._workers:
+                cls._workers[key] = cls(root, max_age_days, max_bytes)
+            return cls._workers[key]
+
+    def lookup(self, url):
+        """返回 URL 的缓存条目，blob 已被删除时同时删除条目"""
+        with self._lock:
+            row = self.conn.execute('SELECT etag, last_modified, digest, ext, size FROM entries WHERE url = ?',
+                                    (url,)).fetchone()
+        if row is None:
+            return None
+        entry = dict(zip(('etag', 'last_modified', 'digest', 'ext', 'size'), row))
+        if not os.path.exists(self.store.blob_path(entry['digest'])):
+            self.forget(url)
+            return None
+        return entry
+
+    @staticmethod
+    def conditional_headers(entry):
+        headers = {}
+        if entry and entry['etag']:
+            headers['If-None-Match'] = entry['etag']
+        if entry and entry['last_modified']:
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+
+    @staticmethod
+    def is_cacheable(response):
+        return bool(response.headers.get('ETag') or response.headers.get('Last-Modified'))
+
+    def hit(self, url, entry, dest_path):
+        """304: 从 blob 链接到 dest_path"""
+        self.store.link(self.store.blob_path(entry['digest']), dest_path, entry['digest'], entry['size'])
+        with self._lock:
+            self.conn.execute('UPDATE entries SET validated = ? WHERE url = ?', (time.time(), url))
+            self.conn.commit()
+            self.hits += 1
+            self.bytes_saved += entry['size']
+
+    def save(self, url, response, temp_path, digest, ext, dest_path):
+        """新下载的图片存为 blob 并记录验证信息"""
+        size = os.path.getsize(temp_path)
+        self.store.commit(temp_path, digest, dest_path)
+        with self._lock:
+            self.conn.execute('INSERT OR REPLACE INTO entries (url, etag, last_modified, digest, ext, size, validated) '
+                              'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                              (url, response.headers.get('ETag'), response.headers.get('Last-Modified'), digest, ext,
+                               size, time.time()))
+            self.conn.commit()
+            self.misses += 1
+
+    def forget(self, url):
+        with self._lock:
+            self.conn.execute('DELETE FROM entries WHERE url = ?', (url,))
+            self.conn.commit()
+
+    def _remove_unreferenced(self, digests):
+        removed = 0
+        for digest in digests:
+            with self._lock:
+                referenced = self.conn.execute('SELECT 1 FROM entries WHERE digest = ? LIMIT 1', (digest,)).fetchone()
+            blob = self.store.blob_path(digest)
+            if not referenced and os.path.exists(blob):
+                # 关键词目录下的硬链接不受影响
+                removed += os.path.getsize(blob)
+                os.remove(blob)
+        return removed
+
+    def evict(self):
+        """按时间和总大小淘汰条目，返回 (删除的条目数, 释放的字节数)"""
+        evicted = []
+        with self._lock:
+            if self.max_age_days > 0:
+                cutoff = time.time() - self.max_age_days * 86400
+                evicted += self.conn.execute('SELECT url, digest FROM entries WHERE validated < ?', (cutoff,)).fetchall()
+                self.conn.execute('DELETE FROM entries WHERE validated < ?', (cutoff,))
+
+            if self.max_bytes > 0:
+                # 同一 blob 可能被多个 URL 引用，按 digest 计算大小
+                rows = self.conn.execute('SELECT digest, MAX(size), MAX(validated) FROM entries GROUP BY digest '
+                                         'ORDER BY MAX(validated) DESC').fetchall()
+                total = 0
+                for digest, size, _ in rows:
+                    total += size
+                    if total > self.max_bytes:
+                        evicted += self.conn.execute('SELECT url, digest FROM entries WHERE digest = ?',
+                                                     (digest,)).fetchall()
+                        self.conn.execute('DELETE FROM entries WHERE digest = ?', (digest,))
+            self.conn.commit()
+
+        freed = self._remove_unreferenced(set(digest for _, digest in evicted))
+        return len(evicted), freed
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+    def print_summary(self):
+        with self._lock:
+            print('HTTP cache - not modified: {}, downloaded: {}, bytes saved: {}'
+                  .format(self.hits, self.misses, self.bytes_saved))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('root', type=str, help='HTTP cache directory.')
+    parser.add_argument('--max-age-days', type=float, default=30, help='Evict entries not validated for this many days.')
+    parser.add_argument('--max-bytes', type=int, default=0, help='Evict least recently validated images above this size.')
+    args = parser.parse_args()
+
+    cache = HttpCache(args.root, args.max_age_days, args.max_bytes)
+    try:
+        count, freed = cache.evict()
+    finally:
+        cache.close()
+    print('Evicted {} entries, freed {} bytes'.format(count, freed))
@@ -0,0 +1,226 @@
+import argparse
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from html.parser import HTMLParser
+from http.server import BaseHTTPRequestHandler
+from urllib.parse import quote, quote_plus, urlparse
+
+from HttpSessionPool import HttpSessionPool
+from LinkFilter import LinkFilter
+from Metrics import Metrics
+
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) '
+                  'Chrome/124.0.0.0 Safari/537.36',
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
+    'Accept-Language': 'en-US,en;q=0.9',
+}
+
+# 站点 -> (第一页, 之后的第 page 页)，参数: 关键词、add_url、page、结果偏移
+PAGE_URLS = {
+    'bing': ('https://www.bing.com/images/search?first=1&q={keyword}{add_url}',
+             'https://www.bing.com/images/async?q={keyword}&first={offset}&count=35&mmasync=1{add_url}'),
+    'pexels': ('https://www.pexels.com/search/{path}/',
+               'https://www.pexels.com/search/{path}/?page={page}'),
+}
+
+# bing 每页的结果数，用于计算 async 接口的偏移
+BING_PAGE_SIZE = 35
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'http_collector')
+
+
+class ResultParser(HTMLParser):
+    def __init__(self, site):
+        """取出 bing 结果 a.iusc 的 m 属性中的 murl，或 pexels 结果图片 img 的 src"""
+        super().__init__(convert_charrefs=True)
+        self.site = site
+        self.links = []
+
+    def handle_starttag(self, tag, attrs):
+        if self.site == 'bing' and tag == 'a':
+            attrs = dict(attrs)
+            if 'iusc' not in (attrs.get('class') or '').split() or not attrs.get('m'):
+                return
+            try:
+                murl = json.loads(attrs['m']).get('murl')
+            except ValueError:
+                return
+            if murl:
+                self.links.append(murl)
+        elif self.site == 'pexels' and tag == 'img':
+            src = dict(attrs).get('src') or ''
+            # 头像等其他图片不在 /photos/ 下
+            if src.startswith('https://images.pexels.com/photos/'):
+                # 与 CollectLinks.pexels 相同的尺寸
+                self.links.append(src.replace('w=500', 'w=1280&h=720'))
+
+
+def parse_results(site, text):
+    parser = ResultParser(site)
+    parser.feed(text)
+    parser.close()
+    return parser.links
+
+
+class HttpCollectLinks:
+    SITES = ('bing', 'pexels')
+
+    def __init__(self, proxy=None, page_workers=4, max_pages=30, page_urls=None, timeout=10):
+        """
+        不启动浏览器，直接请求结果页 (keep-alive 连接池) 并解析 HTML 的采集器，只支持 SITES 中的站点
+        page_workers: 同一个关键词同时请求的页数
+        max_pages: 每个关键词最多请求的页数，一批页面都没有新链接时提前结束
+        page_urls: 覆盖 PAGE_URLS (例如指向本地的测试页面)
+        """
+        self.proxies = {'http': proxy, 'https': proxy} if proxy else None
+        self.page_workers = max(1, page_workers)
+        self.max_pages = max_pages
+        self.page_urls = page_urls or PAGE_URLS
+        self.timeout = timeout
+        self.session = HttpSessionPool.for_worker(pool_maxsize=32)
+        self.filter = LinkFilter()
+        self._lock = threading.Lock()
+        self.pages = 0
+
+    def release(self):
+        """与 CollectLinks 一致，没有需要归还的浏览器"""
+
+    def page_url(self, site, keyword, add_url, page):
+        first, more = self.page_urls[site]
+        template = first if page == 0 else more
+        return template.format(keyword=quote_plus(keyword), path=quote(keyword), add_url=add_url, page=page + 1,
+                               offset=page * BING_PAGE_SIZE + 1)
+
+    def fetch_page(self, site, keyword, add_url, page):
+        url = self.page_url(site, keyword, add_url, page)
+        metrics = Metrics.for_worker()
+        try:
+            with metrics.timer('collect_page_seconds', site=site):
+                response = self.session.get(url, headers=HEADERS, proxies=self.proxies, timeout=self.timeout)
+            if response.status_code != 200:
+                print('[HTTP {} while collecting links from {}] {}'.format(response.status_code, site, url))
+                metrics.inc('collect_errors_total', site=site)
+                return []
+            with self._lock:
+                self.pages += 1
+            return parse_results(site, response.text)
+        except Exception as e:
+            print('[Exception occurred while collecting links from {}] {}'.format(site, e))
+            metrics.inc('collect_errors_total', site=site)
+            return []
+
+    def stream(self, site, keyword, add_url=""):
+        """
+        按批同时请求 page_workers 页并返回新链接 (生成器)
+        一批页面都没有新链接 (到达最后一页或被拒绝) 时结束
+        """
+        found = set()
+        with ThreadPoolExecutor(self.page_workers) as executor:
+            for start in range(0, self.max_pages, self.page_workers):
+                pages = range(start, min(self.max_pages, start + self.page_workers))
+                new_links = 0
+                for links in executor.map(lambda page: self.fetch_page(site, keyword, add_url, page), pages):
+                    for link in links:
+                        if link in found:
+                            continue
+                        found.add(link)
+                        if self.filter.check_link(link):
+                            new_links += 1
+                            yield link
+                if new_links == 0:
+                    break
+
+    def collect(self, site, keyword, add_url=""):
+        links = list(self.stream(site, keyword, add_url))
+        print('Collect links done. Site: {}, Keyword: {}, Total: {}, Pages: {}'.format(site, keyword, len(links),
+                                                                                       self.pages))
+        return links
+
+    def bing(self, keyword, add_url=""):
+        return self.collect('bing', keyword, add_url)
+
+    def pexels(self, keyword, add_url=""):
+        return self.collect('pexels', keyword, add_url)
+
+    def pexels_full(self, keyword, add_url="", limit=100):
+        return self.pexels(keyword, add_url=add_url)
+
+
+def check_fixtures(fixture_dir=FIXTURE_DIR):
+    """
+    用保存的结果页检查解析器，再用本地服务器提供这些页面检查分页
+    expected.json: {文件名: [site, 应该取出的链接, ...]}
+    """
+    from SyntheticImageServer import QuietHTTPServer
+
+    with open(os.path.join(fixture_dir, 'expected.json'), 'r', encoding='utf-8') as f:
+        expected = json.load(f)
+
+    ok = True
+    for name, (site, *links) in sorted(expected.items()):
+        with open(os.path.join(fixture_dir, name), 'r', encoding='utf-8') as f:
+            parsed = parse_results(site, f.read())
+        print('{:<24} {:>3} links  {}'.format(name, len(parsed), 'ok' if parsed == links else 'MISMATCH'))
+        if parsed != links:
+            ok = False
+            print('  expected: {}\n  parsed:   {}'.format(links, parsed))
+
+    # 第一页返回 *_search.html，之后的每一页都返回 bing_async.html / pexels_page2.html
+    # 第二批页面全是重复的链接，采集应该在这里结束
+    pages = {'/images/search': 'bing_search.html', '/images/async': 'bing_async.html',
+             '/search/cat/': 'pexels_search.html'}
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlparse(self.path)
+            name = 'pexels_page2.html' if url.path == '/search/cat/' and url.query else pages.get(url.path)
+            if name is None:
+                self.send_error(404)
+                return
+            with open(os.path.join(fixture_dir, name), 'rb') as f:
+                body = f.read()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    httpd = QuietHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    base_url = 'http://{}:{}'.format(*httpd.server_address[:2])
+    page_urls = {site: tuple(url.replace('https://www.{}.com'.format(site), base_url) for url in urls)
+                 for site, urls in PAGE_URLS.items()}
+    try:
+        for site, names in (('bing', ('bing_search.html', 'bing_async.html')),
+                            ('pexels', ('pexels_search.html', 'pexels_page2.html'))):
+            collect = HttpCollectLinks(page_urls=page_urls)
+            links = collect.collect(site, 'cat')
+            want = list(dict.fromkeys(link for name in names for link in expected[name][1:]
+                                      if collect.filter.check_link(link)))
+            print('{:<24} {:>3} links  {}'.format(site + ' paging', len(links), 'ok' if links == want else 'MISMATCH'))
+            ok = ok and links == want
+    finally:
+        httpd.shutdown()
+        httpd.server_close()
+    return ok
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--site', type=str, default='', help='Collect links of --keyword from bing or pexels. '
+                                                             '(empty: check the parser against the saved fixtures)')
+    parser.add_argument('--keyword', type=str, default='cat', help='Keyword to collect.')
+    parser.add_argument('--pages', type=int, default=30, help='Maximum result pages per keyword.')
+    args = parser.parse_args()
+
+    if args.site:
+        links = HttpCollectLinks(max_pages=args.pages).collect(args.site, args.keyword)
+        print('\n'.join(links))
+    else:
+        raise SystemExit(0 if check_fixtures() else 1)
@@ -0,0 +1,107 @@
+import os
+import struct
+
+HEAD_SIZE = 32
+
+# 读取到这么多字节仍然无法得到尺寸时放弃检查 (JPEG 的 EXIF 缩略图可能很大)
+PROBE_SIZE = 64 * 1024
+
+
+def sniff_image_format(head):
+    """
+    根据文件开头的 magic bytes 判断图片格式
+    返回 'jpg' / 'png' / 'gif' / 'webp' / 'bmp'，不是图片时返回 None
+    """
+    if head[:3] == b'\xff\xd8\xff':
+        return 'jpg'
+    if head[:8] == b'\x89PNG\r\n\x1a\n':
+        return 'png'
+    if head[:6] in (b'GIF87a', b'GIF89a'):
+        return 'gif'
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'webp'
+    if head[:2] == b'BM':
+        return 'bmp'
+    return None
+
+
+JPEG_SOF_MARKERS = set(range(0xc0, 0xd0)) - {0xc4, 0xc8, 0xcc}
+
+
+def probe_jpeg_size(head):
+    offset = 2
+    while offset + 9 <= len(head):
+        if head[offset] != 0xff:
+            return None
+        marker = head[offset + 1]
+        if marker == 0xff:
+            # 填充字节
+            offset += 1
+            continue
+        if marker in JPEG_SOF_MARKERS:
+            height, width = struct.unpack('>HH', head[offset + 5:offset + 9])
+            return width, height
+        if marker == 0x01 or 0xd0 <= marker <= 0xd7:
+            offset += 2
+            continue
+        offset += 2 + struct.unpack('>H', head[offset + 2:offset + 4])[0]
+    return None
+
+
+def probe_image_size(head):
+    """
+    只根据文件开头解析图片宽高: JPEG SOF, PNG IHDR, GIF 逻辑屏幕, WebP (VP8 / VP8L / VP8X), BMP
+    返回 (width, height)，数据不够或无法解析时返回 None
+    """
+    ext = sniff_image_format(head)
+    if ext == 'png' and len(head) >= 24 and head[12:16] == b'IHDR':
+        return struct.unpack('>II', head[16:24])
+    if ext == 'gif' and len(head) >= 10:
+        return struct.unpack('<HH', head[6:10])
+    if ext == 'bmp' and len(head) >= 26:
+        width, height = struct.unpack('<ii', head[18:26])
+        return abs(width), abs(height)
+    if ext == 'webp' and len(head) >= 30:
+        chunk = head[12:16]
+        if chunk == b'VP8 ' and head[23:26] == b'\x9d\x01\x2a':
+            width, height = struct.unpack('<HH', head[26:30])
+            return width & 0x3fff, height & 0x3fff
+        if chunk == b'VP8L' and head[20] == 0x2f:
+            bits = struct.unpack('<I', head[21:25])[0]
+            return (bits & 0x3fff) + 1, ((bits >> 14) & 0x3fff) + 1
+        if chunk == b'VP8X':
+            return (int.from_bytes(head[24:27], 'little') + 1, int.from_bytes(head[27:30], 'little') + 1)
+    if ext == 'jpg':
+        return probe_jpeg_size(head)
+    return None
+
+
+def is_image_content_type(content_type):
+    """HTML 错误页等非图片响应在读取 body 之前就可以放弃"""
+    content_type = str(content_type or '').split(';')[0].strip().lower()
+    return not (content_type.startswith('text/') or content_type in ('application/json', 'application/xml'))
+
+
+def is_image_complete(path, ext):
+    """
+    下载完成后检查文件结尾，发现被截断的图片
+    jpg: EOI 标记, png: IEND 块, gif: 结束符 0x3B, webp / bmp: 文件头中记录的大小
+    """
+    size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        head = f.read(HEAD_SIZE)
+        f.seek(max(0, size - 16))
+        tail = f.read()
+
+    if ext == 'jpg':
+        # 部分编码器会在 EOI 之后补零
+        return b'\xff\xd9' in tail
+    if ext == 'png':
+        return tail.endswith(b'IEND\xaeB`\x82')
+    if ext == 'gif':
+        return tail.rstrip(b'\x00').endswith(b';')
+    if ext == 'webp':
+        return len(head) >= 8 and struct.unpack('<I', head[4:8])[0] + 8 <= size
+    if ext == 'bmp':
+        return len(head) >= 6 and struct.unpack('<I', head[2:6])[0] <= size
+    return True
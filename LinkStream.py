@@ -0,0 +1,67 @@
+import queue
+import threading
+
+from AsyncDownloader import AsyncDownloader
+
+
+class LinkStream:
+    # 生产者结束的标记
+    END = object()
+
+    def __init__(self, links, maxsize=256):
+        """
+        在后台线程中迭代 links (例如 CollectLinks.stream 的生成器)，通过有界队列交给下载引擎
+        队列满时生产者等待 (不再滚动页面)，所以采集快于下载时内存不会增长
+        迭代时队列为空则产出 AsyncDownloader.IDLE，不阻塞正在进行的下载
+        """
+        self.links = links
+        self.queue = queue.Queue(maxsize=max(1, int(maxsize)))
+        self.stop = threading.Event()
+        self.thread = None
+        self.produced = 0
+
+    def start(self):
+        self.thread = threading.Thread(target=self._produce, daemon=True)
+        self.thread.start()
+        return self
+
+    def _put(self, item):
+        while not self.stop.is_set():
+            try:
+                self.queue.put(item, timeout=0.2)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _produce(self):
+        try:
+            for link in self.links:
+                if not self._put(link):
+                    break
+                self.produced += 1
+        except Exception as e:
+            print('[Exception occurred while streaming links] {}'.format(e))
+        finally:
+            # 生成器在本线程中关闭，触发其 finally (例如把浏览器还给 BrowserPool)
+            close = getattr(self.links, 'close', None)
+            if close is not None:
+                close()
+            self._put(self.END)
+
+    def __iter__(self):
+        while True:
+            try:
+                item = self.queue.get_nowait()
+            except queue.Empty:
+                yield AsyncDownloader.IDLE
+                continue
+            if item is self.END:
+                return
+            yield item
+
+    def close(self):
+        """停止生产者 (下载数量达到上限时不再继续采集)"""
+        self.stop.set()
+        if self.thread is not None:
+            self.thread.join()
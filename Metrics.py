@@ -0,0 +1,284 @@
+import json
+import os
+import signal
+import threading
+import time
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from multiprocessing.managers import BaseManager
+
+# 秒，Prometheus 默认桶再加上 WebDriver 和大文件下载常见的长尾
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+PREFIX = 'autocrawler_'
+
+
+def label_key(labels):
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    escaped = ('{}="{}"'.format(key, value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+               for key, value in pairs)
+    return '{' + ','.join(escaped) + '}'
+
+
+class MetricsRegistry:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        """
+        汇总所有进程的计数器 (counter)、瞬时值 (gauge) 和直方图 (histogram)
+        通过 MetricsManager 共享时，各进程的 Metrics 定期把增量 merge 进来
+        """
+        self.buckets = tuple(buckets)
+        self.started = time.time()
+        self._lock = threading.Lock()
+        self.counters = {}  # (name, labels) -> value
+        self.gauges = {}  # (name, labels) -> value
+        self.histograms = {}  # (name, labels) -> [bucket counts + [+Inf], sum]
+
+    def merge(self, counters, gauges, histograms):
+        with self._lock:
+            for key, value in counters.items():
+                self.counters[key] = self.counters.get(key, 0) + value
+            self.gauges.update(gauges)
+            for key, (counts, total) in histograms.items():
+                if key not in self.histograms:
+                    self.histograms[key] = [[0] * (len(self.buckets) + 1), 0.0]
+                histogram = self.histograms[key]
+                histogram[0] = [a + b for a, b in zip(histogram[0], counts)]
+                histogram[1] += total
+
+    def quantile(self, counts, q):
+        """按桶线性插值估算分位数"""
+        total = sum(counts)
+        if total == 0:
+            return None
+        rank = q * total
+        cumulative = 0
+        for index, count in enumerate(counts):
+            if count and cumulative + count >= rank:
+                lower = self.buckets[index - 1] if index > 0 else 0.0
+                upper = self.buckets[index] if index < len(self.buckets) else self.buckets[-1]
+                return lower + (upper - lower) * (rank - cumulative) / count
+            cumulative += count
+        return self.buckets[-1]
+
+    def to_prometheus(self):
+        """Prometheus 文本格式 (version 0.0.4)"""
+        lines = []
+        with self._lock:
+            for kind, values in (('counter', self.counters), ('gauge', self.gauges)):
+                for name in sorted(set(name for name, _ in values)):
+                    lines.append('# TYPE {}{} {}'.format(PREFIX, name, kind))
+                    for (metric, labels), value in sorted(values.items()):
+                        if metric == name:
+                            lines.append('{}{}{} {}'.format(PREFIX, name, format_labels(labels), value))
+
+            for name in sorted(set(name for name, _ in self.histograms)):
+                lines.append('# TYPE {}{} histogram'.format(PREFIX, name))
+                for (metric, labels), (counts, total) in sorted(self.histograms.items()):
+                    if metric != name:
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(list(self.buckets) + ['+Inf'], counts):
+                        cumulative += count
+                        lines.append('{}{}_bucket{} {}'.format(PREFIX, name, format_labels(labels, [('le', str(bound))]),
+                                                               cumulative))
+                    lines.append('{}{}_sum{} {}'.format(PREFIX, name, format_labels(labels), total))
+                    lines.append('{}{}_count{} {}'.format(PREFIX, name, format_labels(labels), cumulative))
+        return '\n'.join(lines) + '\n'
+
+    def summary(self):
+        """运行结束时写入 JSON 的汇总，计数器附带平均每秒速率"""
+        with self._lock:
+            elapsed = max(1e-9, time.time() - self.started)
+            return {
+                'started': self.started,
+                'seconds': elapsed,
+                'counters': [{'name': name, 'labels': dict(labels), 'value': value, 'per_second': value / elapsed}
+                             for (name, labels), value in sorted(self.counters.items())],
+                'gauges': [{'name': name, 'labels': dict(labels), 'value': value}
+                           for (name, labels), value in sorted(self.gauges.items())],
+                'histograms': [{'name': name, 'labels': dict(labels), 'count': sum(counts), 'sum': total,
+                                'mean': total / sum(counts) if sum(counts) else None,
+                                'p50': self.quantile(counts, 0.5), 'p90': self.quantile(counts, 0.9),
+                                'p99': self.quantile(counts, 0.99)}
+                               for (name, labels), (counts, total) in sorted(self.histograms.items())],
+            }
+
+
+class Metrics:
+    _workers = {}
+    _workers_lock = threading.Lock()
+
+    # 向共享的 MetricsRegistry 提交增量的最短间隔 (秒)
+    FLUSH_INTERVAL = 1.0
+
+    def __init__(self, registry=None):
+        """
+        每个进程的指标记录器，先在本地累计，定期合并到 registry (默认是本进程内的 MetricsRegistry)
+        """
+        self.registry = registry if registry is not None else MetricsRegistry()
+        self.buckets = LATENCY_BUCKETS
+        self._lock = threading.Lock()
+        self._reset()
+        self.flushed = time.monotonic()
+
+    @classmethod
+    def for_worker(cls):
+        """每个进程共用一个实例"""
+        key = os.getpid()
+        with cls._workers_lock:
+            if key not in cls._workers:
+                cls._workers[key] = cls()
+            return cls._workers[key]
+
+    def attach(self, registry):
+        """改为提交到共享的 registry (Pool 的 initializer 中调用)"""
+        self.flush()
+        self.registry = registry
+
+    def _reset(self):
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+
+    def inc(self, name, value=1, **labels):
+        key = (name, label_key(labels))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+        self.maybe_flush()
+
+    def gauge(self, name, value, **labels):
+        # 每个进程一条，汇总时按 worker 区分
+        labels['worker'] = os.getpid()
+        with self._lock:
+            self.gauges[(name, label_key(labels))] = value
+        self.maybe_flush()
+
+    def observe(self, name, value, **labels):
+        key = (name, label_key(labels))
+        with self._lock:
+            if key not in self.histograms:
+                self.histograms[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            histogram = self.histograms[key]
+            histogram[0][bisect_left(self.buckets, value)] += 1
+            histogram[1] += value
+        self.maybe_flush()
+
+    def timer(self, name, **labels):
+        return Timer(self, name, labels)
+
+    def maybe_flush(self):
+        if time.monotonic() - self.flushed >= self.FLUSH_INTERVAL:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            counters, gauges, histograms = self.counters, self.gauges, self.histograms
+            self._reset()
+            self.flushed = time.monotonic()
+        if counters or gauges or histograms:
+            try:
+                self.registry.merge(counters, gauges, histograms)
+            except (OSError, EOFError) as e:
+                # 共享的 registry 已经关闭 (例如运行结束后)
+                print('Metrics flush failed - {}'.format(e))
+
+
+class Timer:
+    def __init__(self, metrics, name, labels):
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+        self.started = None
+
+    def __enter__(self):
+        self.started = time.monotonic()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.metrics.observe(self.name, time.monotonic() - self.started, **self.labels)
+
+
+class MetricsServer:
+    def __init__(self, registry, port=9100, host='127.0.0.1'):
+        """本地 HTTP 接口: /metrics 返回 Prometheus 文本格式，/summary 返回 JSON"""
+        self.registry = registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == '/metrics':
+                    body, content_type = registry.to_prometheus().encode(), 'text/plain; version=0.0.4'
+                elif self.path == '/summary':
+                    body, content_type = json.dumps(registry.summary()).encode(), 'application/json'
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return 'http://{}:{}/metrics'.format(host, port)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class MetricsManager(BaseManager):
+    """在独立进程中保存 MetricsRegistry，供所有工作进程共享"""
+
+
+MetricsManager.register('MetricsRegistry', MetricsRegistry)
+
+
+class MetricsRun:
+    def __init__(self, port=0, summary_path=None):
+        """
+        一次运行的指标: 启动共享的 registry，port 不为 0 时开启 HTTP 接口，结束时把汇总写入 summary_path
+        with MetricsRun(...) as registry: 把 registry 传给 Pool 的 initializer
+        """
+        self.port = port
+        self.summary_path = summary_path
+        self.manager = None
+        self.server = None
+        self.registry = None
+
+    def __enter__(self):
+        self.manager = MetricsManager()
+        self.manager.start(signal.signal, (signal.SIGINT, signal.SIG_IGN))
+        self.registry = self.manager.MetricsRegistry()
+        if self.port:
+            self.server = MetricsServer(self.registry, self.port).start()
+            print('Metrics - {}'.format(self.server.url))
+        return self.registry
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self.summary_path:
+            os.makedirs(os.path.dirname(os.path.abspath(self.summary_path)), exist_ok=True)
+            with open(self.summary_path, 'w', encoding='utf-8') as f:
+                json.dump(self.registry.summary(), f, ensure_ascii=False, indent=2)
+            print('Metrics summary - {}'.format(self.summary_path))
+        if self.server is not None:
+            self.server.stop()
+        self.manager.shutdown()
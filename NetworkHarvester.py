@@ -0,0 +1,56 @@
+import base64
+import json
+import re
+
+
+class NetworkHarvester:
+    def __init__(self, browser, url_pattern):
+        """
+        从 Chrome 的 performance 日志中找出 URL 匹配 url_pattern 的响应，通过 CDP 读取响应正文
+        浏览器需要由 BrowserPool(performance_log=True) 启动
+        """
+        self.browser = browser
+        self.url_pattern = re.compile(url_pattern)
+        self.pending = {}  # requestId -> url，响应头已收到、正文还未加载完
+        self.responses = 0
+        self.failed = 0
+
+    def drain(self):
+        """丢弃已缓存的网络事件 (打开新页面之前调用)"""
+        self.browser.get_log('performance')
+        self.pending = {}
+
+    def read_body(self, request_id):
+        result = self.browser.execute_cdp_cmd('Network.getResponseBody', {'requestId': request_id})
+        body = result.get('body', '')
+        if result.get('base64Encoded'):
+            body = base64.b64decode(body).decode('utf-8', 'replace')
+        return body
+
+    def poll(self):
+        """返回上次调用之后加载完成的匹配响应 [(url, 正文), ...]"""
+        bodies = []
+        for entry in self.browser.get_log('performance'):
+            try:
+                message = json.loads(entry['message'])['message']
+            except (KeyError, ValueError):
+                continue
+            method = message.get('method')
+            params = message.get('params', {})
+
+            if method == 'Network.responseReceived':
+                url = params.get('response', {}).get('url', '')
+                if self.url_pattern.search(url):
+                    self.pending[params['requestId']] = url
+            elif method == 'Network.loadingFinished' and params.get('requestId') in self.pending:
+                url = self.pending.pop(params['requestId'])
+                try:
+                    bodies.append((url, self.read_body(params['requestId'])))
+                    self.responses += 1
+                except Exception as e:
+                    # 页面跳转后旧请求的正文已被丢弃
+                    self.failed += 1
+                    print('Failed to read response body {} - {}'.format(url, e))
+            elif method == 'Network.loadingFailed':
+                self.pending.pop(params.get('requestId'), None)
+        return bodies
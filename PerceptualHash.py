@@ -0,0 +1,226 @@
+import argparse
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.webp', '.bmp')
+
+
+def _dct_matrix(n):
+    k = np.arange(n)
+    m = np.cos(np.pi * (2 * k[None, :] + 1) * k[:, None] / (2 * n)) * np.sqrt(2.0 / n)
+    m[0] /= np.sqrt(2.0)
+    return m
+
+
+_DCT_32 = _dct_matrix(32)
+
+
+def _pack_bits(bits):
+    """(N, 64) 的布尔矩阵转换为 N 个 64 位整数"""
+    return np.packbits(bits.reshape(len(bits), 64), axis=1).view('>u8').ravel().astype(np.uint64)
+
+
+def dhash_batch(pixels):
+    """
+    批量计算 dHash
+    pixels: (N, 8, 9) 的灰度矩阵
+    """
+    return _pack_bits(pixels[:, :, 1:] > pixels[:, :, :-1])
+
+
+def phash_batch(pixels):
+    """
+    批量计算 pHash
+    pixels: (N, 32, 32) 的灰度矩阵
+    """
+    dct = _DCT_32 @ pixels.astype(np.float64) @ _DCT_32.T
+    low = dct[:, :8, :8].reshape(len(pixels), 64)
+    # 直流分量不参与中位数计算
+    median = np.median(low[:, 1:], axis=1, keepdims=True)
+    return _pack_bits(low > median)
+
+
+HASH_METHODS = {
+    'dhash': ((9, 8), dhash_batch),
+    'phash': ((32, 32), phash_batch),
+}
+
+
+def load_gray(path, size):
+    try:
+        with Image.open(path) as img:
+            return np.asarray(img.convert('L').resize(size, Image.BILINEAR), dtype=np.int16)
+    except Exception as e:
+        print('Unreadable file - {} ({})'.format(path, e))
+        return None
+
+
+def hamming_distance(a, b):
+    return (int(a) ^ int(b)).bit_count()
+
+
+class BKTree:
+    def __init__(self):
+        """按汉明距离组织的 BK 树，用于亚线性时间的近邻查找"""
+        self.root = None
+        self.size = 0
+
+    def add(self, value, item):
+        node = [value, [item], {}]
+        if self.root is None:
+            self.root = node
+            self.size += 1
+            return
+
+        current = self.root
+        while True:
+            distance = hamming_distance(value, current[0])
+            if distance == 0:
+                current[1].append(item)
+                return
+            child = current[2].get(distance)
+            if child is None:
+                current[2][distance] = node
+                self.size += 1
+                return
+            current = child
+
+    def search(self, value, max_distance):
+        """返回 [(distance, item), ...]"""
+        results = []
+        if self.root is None:
+            return results
+
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            distance = hamming_distance(value, node[0])
+            if distance <= max_distance:
+                results.extend((distance, item) for item in node[1])
+            # 三角不等式剪枝
+            for d, child in node[2].items():
+                if distance - max_distance <= d <= distance + max_distance:
+                    stack.append(child)
+        return results
+
+
+class NearDuplicateIndex:
+    def __init__(self, index_path, method='dhash', n_workers=8, batch_size=256):
+        """
+        感知哈希近似重复索引 (增量)
+        index_path: 索引文件，每行 "hash mtime size path"，再次运行时只计算新增或修改过的文件
+        method: dhash / phash
+        """
+        self.index_path = index_path
+        self.method = method
+        self.size, self.hash_fn = HASH_METHODS[method]
+        self.n_workers = n_workers
+        self.batch_size = batch_size
+        self.entries = {}  # path -> (hash, mtime, size)
+        self.load()
+
+    def load(self):
+        if not os.path.exists(self.index_path):
+            return
+        with open(self.index_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                parts = line.rstrip('\n').split('\t', 3)
+                if len(parts) == 4:
+                    value, mtime, size, path = parts
+                    self.entries[path] = (int(value, 16), float(mtime), int(size))
+
+    def save(self):
+        tmp_path = self.index_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for path, (value, mtime, size) in self.entries.items():
+                f.write('{:016x}\t{}\t{}\t{}\n'.format(value, mtime, size, path))
+        os.replace(tmp_path, self.index_path)
+
+    @staticmethod
+    def scan(root):
+        for dirpath, _, files in os.walk(root):
+            for file in files:
+                if file.lower().endswith(IMAGE_EXTENSIONS):
+                    yield os.path.join(dirpath, file)
+
+    def update(self, root):
+        """计算 root 下新增图片的哈希，并移除已删除的文件，返回新计算的数量"""
+        seen = set()
+        todo = []
+        for path in self.scan(root):
+            seen.add(path)
+            stat = os.stat(path)
+            entry = self.entries.get(path)
+            if entry is None or entry[1] != stat.st_mtime or entry[2] != stat.st_size:
+                todo.append((path, stat.st_mtime, stat.st_size))
+
+        for path in [p for p in self.entries if p.startswith(root) and p not in seen]:
+            del self.entries[path]
+
+        with ThreadPoolExecutor(max_workers=self.n_workers) as executor:
+            for start in range(0, len(todo), self.batch_size):
+                batch = todo[start:start + self.batch_size]
+                images = list(executor.map(lambda item: load_gray(item[0], self.size), batch))
+                valid = [(item, img) for item, img in zip(batch, images) if img is not None]
+                if not valid:
+                    continue
+                hashes = self.hash_fn(np.stack([img for _, img in valid]))
+                for ((path, mtime, size), _), value in zip(valid, hashes):
+                    self.entries[path] = (int(value), mtime, size)
+                print('Hashed {} / {}'.format(min(start + self.batch_size, len(todo)), len(todo)))
+
+        self.save()
+        return len(todo)
+
+    def build_tree(self):
+        tree = BKTree()
+        for path, (value, _, _) in self.entries.items():
+            tree.add(value, path)
+        return tree
+
+    def find_duplicates(self, threshold=6):
+        """返回近似重复的分组 [[path, ...], ...]"""
+        tree = self.build_tree()
+        parent = {}
+
+        def find(x):
+            while parent.get(x, x) != x:
+                parent[x] = parent.get(parent[x], parent[x])
+                x = parent[x]
+            return x
+
+        for path, (value, _, _) in self.entries.items():
+            for _, other in tree.search(value, threshold):
+                a, b = find(path), find(other)
+                if a != b:
+                    parent[b] = a
+
+        groups = {}
+        for path in self.entries:
+            groups.setdefault(find(path), []).append(path)
+        return [sorted(group) for group in groups.values() if len(group) > 1]
+
+    def write_report(self, report_path, threshold=6):
+        groups = self.find_duplicates(threshold)
+        with open(report_path, 'w', encoding='utf-8') as f:
+            for group in groups:
+                f.write('\t'.join(group) + '\n')
+        print('Near duplicates: {} groups, {} files -> {}'
+              .format(len(groups), sum(len(g) for g in groups), report_path))
+        return groups
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('path', nargs='?', default='download/images_file', help='Image folder to index.')
+    parser.add_argument('--method', type=str, default='dhash', help='dhash or phash')
+    parser.add_argument('--threshold', type=int, default=6, help='Maximum hamming distance of near duplicates.')
+    args = parser.parse_args()
+
+    parent_dir = os.path.dirname(os.path.normpath(args.path))
+    index = NearDuplicateIndex(os.path.join(parent_dir, '{}_index.tsv'.format(args.method)), method=args.method)
+    index.update(args.path)
+    index.write_report(os.path.join(parent_dir, 'near_duplicates.txt'), threshold=args.threshold)
@@ -0,0 +1,112 @@
+import random
+import threading
+import time
+
+import requests
+from urllib3.exceptions import ProtocolError, ReadTimeoutError
+
+
+class TransientError(Exception):
+    """服务器临时错误 (500 / 502 / 504)，可以重试"""
+
+
+class RetryPolicy:
+    def __init__(self, max_retries=2, base_delay=1.0, max_delay=30.0):
+        """
+        临时错误的重试策略：指数退避 + 随机抖动 (full jitter)
+        max_retries: 每个链接最多重试次数
+        base_delay: 第一次重试的最大等待秒数，之后每次翻倍，不超过 max_delay
+        """
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    @staticmethod
+    def is_transient(error):
+        # 读取 response.raw 时 urllib3 的异常不会被 requests 包装
+        return isinstance(error, (TransientError, requests.ConnectionError, requests.Timeout,
+                                  requests.exceptions.ChunkedEncodingError, ProtocolError, ReadTimeoutError))
+
+    def backoff(self, attempt):
+        """第 attempt 次重试前的等待秒数 (attempt 从 1 开始)"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** (attempt - 1))))
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold=5, cooldown=60.0):
+        """
+        按域名熔断：连续失败 failure_threshold 次后，cooldown 秒内跳过该域名的所有链接
+        冷却结束后放行一个请求试探，成功则恢复，失败则继续熔断
+        通过 SchedulerManager 共享时，所有下载进程使用同一份状态
+        """
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self._lock = threading.Lock()
+        self.domains = {}
+
+    def _get(self, domain):
+        state = self.domains.get(domain)
+        if state is None:
+            state = {'failures': 0, 'open_until': 0.0, 'probing': False, 'failure_count': 0,
+                     'failure_seconds': 0.0, 'skipped': 0, 'saved_seconds': 0.0, 'opened': 0}
+            self.domains[domain] = state
+        return state
+
+    def allow(self, domain):
+        """熔断中返回 False，并按该域名失败请求的平均耗时累计节省的时间"""
+        if self.failure_threshold <= 0:
+            return True
+        with self._lock:
+            state = self._get(domain)
+            if state['failures'] < self.failure_threshold:
+                return True
+            if time.monotonic() >= state['open_until'] and not state['probing']:
+                state['probing'] = True
+                return True
+            state['skipped'] += 1
+            if state['failure_count']:
+                state['saved_seconds'] += state['failure_seconds'] / state['failure_count']
+            return False
+
+    def record_success(self, domain):
+        with self._lock:
+            state = self._get(domain)
+            state['failures'] = 0
+            state['probing'] = False
+
+    def release_probe(self, domain):
+        """试探请求既不算成功也不算失败时 (被限流或非临时错误) 结束试探，冷却结束后可以再放行一个"""
+        with self._lock:
+            state = self.domains.get(domain)
+            if state is not None:
+                state['probing'] = False
+
+    def record_failure(self, domain, seconds):
+        with self._lock:
+            state = self._get(domain)
+            state['failures'] += 1
+            state['failure_count'] += 1
+            state['failure_seconds'] += seconds
+            state['probing'] = False
+            if state['failures'] >= self.failure_threshold > 0:
+                if state['open_until'] <= time.monotonic():
+                    state['opened'] += 1
+                state['open_until'] = time.monotonic() + self.cooldown
+
+    def stats(self):
+        with self._lock:
+            return {domain: {'opened': state['opened'], 'skipped': state['skipped'],
+                             'saved_seconds': state['saved_seconds']}
+                    for domain, state in self.domains.items() if state['opened']}
+
+    def print_summary(self):
+        self.print_stats(self.stats())
+
+    @staticmethod
+    def print_stats(stats):
+        """stats 可以来自共享的代理，在当前进程打印"""
+        for domain, s in sorted(stats.items()):
+            print('Circuit breaker {} - opened: {}, skipped links: {}, time saved: ~{:.1f}s'
+                  .format(domain, s['opened'], s['skipped'], s['saved_seconds']))
+        if stats:
+            print('Circuit breaker - total time saved: ~{:.1f}s'.format(sum(s['saved_seconds'] for s in stats.values())))
@@ -0,0 +1,106 @@
+import os
+import sqlite3
+import threading
+import time
+
+STAGE_COLLECT = 'collect'
+STAGE_DOWNLOAD = 'download'
+
+STATUS_DONE = 'done'
+STATUS_FAILED = 'failed'
+STATUS_PENDING = 'pending'
+
+
+class RunStateStore:
+    _workers = {}
+    _workers_lock = threading.Lock()
+
+    def __init__(self, db_path):
+        """
+        记录采集/下载进度的 SQLite 数据库 (WAL 模式，多进程共用)
+        tasks: 每个 (site, keyword, stage) 的状态
+        urls: 每个 (site, keyword, url) 的下载状态，用于中断后按 URL 续传
+        """
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS tasks (
+                site TEXT NOT NULL,
+                keyword TEXT NOT NULL,
+                stage TEXT NOT NULL,
+                status TEXT NOT NULL,
+                updated REAL NOT NULL,
+                PRIMARY KEY (site, keyword, stage)
+            );
+            CREATE INDEX IF NOT EXISTS tasks_stage_status ON tasks (stage, status);
+            CREATE TABLE IF NOT EXISTS urls (
+                site TEXT NOT NULL,
+                keyword TEXT NOT NULL,
+                url TEXT NOT NULL,
+                idx INTEGER NOT NULL,
+                status TEXT NOT NULL,
+                path TEXT,
+                updated REAL NOT NULL,
+                PRIMARY KEY (site, keyword, url)
+            );
+        """)
+        self.conn.commit()
+
+    @classmethod
+    def for_worker(cls, db_path):
+        """sqlite 连接不能跨进程使用，每个进程单独打开"""
+        key = (os.getpid(), db_path)
+        with cls._workers_lock:
+            if key not in cls._workers:
+                cls._workers[key] = cls(db_path)
+            return cls._workers[key]
+
+    def _execute(self, sql, params=()):
+        with self._lock:
+            self.conn.execute(sql, params)
+            self.conn.commit()
+
+    def done_keywords(self, stage):
+        """一次查询返回某阶段已完成的 {(site, keyword), ...}"""
+        with self._lock:
+            rows = self.conn.execute('SELECT site, keyword FROM tasks WHERE stage = ? AND status = ?',
+                                     (stage, STATUS_DONE)).fetchall()
+        return set(rows)
+
+    def set_task_status(self, site, keyword, stage, status):
+        self._execute('INSERT OR REPLACE INTO tasks (site, keyword, stage, status, updated) VALUES (?, ?, ?, ?, ?)',
+                      (site, keyword, stage, status, time.time()))
+
+    def add_urls(self, site, keyword, urls):
+        """
+        登记 URL，返回 {url: 序号}
+        已存在的 URL 保持原序号和状态 (序号决定文件名，链接文件的顺序在两次运行之间可能变化)
+        新的 URL 的序号接在该关键词已有的最大序号之后
+        """
+        now = time.time()
+        with self._lock:
+            indexes = dict(self.conn.execute('SELECT url, idx FROM urls WHERE site = ? AND keyword = ?',
+                                             (site, keyword)).fetchall())
+            start = max(indexes.values(), default=-1) + 1
+            new_urls = [url for url in dict.fromkeys(urls) if url not in indexes]
+            self.conn.executemany(
+                'INSERT INTO urls (site, keyword, url, idx, status, updated) VALUES (?, ?, ?, ?, ?, ?)',
+                [(site, keyword, url, idx, STATUS_PENDING, now) for idx, url in enumerate(new_urls, start)])
+            self.conn.commit()
+        indexes.update((url, idx) for idx, url in enumerate(new_urls, start))
+        return {url: indexes[url] for url in urls}
+
+    def url_status(self, site, keyword):
+        """返回 {url: (status, 序号)}"""
+        with self._lock:
+            rows = self.conn.execute('SELECT url, status, idx FROM urls WHERE site = ? AND keyword = ?',
+                                     (site, keyword)).fetchall()
+        return {url: (status, idx) for url, status, idx in rows}
+
+    def mark_url(self, site, keyword, url, status, path=None):
+        self._execute('UPDATE urls SET status = ?, path = ?, updated = ? WHERE site = ? AND keyword = ? AND url = ?',
+                      (status, path, time.time(), site, keyword, url))
@@ -0,0 +1,135 @@
+import time
+
+# 滚动一步: 滚到页面底部触发站点的无限加载，在页面内用 MutationObserver 等待结果节点增加
+# 节点一增加就立即返回，超时仍未增加时返回 grew: false；整个等待只需要一次 WebDriver 请求
+SCROLL_STEP_FUNCTION = '''
+function scrollStep(xpath, timeout, nudge, loadMore, done) {
+function count() {
+    return document.evaluate('count(' + xpath + ')', document, null, XPathResult.NUMBER_TYPE, null).numberValue;
+}
+var before = count(), finished = false, scheduled = false, timer = null;
+var observer = new MutationObserver(function () {
+    // 新节点通常成批插入，合并检查
+    if (scheduled || finished) return;
+    scheduled = true;
+    setTimeout(function () { scheduled = false; if (count() > before) finish(true); }, 50);
+});
+function finish(grew) {
+    if (finished) return;
+    finished = true;
+    observer.disconnect();
+    clearTimeout(timer);
+    var root = document.scrollingElement || document.documentElement;
+    done({count: count(), grew: grew, bottom: root.scrollTop + window.innerHeight >= root.scrollHeight - 2});
+}
+observer.observe(document.body, {childList: true, subtree: true});
+timer = setTimeout(function () { finish(false); }, timeout);
+
+var root = document.scrollingElement || document.documentElement;
+if (loadMore) {
+    var button = document.evaluate(loadMore, document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue;
+    if (button && button.offsetParent !== null) button.click();
+}
+if (nudge) {
+    // 部分站点只在滚动事件中检查是否需要加载: 先向上再回到底部
+    window.scrollBy(0, -2 * window.innerHeight);
+    setTimeout(function () { window.scrollTo(0, root.scrollHeight); }, 100);
+} else {
+    window.scrollTo(0, root.scrollHeight);
+}
+}
+'''
+
+SCROLL_STEP_JS = SCROLL_STEP_FUNCTION + '''
+scrollStep(arguments[0], arguments[1], arguments[2], arguments[3], arguments[arguments.length - 1]);
+'''
+
+# 不等待结果的版本: 开始一步后立即返回，结果保存在页面中，之后用 POLL_SCROLL_STEP_JS 读取
+# 多个标签页轮流开始和读取，一个标签页等待加载时其他标签页继续滚动
+START_SCROLL_STEP_JS = SCROLL_STEP_FUNCTION + '''
+window.__autocrawlerScrollStep = null;
+scrollStep(arguments[0], arguments[1], arguments[2], arguments[3], function (state) {
+    window.__autocrawlerScrollStep = state;
+});
+'''
+
+POLL_SCROLL_STEP_JS = 'return window.__autocrawlerScrollStep || null;'
+
+
+class ScrollState:
+    def __init__(self, result_xpath, limit=0, load_more_xpath=None):
+        """一个页面的滚动进度，由 ScrollEngine.update 更新"""
+        self.result_xpath = result_xpath
+        self.limit = limit
+        self.load_more_xpath = load_more_xpath
+        self.started = time.time()
+        self.count = 0
+        self.stalls = 0
+        self.steps = 0
+        self.done = False
+
+
+class ScrollEngine:
+    def __init__(self, driver, growth_timeout=3.0, patience=2, max_steps=500, max_seconds=300):
+        """
+        事件驱动的无限滚动，代替固定间隔的 PAGE_DOWN + sleep 循环
+        growth_timeout: 每一步等待新结果的最长时间 (秒)
+        patience: 连续多少步没有新结果时结束 (之后的步骤会先向上滚动或点击 "加载更多" 再重试)
+        max_steps / max_seconds: 滚动步数和总时间的上限
+        """
+        self.driver = driver
+        self.growth_timeout = growth_timeout
+        self.patience = patience
+        self.max_steps = max_steps
+        self.max_seconds = max_seconds
+
+    def step_args(self, scroll):
+        # 上一步没有新结果时，先向上滚动或点击 "加载更多" 再重试
+        return (scroll.result_xpath, int(self.growth_timeout * 1000), scroll.stalls > 0,
+                scroll.load_more_xpath if scroll.stalls > 0 else None)
+
+    def update(self, scroll, state):
+        """记录一步的结果，结束时设置 scroll.done"""
+        scroll.steps += 1
+        scroll.count = int(state['count'])
+        if state['grew']:
+            scroll.stalls = 0
+        else:
+            scroll.stalls += 1
+        scroll.done = (0 < scroll.limit <= scroll.count or scroll.stalls >= self.patience or
+                       scroll.steps >= self.max_steps or time.time() - scroll.started >= self.max_seconds)
+        if scroll.done:
+            print('Scrolled {} steps in {:.1f}s, {} results'.format(scroll.steps, time.time() - scroll.started,
+                                                                     scroll.count))
+
+    def start_step(self, scroll):
+        """在当前标签页开始一步，不等待结果"""
+        self.driver.execute_script(START_SCROLL_STEP_JS, *self.step_args(scroll))
+
+    def poll_step(self, scroll):
+        """读取当前标签页的这一步是否结束，结束时更新 scroll 并返回 True"""
+        state = self.driver.execute_script(POLL_SCROLL_STEP_JS)
+        if state is None:
+            return False
+        self.update(scroll, state)
+        return True
+
+    def steps(self, result_xpath, limit=0, load_more_xpath=None):
+        """
+        每滚动一步返回当前的结果节点数 (生成器)，结果不再增加 (或达到 limit 个) 时结束
+        result_xpath: 结果节点的 XPath
+        load_more_xpath: 没有新结果时点击的 "加载更多" 按钮
+        """
+        self.driver.set_script_timeout(self.growth_timeout + 10)
+        scroll = ScrollState(result_xpath, limit, load_more_xpath)
+        while not scroll.done:
+            state = self.driver.execute_async_script(SCROLL_STEP_JS, *self.step_args(scroll))
+            self.update(scroll, state)
+            yield scroll.count
+
+    def scroll(self, result_xpath, limit=0, load_more_xpath=None):
+        """一直滚动到结果节点不再增加 (或达到 limit 个)，返回结果节点数"""
+        count = 0
+        for count in self.steps(result_xpath, limit, load_more_xpath):
+            pass
+        return count
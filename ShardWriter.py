@@ -0,0 +1,177 @@
+import argparse
+import io
+import json
+import os
+import tarfile
+import threading
+import time
+from collections import defaultdict
+
+INDEX_FILE = 'index.tsv'
+
+
+class ShardWriter:
+    _workers = {}
+    _workers_lock = threading.Lock()
+
+    def __init__(self, root, prefix='shard', max_bytes=1024 ** 3):
+        """
+        把图片写入大小有上限的 tar 分片 (WebDataset 格式)，避免产生大量小文件
+        每个样本是两个相邻的成员: <key>.<ext> 和 <key>.json (来源 URL、站点、关键词、格式)
+        每写入一个样本向 root/index.tsv 追加一行，记录分片名和数据偏移，读取时不需要扫描分片
+        max_bytes: 单个分片的大小上限
+        """
+        self.root = root
+        self.prefix = prefix
+        self.max_bytes = max_bytes
+        os.makedirs(root, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self.file = None
+        self.tar = None
+        self.shard_name = None
+        self.shard_number = 0
+        self.end_offset = 0  # 结束块之前的位置，close 之后从这里继续追加
+        self.samples = 0
+        self.bytes_written = 0
+
+    @classmethod
+    def for_worker(cls, root, max_bytes=1024 ** 3):
+        """每个进程写自己的分片，文件名中带进程号"""
+        key = (os.getpid(), root)
+        with cls._workers_lock:
+            if key not in cls._workers:
+                cls._workers[key] = cls(root, 'shard-{}'.format(os.getpid()), max_bytes)
+            return cls._workers[key]
+
+    def _next_shard(self):
+        # 进程号可能和以前的运行重复，跳过已存在的分片
+        while True:
+            name = '{}-{:06d}.tar'.format(self.prefix, self.shard_number)
+            self.shard_number += 1
+            if not os.path.exists(os.path.join(self.root, name)):
+                return name
+
+    def _open(self):
+        if self.shard_name is not None and self.end_offset < self.max_bytes:
+            # 继续写上次 close 的分片: 覆盖结束块
+            self.file = open(os.path.join(self.root, self.shard_name), 'r+b')
+            self.file.seek(self.end_offset)
+            self.file.truncate()
+        else:
+            self.shard_name = self._next_shard()
+            self.file = open(os.path.join(self.root, self.shard_name), 'wb')
+            self.end_offset = 0
+        self.tar = tarfile.open(fileobj=self.file, mode='w', format=tarfile.PAX_FORMAT)
+
+    def _add_member(self, name, fileobj, size):
+        info = tarfile.TarInfo(name)
+        info.size = size
+        info.mtime = int(time.time())
+        self.tar.addfile(info, fileobj)
+        # 写入模式下 offset_data 不会被设置: 数据在补齐到 512 字节的块之前
+        return self.tar.offset - (size + tarfile.BLOCKSIZE - 1) // tarfile.BLOCKSIZE * tarfile.BLOCKSIZE
+
+    def add(self, key, ext, fileobj, size, meta):
+        """写入一个样本，返回 "<分片名>#<key>" """
+        with self._lock:
+            if self.tar is None:
+                self._open()
+            elif self.end_offset + size > self.max_bytes and self.end_offset > 0:
+                self._close()
+                self.shard_name = None
+                self._open()
+
+            offset = self._add_member('{}.{}'.format(key, ext), fileobj, size)
+            meta_bytes = json.dumps(meta, ensure_ascii=False).encode('utf-8')
+            meta_offset = self._add_member('{}.json'.format(key), io.BytesIO(meta_bytes), len(meta_bytes))
+            self.file.flush()
+            self.end_offset = self.tar.offset
+
+            # 单次 write 追加一行，多个进程共用同一个索引文件
+            line = '\t'.join([key, self.shard_name, str(offset), str(size), ext, str(meta_offset),
+                              str(len(meta_bytes)), meta.get('site', ''), meta.get('keyword', '')]) + '\n'
+            with open(os.path.join(self.root, INDEX_FILE), 'a', encoding='utf-8') as f:
+                f.write(line)
+
+            self.samples += 1
+            self.bytes_written += size
+            return '{}#{}'.format(self.shard_name, key)
+
+    def add_file(self, key, ext, path, meta):
+        with open(path, 'rb') as f:
+            return self.add(key, ext, f, os.path.getsize(path), meta)
+
+    def _close(self):
+        if self.tar is not None:
+            self.tar.close()
+            self.file.close()
+            self.tar = None
+            self.file = None
+
+    def close(self):
+        """写入结束块，分片成为完整的 tar 文件；之后再写入时继续追加到同一个分片"""
+        with self._lock:
+            self._close()
+
+    def print_summary(self):
+        with self._lock:
+            print('Shards - samples: {}, bytes written: {}, current shard: {}'
+                  .format(self.samples, self.bytes_written, self.shard_name))
+
+
+class ShardIndex:
+    FIELDS = ('key', 'shard', 'offset', 'size', 'ext', 'meta_offset', 'meta_size', 'site', 'keyword')
+
+    def __init__(self, root):
+        """读取 index.tsv，按 key 随机读取分片中的样本"""
+        self.root = root
+        self.entries = {}
+        with open(os.path.join(root, INDEX_FILE), 'r', encoding='utf-8') as f:
+            for line in f:
+                values = line.rstrip('\n').split('\t')
+                if len(values) == len(self.FIELDS):
+                    entry = dict(zip(self.FIELDS, values))
+                    for field in ('offset', 'size', 'meta_offset', 'meta_size'):
+                        entry[field] = int(entry[field])
+                    # 同一个 key 重新下载时以最后一行为准
+                    self.entries[entry['key']] = entry
+
+    def _read(self, shard, offset, size):
+        with open(os.path.join(self.root, shard), 'rb') as f:
+            f.seek(offset)
+            return f.read(size)
+
+    def read(self, key):
+        """返回 (图片字节, 元数据)"""
+        entry = self.entries[key]
+        data = self._read(entry['shard'], entry['offset'], entry['size'])
+        meta = json.loads(self._read(entry['shard'], entry['meta_offset'], entry['meta_size']))
+        return data, meta
+
+    def counts(self):
+        """{(site, keyword): 图片数}"""
+        counts = defaultdict(int)
+        for entry in self.entries.values():
+            counts[(entry['site'], entry['keyword'])] += 1
+        return counts
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('root', type=str, help='Shard directory, like: download/images_shards')
+    parser.add_argument('--extract', type=str, default='', help='Key of a sample to write to the current directory.')
+    args = parser.parse_args()
+
+    index = ShardIndex(args.root)
+    if args.extract:
+        data, meta = index.read(args.extract)
+        file_name = '{}.{}'.format(args.extract.replace('/', '_'), meta['format'])
+        with open(file_name, 'wb') as f:
+            f.write(data)
+        print('{} - {}'.format(file_name, meta))
+    else:
+        for (site, keyword), count in sorted(index.counts().items()):
+            print('{}\t{}\t{}'.format(site, keyword, count))
+        print('{} samples in {} shards'.format(len(index.entries),
+                                               len(set(e['shard'] for e in index.entries.values()))))
@@ -0,0 +1,105 @@
+import os
+import threading
+
+from ImageHeader import HEAD_SIZE, PROBE_SIZE, probe_image_size
+
+
+class ImageTooLarge(Exception):
+    """没有 Content-Length 的响应在读取中超过 max_bytes"""
+
+
+class LimitedStream:
+    def __init__(self, size_filter, link, stream, bytes_read):
+        """读取 stream 时累计字节数，超过 size_filter.max_bytes 时记录跳过并抛出 ImageTooLarge"""
+        self.size_filter = size_filter
+        self.link = link
+        self.stream = stream
+        self.bytes_read = bytes_read
+
+    def read(self, size=-1):
+        chunk = self.stream.read(size)
+        self.bytes_read += len(chunk)
+        if self.bytes_read > self.size_filter.max_bytes:
+            self.size_filter._skip(self.link, 'too large (over {} bytes)'.format(self.size_filter.max_bytes),
+                                   self.bytes_read, 0)
+            raise ImageTooLarge(self.link)
+        return chunk
+
+
+class SizeFilter:
+    _workers = {}
+    _workers_lock = threading.Lock()
+
+    def __init__(self, min_width=0, min_height=0, max_bytes=0):
+        """
+        下载前按尺寸过滤图片 (0: 不限)
+        max_bytes 有 Content-Length 时在读取 body 之前判断，没有时在读取中超过即断开 (limit_stream)
+        min_width / min_height 根据文件开头几 KB 解析出的宽高判断，不满足时立即断开
+        """
+        self.min_width = min_width
+        self.min_height = min_height
+        self.max_bytes = max_bytes
+
+        self._lock = threading.Lock()
+        self.skipped = 0
+        self.bytes_read = 0
+        self.bytes_saved = 0
+
+    @classmethod
+    def for_worker(cls, min_width=0, min_height=0, max_bytes=0):
+        """每个进程共用一个实例"""
+        key = (os.getpid(), min_width, min_height, max_bytes)
+        with cls._workers_lock:
+            if key not in cls._workers:
+                cls._workers[key] = cls(min_width, min_height, max_bytes)
+            return cls._workers[key]
+
+    def read_head(self, stream):
+        """读取文件开头；需要检查宽高时继续读取，直到能解析出宽高或达到 PROBE_SIZE"""
+        head = stream.read(HEAD_SIZE)
+        if self.min_width <= 0 and self.min_height <= 0:
+            return head
+        while len(head) < PROBE_SIZE and probe_image_size(head) is None:
+            chunk = stream.read(min(4096, PROBE_SIZE - len(head)))
+            if not chunk:
+                break
+            head += chunk
+        return head
+
+    def _skip(self, link, reason, bytes_read, content_length):
+        with self._lock:
+            self.skipped += 1
+            self.bytes_read += bytes_read
+            if content_length > bytes_read:
+                self.bytes_saved += content_length - bytes_read
+        print('Skipped {} - {}'.format(reason, link))
+
+    def reject_length(self, link, content_length):
+        if 0 < self.max_bytes < content_length:
+            self._skip(link, 'too large ({} bytes)'.format(content_length), 0, content_length)
+            return True
+        return False
+
+    def limit_stream(self, link, stream, bytes_read=0):
+        """bytes_read: 已经从 stream 读取的字节数 (文件开头)"""
+        if self.max_bytes <= 0:
+            return stream
+        return LimitedStream(self, link, stream, bytes_read)
+
+    def reject_dimensions(self, link, head, content_length):
+        if self.min_width <= 0 and self.min_height <= 0:
+            return False
+        size = probe_image_size(head)
+        if size is None:
+            # 无法解析时交给后续的过滤
+            return False
+        width, height = size
+        if width < self.min_width or height < self.min_height:
+            self._skip(link, 'too small ({}x{})'.format(width, height), len(head), content_length)
+            return True
+        return False
+
+    def print_summary(self):
+        with self._lock:
+            print('Size filter - skipped: {}, bytes read from skipped: {}, bytes saved: {}'
+                  .format(self.skipped, self.bytes_read, self.bytes_saved))
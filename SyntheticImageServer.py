@@ -0,0 +1,260 @@
+import argparse
+import io
+import json
+import random
+import struct
+import sys
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def make_png(width, height, seed=0):
+    """生成一张随机噪声 PNG 图片 (8 位灰度)"""
+    rng = random.Random(seed)
+
+    def chunk(tag, data):
+        return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', zlib.crc32(tag + data) & 0xffffffff)
+
+    raw = b''.join(b'\x00' + rng.randbytes(width) for _ in range(height))
+    return (b'\x89PNG\r\n\x1a\n' +
+            chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 0, 0, 0, 0)) +
+            chunk(b'IDAT', zlib.compress(raw)) +
+            chunk(b'IEND', b''))
+
+
+CONTENT_TYPES = {'png': 'image/png', 'jpg': 'image/jpeg', 'jpeg': 'image/jpeg', 'gif': 'image/gif'}
+
+
+def make_image(ext, width, height, seed=0):
+    """按扩展名生成 PNG / JPEG / GIF 随机噪声图片"""
+    if ext == 'png':
+        return make_png(width, height, seed)
+    # JPEG 和 GIF 的编码交给 Pillow，只在请求这两种格式时需要
+    from PIL import Image
+
+    rng = random.Random(seed)
+    image = Image.frombytes('L', (width, height), rng.randbytes(width * height))
+    buffer = io.BytesIO()
+    image.save(buffer, 'JPEG' if ext in ('jpg', 'jpeg') else 'GIF', quality=90)
+    return buffer.getvalue()
+
+
+class QuietHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # 客户端提前断开连接 (例如读到 HTML 错误页后放弃) 不算错误
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class SyntheticImageServer:
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, image_size=(64, 64), html_rate=0.0, html_size=32 * 1024,
+                 rate_limit=0.0, error_rate=0.0, truncate_rate=0.0, bandwidth=0):
+        """
+        本地合成图片服务器，用于离线压测下载流程
+        latency: 每个请求注入的延迟 (秒)
+        image_size: 生成图片的宽高
+        html_rate: 返回 HTML 错误页 (200 text/html) 的比例
+        html_size: HTML 错误页大小 (字节)
+        rate_limit: 每秒允许的请求数，超出时返回 429 (0: 不限)
+        error_rate: 随机返回 502 的比例，同一张图片重试后可能成功
+        truncate_rate: 随机只发送一半图片数据就断开连接的比例
+        bandwidth: 每个响应的发送速度上限 (字节/秒，0: 不限)
+        图片支持 Range 请求 (bytes=N-) 和 If-Range
+        访问 /img/<n>.<png|jpg|gif> 返回第 n 张对应格式的图片 (带 ETag，If-None-Match 相同时返回 304)
+        访问 /stats 返回统计数据
+        """
+        self.latency = latency
+        self.image_size = image_size
+        self.html_rate = html_rate
+        self.html_size = html_size
+        self.rate_limit = rate_limit
+        self.error_rate = error_rate
+        self.truncate_rate = truncate_rate
+        self.bandwidth = bandwidth
+        self.truncated_count = 0
+        self.range_count = 0
+        self.error_count = 0
+        self.not_modified_count = 0
+        self.request_count = 0
+        self.throttled_count = 0
+        self.bytes_sent = 0
+        self._window = (0, 0)  # (second, request count)
+        self._lock = threading.Lock()
+        self._cache = {}
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                server.handle(self)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = QuietHTTPServer((host, port), Handler)
+        self.thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return 'http://{}:{}'.format(host, port)
+
+    def url(self, n, ext='png'):
+        return '{}/img/{}.{}'.format(self.base_url, n, ext)
+
+    def get_image(self, n, ext='png'):
+        with self._lock:
+            if (n, ext) not in self._cache:
+                self._cache[(n, ext)] = make_image(ext, self.image_size[0], self.image_size[1], seed=n)
+            return self._cache[(n, ext)]
+
+    def is_throttled(self):
+        with self._lock:
+            second = int(time.time())
+            count = self._window[1] + 1 if self._window[0] == second else 1
+            self._window = (second, count)
+            if 0 < self.rate_limit < count:
+                self.throttled_count += 1
+                return True
+            return False
+
+    def send_body(self, request, status, content_type, body, headers=None, truncate=False):
+        request.send_response(status)
+        request.send_header('Content-Type', content_type)
+        request.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            request.send_header(key, value)
+        request.end_headers()
+        if truncate:
+            # Content-Length 不变，发送一半后断开
+            body = body[:len(body) // 2]
+            request.close_connection = True
+        try:
+            if self.bandwidth > 0:
+                # 按带宽分块发送
+                step = max(1024, int(self.bandwidth / 20))
+                for offset in range(0, len(body), step):
+                    request.wfile.write(body[offset:offset + step])
+                    time.sleep(len(body[offset:offset + step]) / self.bandwidth)
+            else:
+                request.wfile.write(body)
+        except ConnectionError:
+            return
+        with self._lock:
+            self.bytes_sent += len(body)
+
+    def stats(self):
+        with self._lock:
+            return {'requests': self.request_count, 'throttled': self.throttled_count, 'errors': self.error_count,
+                    'not_modified': self.not_modified_count, 'truncated': self.truncated_count,
+                    'ranges': self.range_count, 'bytes_sent': self.bytes_sent}
+
+    def handle(self, request):
+        if request.path == '/stats':
+            self.send_body(request, 200, 'application/json', json.dumps(self.stats()).encode())
+            return
+
+        with self._lock:
+            self.request_count += 1
+
+        if self.is_throttled():
+            self.send_body(request, 429, 'text/plain', b'Too Many Requests', {'Retry-After': '1'})
+            return
+
+        if self.latency > 0:
+            time.sleep(self.latency)
+
+        if random.random() < self.error_rate:
+            with self._lock:
+                self.error_count += 1
+            self.send_body(request, 502, 'text/plain', b'Bad Gateway')
+            return
+
+        name, _, ext = request.path.split('/')[-1].partition('.')
+        ext = ext or 'png'
+        try:
+            n = int(name)
+        except ValueError:
+            request.send_error(404)
+            return
+        if ext not in CONTENT_TYPES:
+            request.send_error(404)
+            return
+        content_type = CONTENT_TYPES[ext]
+
+        if random.Random(n).random() < self.html_rate:
+            body = b'<html>' + b' ' * max(0, self.html_size - 13) + b'</html>'
+            self.send_body(request, 200, 'text/html', body)
+            return
+
+        etag = '"{}-{}-{}x{}"'.format(n, ext, *self.image_size)
+        if request.headers.get('If-None-Match') == etag:
+            with self._lock:
+                self.not_modified_count += 1
+            self.send_body(request, 304, content_type, b'', {'ETag': etag})
+            return
+
+        body, status, headers = self.get_image(n, ext), 200, {'ETag': etag, 'Accept-Ranges': 'bytes'}
+        byte_range = request.headers.get('Range', '')
+        if byte_range.startswith('bytes=') and request.headers.get('If-Range') in (None, etag):
+            start = int(byte_range[6:].split('-')[0])
+            if start >= len(body):
+                self.send_body(request, 416, 'text/plain', b'Range Not Satisfiable',
+                               {'Content-Range': 'bytes */{}'.format(len(body))})
+                return
+            with self._lock:
+                self.range_count += 1
+            headers['Content-Range'] = 'bytes {}-{}/{}'.format(start, len(body) - 1, len(body))
+            body, status = body[start:], 206
+
+        truncate = random.random() < self.truncate_rate
+        if truncate:
+            with self._lock:
+                self.truncated_count += 1
+        self.send_body(request, status, content_type, body, headers, truncate=truncate)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--port', type=int, default=8000, help='Port to listen on. (0: any free port)')
+    parser.add_argument('--latency', type=float, default=0.2, help='Injected latency per request (seconds).')
+    parser.add_argument('--html-rate', type=float, default=0.0, help='Fraction of responses that are HTML error pages.')
+    parser.add_argument('--rate-limit', type=float, default=0.0, help='Requests per second before 429. (0: unlimited)')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of responses that are 502 errors.')
+    parser.add_argument('--truncate-rate', type=float, default=0.0,
+                        help='Fraction of image responses cut off after half of the body.')
+    parser.add_argument('--image-size', type=int, default=64, help='Width and height of the generated images.')
+    parser.add_argument('--bandwidth', type=int, default=0,
+                        help='Maximum bytes per second sent for each response. (0: unlimited)')
+    args = parser.parse_args()
+
+    with SyntheticImageServer(port=args.port, latency=args.latency, html_rate=args.html_rate,
+                              rate_limit=args.rate_limit, error_rate=args.error_rate, truncate_rate=args.truncate_rate,
+                              image_size=(args.image_size, args.image_size), bandwidth=args.bandwidth) as server:
+        # The first line is read by benchmark_download.py
+        print(server.base_url, flush=True)
+        try:
+            server.thread.join()
+        except KeyboardInterrupt:
+            pass
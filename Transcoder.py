@@ -0,0 +1,151 @@
+import multiprocessing
+import os
+import queue
+import signal
+import time
+
+# 共享计数器的下标
+ENQUEUED, PUT_WAIT, DONE, FAILED, BUSY, GET_WAIT, BYTES_IN, BYTES_OUT = range(8)
+
+FORMATS = {'webp': ('WEBP', 'webp'), 'jpeg': ('JPEG', 'jpg'), 'jpg': ('JPEG', 'jpg')}
+
+
+def transcode_image(src_path, dest_path, max_edge=1024, fmt='webp', quality=90):
+    """缩放到最长边不超过 max_edge 并重新编码，返回输出文件大小"""
+    # Pillow 只在这个阶段需要
+    from PIL import Image
+
+    pil_format = FORMATS[fmt][0]
+    with Image.open(src_path) as image:
+        if max_edge > 0:
+            # JPEG 可以直接按 1/2、1/4、1/8 解码，缩小大图时省去大部分解码时间
+            image.draft('RGB', (max_edge, max_edge))
+            image.thumbnail((max_edge, max_edge), Image.LANCZOS)
+        if pil_format == 'JPEG' and image.mode != 'RGB':
+            image = image.convert('RGB')
+        elif image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA' if 'A' in image.getbands() or 'transparency' in image.info else 'RGB')
+
+        os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+        temp_path = dest_path + '.tmp'
+        image.save(temp_path, pil_format, quality=quality)
+        os.replace(temp_path, dest_path)
+    return os.path.getsize(dest_path)
+
+
+def transcode_worker(tasks, counters, max_edge, fmt, quality):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    while True:
+        t1 = time.time()
+        task = tasks.get()
+        t2 = time.time()
+        if task is None:
+            break
+        src_path, dest_path = task
+        try:
+            size = transcode_image(src_path, dest_path, max_edge, fmt, quality)
+            done = (DONE, BYTES_IN, BYTES_OUT), (1, os.path.getsize(src_path), size)
+        except Exception as e:
+            print('Transcode failed - {} {}'.format(src_path, e))
+            done = (FAILED,), (1,)
+        with counters.get_lock():
+            counters[GET_WAIT] += t2 - t1
+            counters[BUSY] += time.time() - t2
+            for index, value in zip(*done):
+                counters[index] += value
+
+
+class TranscodeStage:
+    # 下载进程中由 Pool 的 initializer 设置
+    _tasks = None
+    _counters = None
+
+    def __init__(self, n_workers=2, max_edge=1024, fmt='webp', quality=90, queue_size=256):
+        """
+        下载后的缩放/转码阶段，在独立的进程池中与下载并行执行
+        必须在主进程中创建: Pool 的工作进程是 daemon 进程，不能再创建子进程
+        队列有上限 (queue_size)，转码跟不上时下载进程在 submit 处等待，内存占用不会增长
+        """
+        self.n_workers = n_workers
+        self.max_edge = max_edge
+        self.fmt = fmt
+        self.quality = quality
+        self.tasks = multiprocessing.Queue(maxsize=queue_size)
+        self.counters = multiprocessing.Array('d', 8)
+        self.processes = []
+        self.started = None
+
+    @staticmethod
+    def extension(fmt):
+        return FORMATS[fmt][1]
+
+    def start(self):
+        self.started = time.time()
+        for _ in range(self.n_workers):
+            process = multiprocessing.Process(target=transcode_worker,
+                                              args=(self.tasks, self.counters, self.max_edge, self.fmt, self.quality))
+            process.start()
+            self.processes.append(process)
+        return self
+
+    def stop(self):
+        """等待队列中的任务全部完成"""
+        for _ in self.processes:
+            self.tasks.put(None)
+        for process in self.processes:
+            process.join()
+        self.processes = []
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    @classmethod
+    def attach(cls, tasks, counters):
+        cls._tasks = tasks
+        cls._counters = counters
+
+    @classmethod
+    def submit(cls, src_path, dest_path):
+        """队列已满时阻塞，返回 False 表示当前进程没有连接到转码阶段"""
+        if cls._tasks is None:
+            return False
+        t1 = time.time()
+        try:
+            cls._tasks.put((src_path, dest_path), timeout=600)
+        except queue.Full:
+            print('Transcode queue is stuck, skipped - {}'.format(src_path))
+            return False
+        with cls._counters.get_lock():
+            cls._counters[ENQUEUED] += 1
+            cls._counters[PUT_WAIT] += time.time() - t1
+        return True
+
+    @classmethod
+    def queue_depth(cls):
+        """等待转码的图片数，平台不支持时返回 -1"""
+        try:
+            return cls._tasks.qsize()
+        except (AttributeError, NotImplementedError):
+            return -1
+
+    def stats(self):
+        with self.counters.get_lock():
+            counters = list(self.counters)
+        elapsed = max(1e-9, time.time() - self.started) if self.started else 1e-9
+        return {'enqueued': int(counters[ENQUEUED]), 'done': int(counters[DONE]), 'failed': int(counters[FAILED]),
+                'enqueue_per_sec': counters[ENQUEUED] / elapsed, 'done_per_sec': counters[DONE] / elapsed,
+                'producer_wait_seconds': counters[PUT_WAIT],
+                'worker_utilization': counters[BUSY] / (elapsed * max(1, self.n_workers)),
+                'worker_idle_seconds': counters[GET_WAIT],
+                'bytes_in': int(counters[BYTES_IN]), 'bytes_out': int(counters[BYTES_OUT])}
+
+    def print_summary(self):
+        stats = self.stats()
+        print('Transcode - enqueued: {enqueued} ({enqueue_per_sec:.1f}/s), done: {done} ({done_per_sec:.1f}/s), '
+              'failed: {failed}, bytes in/out: {bytes_in}/{bytes_out}'.format(**stats))
+        # 下载进程等待时间长: 转码是瓶颈，增加 --transcode-workers；转码进程空闲时间长: 下载是瓶颈
+        print('Transcode - download side waited {producer_wait_seconds:.1f}s on a full queue, '
+              'workers busy {worker_utilization:.0%}, idle {worker_idle_seconds:.1f}s'.format(**stats))
@@ -0,0 +1,335 @@
+import argparse
+import html
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from selenium.webdriver.common.by import By
+from selenium.webdriver.common.keys import Keys
+
+from BrowserPool import BrowserPool
+from HarvestFixtureServer import HarvestFixtureServer
+from ScrollEngine import ScrollEngine
+from SyntheticImageServer import SyntheticImageServer
+from collect_links import EXTRACT_ATTRIBUTES_JS, PEXELS_SIZE, RESULT_SELECTORS, CollectLinks
+
+# 每个站点一个结果节点的标记，与 RESULT_SELECTORS 中的 XPath 对应
+FIXTURE_ITEMS = {
+    'google': '<div class="eA0Zlc"><img class="YQ4gaf" src="https://example.com/google/{i}.jpg"></div>',
+    'naver': '<div class="tile_item _fe_image_tab_content_tile"><img class="_fe_image_tab_content_thumbnail_image" '
+             'src="https://search.pstatic.net/common/?src=https%3A%2F%2Fexample.com%2Fnaver%2F{i}.jpg&amp;type=a340">'
+             '</div>',
+    'bing': '<div class="imgpt"><a class="iusc" m="{m}" href="/images/search?view=detailV2&amp;id={i}"></a></div>',
+    'pexels': '<a href="/photo/{i}/"><img class="spacing_noMargin__F5u9R" '
+              'src="https://images.pexels.com/photos/{i}/pexels-photo-{i}.jpeg?auto=compress&amp;w=500"></a>',
+}
+
+
+def write_fixtures(directory, count):
+    """生成每个站点含 count 个结果的 HTML 页面，返回 {站点: 文件路径}"""
+    paths = {}
+    for site, item in FIXTURE_ITEMS.items():
+        items = []
+        for i in range(count):
+            m = html.escape(json.dumps({'murl': 'https://example.com/bing/{}.jpg'.format(i),
+                                        'turl': 'https://tse1.mm.bing.net/th?id={}'.format(i)}))
+            items.append(item.format(i=i, m=m))
+        path = os.path.join(directory, '{}.html'.format(site))
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write('<!DOCTYPE html><html><body>{}</body></html>'.format('\n'.join(items)))
+        paths[site] = path
+    return paths
+
+
+# 无限滚动页面: 接近底部时延迟 delay 毫秒追加一批结果，直到 total 个，第 i 张图片的地址是 prefix + i + suffix
+INFINITE_SCROLL_PAGE = '''<!DOCTYPE html><html><head><style>img {{ display: block; height: 200px; }}</style></head>
+<body><div id="results"></div><script>
+var total = {total}, batch = {batch}, loaded = 0, loading = false;
+function load() {{
+    var html = '';
+    for (var i = loaded; i < Math.min(total, loaded + batch); i++) {{
+        html += '<div class="eA0Zlc"><img class="YQ4gaf" src="{prefix}' + i + '{suffix}"></div>';
+    }}
+    document.getElementById('results').insertAdjacentHTML('beforeend', html);
+    loaded = Math.min(total, loaded + batch);
+}}
+load();
+window.addEventListener('scroll', function () {{
+    if (loading || loaded >= total) return;
+    if (window.innerHeight + window.scrollY >= document.body.scrollHeight - 400) {{
+        loading = true;
+        setTimeout(function () {{ load(); loading = false; }}, {delay});
+    }}
+}});
+</script></body></html>'''
+
+
+def scroll_fixed_sleep(browser):
+    """原来 google 的滚动循环: PAGE_DOWN 后固定等待 0.2 秒，连续 50 次位置不变时结束"""
+    elem = browser.find_element(By.TAG_NAME, "body")
+    last_scroll = 0
+    scroll_patience = 0
+    while scroll_patience < 50:
+        elem.send_keys(Keys.PAGE_DOWN)
+        time.sleep(0.2)
+        scroll = browser.execute_script("return window.pageYOffset;")
+        if scroll == last_scroll:
+            scroll_patience += 1
+        else:
+            scroll_patience = 0
+            last_scroll = scroll
+
+
+def run_scroll_benchmark(browser, counter, directory, total, batch=50, delay=300):
+    path = os.path.join(directory, 'infinite_scroll.html')
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(INFINITE_SCROLL_PAGE.format(total=total, batch=batch, delay=delay, prefix='https://example.com/google/',
+                                            suffix='.jpg'))
+
+    xpath = RESULT_SELECTORS['google'][0]
+    result = {'site': 'scroll', 'total': total}
+    for name, scroll in (('fixed_sleep', lambda: scroll_fixed_sleep(browser)),
+                         ('scroll_engine', lambda: ScrollEngine(browser).scroll(xpath))):
+        browser.get(Path(path).as_uri())
+        counter[0] = 0
+        t1 = time.time()
+        scroll()
+        result[name + '_seconds'] = time.time() - t1
+        result[name + '_round_trips'] = counter[0]
+        result[name + '_results'] = len(extract_bulk(browser, 'google'))
+    return result
+
+
+def process_tree_rss_mb(pid):
+    """Linux 下 pid 及其所有子进程 (chromedriver、Chrome 和渲染进程) 的常驻内存之和 (MB)"""
+    children = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open('/proc/{}/stat'.format(entry), 'r') as f:
+                ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, ValueError, IndexError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+
+    total = 0
+    todo = [pid]
+    while todo:
+        current = todo.pop()
+        todo += children.get(current, [])
+        try:
+            with open('/proc/{}/status'.format(current), 'r') as f:
+                fields = dict(line.split(':', 1) for line in f if ':' in line)
+            total += int(fields['VmRSS'].split()[0])
+        except (OSError, KeyError, ValueError):
+            continue
+    return round(total / 1024, 1)
+
+
+def run_resource_benchmark(no_gui, directory, total, image_size=256):
+    """
+    同一个无限滚动页面 (图片来自本地的 SyntheticImageServer) 分别在不屏蔽和屏蔽资源时加载和滚动
+    每种情况使用新启动的浏览器，比较页面加载时间、滚动时间、图片请求数和浏览器进程的内存
+    """
+    result = {'site': 'resources', 'total': total}
+    with SyntheticImageServer(image_size=(image_size, image_size)) as server:
+        path = os.path.join(directory, 'resources.html')
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(INFINITE_SCROLL_PAGE.format(total=total, batch=50, delay=300, prefix=server.base_url + '/img/',
+                                                suffix='.png'))
+
+        links = {}
+        for name, block_resources in (('default', False), ('blocked', True)):
+            collect = CollectLinks(no_gui=no_gui, block_resources=block_resources)
+            try:
+                requests_before = server.stats()['requests']
+                collect.apply_resource_policy('google')
+                t1 = time.time()
+                collect.browser.get(Path(path).as_uri())
+                result[name + '_load_seconds'] = time.time() - t1
+                collect.scroll_engine.scroll(RESULT_SELECTORS['google'][0])
+                result[name + '_seconds'] = time.time() - t1
+                links[name] = collect.extract_attributes('google')
+                result[name + '_results'] = len(links[name])
+                result[name + '_image_requests'] = server.stats()['requests'] - requests_before
+                result[name + '_rss_mb'] = process_tree_rss_mb(collect.browser.service.process.pid)
+            finally:
+                collect.release()
+                # 下一种情况重新启动浏览器，内存不受上一次的影响
+                BrowserPool.close_worker()
+    result['same_links'] = links['default'] == links['blocked']
+    return result
+
+
+def run_harvest_benchmark(no_gui, sites, total):
+    """
+    在 HarvestFixtureServer 的页面上比较 dom 和 network 两种 collector: 第一个链接出现的时间、总时间和链接数
+    network 模式取出的链接应该与页面数据中的原图完全一致
+    """
+    results = []
+    with HarvestFixtureServer(total=total) as server:
+        for site in sites:
+            result = {'site': 'harvest_' + site}
+            links = {}
+            for collector in ('dom', 'network'):
+                collect = CollectLinks(no_gui=no_gui, collector=collector)
+                t1 = time.time()
+                links[collector] = []
+                for link in collect.stream_url(site, server.page_url(site)):
+                    if not links[collector]:
+                        result[collector + '_first_link_seconds'] = round(time.time() - t1, 2)
+                    links[collector].append(link)
+                result[collector + '_seconds'] = time.time() - t1
+                result[collector + '_links'] = len(links[collector])
+                result.setdefault(collector + '_first_link_seconds', None)
+            expected = [link + PEXELS_SIZE if site == 'pexels' else link for link in server.expected_links(site)]
+            result['same_links'] = links['network'] == expected
+            results.append(result)
+    return results
+
+
+def run_full_benchmark(no_gui, total):
+    """
+    在 HarvestFixtureServer 的 google 页面上比较 google_full 的内嵌数据 (inline) 和逐张点击 (click) 两种方式
+    时间换算为每 1000 个链接，inline 取出的链接应该与页面数据中的原图完全一致
+    """
+    result = {'site': 'google_full'}
+    links = {}
+    with HarvestFixtureServer(total=total) as server:
+        for mode in ('inline', 'click'):
+            collect = CollectLinks(no_gui=no_gui)
+            t1 = time.time()
+            try:
+                links[mode] = getattr(collect, 'google_full_' + mode)(server.page_url('google'), total)
+            finally:
+                collect.release()
+            seconds = time.time() - t1
+            result[mode + '_links'] = len(links[mode])
+            result[mode + '_seconds'] = seconds
+            result[mode + '_seconds_per_1000'] = seconds * 1000 / max(1, len(links[mode]))
+        result['same_links'] = links['inline'] == server.expected_links('google')
+    return result
+
+
+def extract_per_element(browser, site):
+    """原来的做法: find_elements 后逐个元素 get_attribute"""
+    xpath, attribute, json_key = RESULT_SELECTORS[site]
+    values = []
+    for element in browser.find_elements(By.XPATH, xpath):
+        value = element.get_attribute(attribute)
+        if value and json_key:
+            value = json.loads(value).get(json_key)
+        if value:
+            values.append(value)
+    return values
+
+
+def extract_bulk(browser, site):
+    xpath, attribute, json_key = RESULT_SELECTORS[site]
+    return browser.execute_script(EXTRACT_ATTRIBUTES_JS, xpath, attribute, json_key) or []
+
+
+def count_round_trips(browser):
+    """统计 WebDriver 请求次数，返回计数用的列表"""
+    counter = [0]
+    execute = browser.execute
+
+    def counting_execute(driver_command, params=None):
+        counter[0] += 1
+        return execute(driver_command, params)
+
+    browser.execute = counting_execute
+    return counter
+
+
+def run_benchmark(browser, counter, site, path):
+    browser.get(Path(path).as_uri())
+    result = {'site': site}
+    values = {}
+    for name, extract in (('per_element', extract_per_element), ('bulk', extract_bulk)):
+        counter[0] = 0
+        t1 = time.time()
+        values[name] = extract(browser, site)
+        result[name + '_seconds'] = time.time() - t1
+        result[name + '_round_trips'] = counter[0]
+    result['links'] = len(values['bulk'])
+    result['same_links'] = values['per_element'] == values['bulk']
+    return result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--count', type=int, default=1000, help='Number of results on every fixture page.')
+    parser.add_argument('--sites', type=str, default='google,naver,bing,pexels', help='Comma separated sites.')
+    parser.add_argument('--scroll', type=int, default=0,
+                        help='Also compare the fixed sleep scroll loop with ScrollEngine on an infinite scroll page '
+                             'loading this many results. (0: skip)')
+    parser.add_argument('--resources', type=int, default=0,
+                        help='Also compare page load time and browser memory with and without resource blocking on an '
+                             'infinite scroll page with this many locally served images. (0: skip)')
+    parser.add_argument('--harvest', type=int, default=0,
+                        help='Also compare the dom and network collectors on local pages serving this many results '
+                             'in the payload format of every site. (0: skip)')
+    parser.add_argument('--full', type=int, default=0,
+                        help='Also compare reading google_full links from the inline result data with clicking '
+                             'through the results on a local page with this many results. (0: skip)')
+    parser.add_argument('--gui', type=str, default='false', help='Show the browser window (boolean)')
+    parser.add_argument('--json', type=str, default='',
+                        help='Append the configuration and results as one JSON line to this file, like: bench.jsonl')
+    args = parser.parse_args()
+
+    fixture_dir = tempfile.mkdtemp(prefix='autocrawler_fixtures_')
+    pool = BrowserPool(no_gui=str(args.gui).lower() == 'false')
+    browser = pool.acquire()
+    try:
+        counter = count_round_trips(browser)
+        paths = write_fixtures(fixture_dir, args.count)
+        results = []
+        for site in args.sites.split(','):
+            result = run_benchmark(browser, counter, site, paths[site])
+            results.append(result)
+            print('{site:<7} links:{links:>6}  per element: {per_element_round_trips:>6} round trips '
+                  '{per_element_seconds:7.2f}s  bulk: {bulk_round_trips:>3} round trips {bulk_seconds:7.3f}s  '
+                  'same links: {same_links}'.format(**result))
+        if args.scroll:
+            result = run_scroll_benchmark(browser, counter, fixture_dir, args.scroll)
+            results.append(result)
+            print('scroll  fixed sleep: {fixed_sleep_results} results {fixed_sleep_seconds:.1f}s '
+                  '{fixed_sleep_round_trips} round trips  scroll engine: {scroll_engine_results} results '
+                  '{scroll_engine_seconds:.1f}s {scroll_engine_round_trips} round trips'.format(**result))
+        if args.resources:
+            result = run_resource_benchmark(str(args.gui).lower() == 'false', fixture_dir, args.resources)
+            results.append(result)
+            print('resources  default: load {default_load_seconds:.2f}s, total {default_seconds:.1f}s, '
+                  '{default_image_requests} image requests, {default_rss_mb} MB  blocked: load '
+                  '{blocked_load_seconds:.2f}s, total {blocked_seconds:.1f}s, {blocked_image_requests} image requests, '
+                  '{blocked_rss_mb} MB  same links: {same_links}'.format(**result))
+        if args.harvest:
+            for result in run_harvest_benchmark(str(args.gui).lower() == 'false', args.sites.split(','),
+                                                args.harvest):
+                results.append(result)
+                print('{site:<14} dom: {dom_links:>5} links, first after {dom_first_link_seconds}s, '
+                      '{dom_seconds:.1f}s  network: {network_links:>5} links, first after '
+                      '{network_first_link_seconds}s, {network_seconds:.1f}s  '
+                      'same links: {same_links}'.format(**result))
+        if args.full:
+            result = run_full_benchmark(str(args.gui).lower() == 'false', args.full)
+            results.append(result)
+            print('google_full  inline: {inline_links} links {inline_seconds:.1f}s '
+                  '({inline_seconds_per_1000:.1f}s per 1000)  click: {click_links} links {click_seconds:.1f}s '
+                  '({click_seconds_per_1000:.1f}s per 1000)  same links: {same_links}'.format(**result))
+    finally:
+        pool.close()
+        BrowserPool.close_worker()
+        shutil.rmtree(fixture_dir, ignore_errors=True)
+
+    if args.json:
+        with open(args.json, 'a', encoding='utf-8') as f:
+            f.write(json.dumps({'time': time.time(), 'config': vars(args), 'results': results}) + '\n')
+        print('Results appended to {}'.format(args.json))
+    sys.exit(0 if all(result.get('same_links', True) for result in results) else 1)
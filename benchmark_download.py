@@ -0,0 +1,230 @@
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+from HttpSessionPool import HttpSessionPool
+from download_images import AutoCrawler
+
+
+class ServerProcess:
+    def __init__(self, latency=0.1, html_rate=0.0, rate_limit=0.0, error_rate=0.0, truncate_rate=0.0, bandwidth=0,
+                 image_size=64):
+        """在子进程中启动 SyntheticImageServer，避免服务端的 I/O 和 CPU 计入本进程的统计"""
+        self.args = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'SyntheticImageServer.py'),
+                     '--port', '0', '--latency', str(latency), '--html-rate', str(html_rate),
+                     '--rate-limit', str(rate_limit), '--error-rate', str(error_rate),
+                     '--truncate-rate', str(truncate_rate), '--bandwidth', str(bandwidth),
+                     '--image-size', str(image_size)]
+        self.process = None
+        self.base_url = None
+
+    def url(self, n, ext='png'):
+        return '{}/img/{}.{}'.format(self.base_url, n, ext)
+
+    def stats(self):
+        with urllib.request.urlopen(self.base_url + '/stats') as response:
+            return json.loads(response.read())
+
+    def __enter__(self):
+        self.process = subprocess.Popen(self.args, stdout=subprocess.PIPE, text=True)
+        self.base_url = self.process.stdout.readline().strip()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.process.terminate()
+        self.process.wait()
+
+
+def run_skew_benchmark(server, chunk_size, n_threads=4, keyword_sizes=(400, 20, 20, 20, 20, 20, 20, 20), limit=0):
+    """
+    Runs do_crawling on keywords with very different link counts and reports how long the other
+    threads sit idle while the largest keyword finishes.
+    """
+    cwd = os.getcwd()
+    work_dir = tempfile.mkdtemp(prefix='autocrawler_skew_')
+    try:
+        # do_crawling reads keyword lists relative to the working directory
+        os.chdir(work_dir)
+        keywords = ['kw{}'.format(i) for i in range(len(keyword_sizes))]
+        for site_name in ('google', 'bing', 'pexels', 'naver'):
+            with open('datasets_keywords\\{}.txt'.format(site_name), 'w', encoding='utf-8') as f:
+                f.write('\n'.join(keywords) if site_name == 'google' else '')
+        # Absolute, because per-process stores are cached by path
+        download_path = os.path.join(work_dir, 'download')
+        os.makedirs(os.path.join(download_path, 'images_url', 'google'))
+        offset = 0
+        for keyword, size in zip(keywords, keyword_sizes):
+            with open(os.path.join(download_path, 'images_url', 'google', keyword + '.txt'), 'w', encoding='utf-8') as f:
+                f.write('\n'.join(server.url(offset + i) for i in range(size)))
+            offset += size
+
+        crawler = AutoCrawler(download_path=download_path, n_threads=n_threads, n_inflight=4, do_bing=False,
+                              do_pexels=False, do_naver=False, limit=limit, chunk_size=chunk_size)
+        result = crawler.do_crawling()
+        result['chunk_size'] = chunk_size
+        result['images'] = sum(len(files) for _, _, files in os.walk(os.path.join(download_path, 'images_file')))
+        return result
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def read_proc_io():
+    """Linux 下读取本进程的系统调用次数和读写字节数，其他平台返回空字典"""
+    try:
+        with open('/proc/self/io', 'r') as f:
+            return {key: int(value) for key, value in (line.split(': ') for line in f)}
+    except OSError:
+        return {}
+
+
+def read_proc_memory():
+    """Linux 下读取本进程当前和峰值的常驻内存 (MB)，其他平台返回空字典"""
+    try:
+        with open('/proc/self/status', 'r') as f:
+            fields = dict(line.split(':', 1) for line in f if ':' in line)
+        return {'rss_mb': round(int(fields['VmRSS'].split()[0]) / 1024, 1),
+                'peak_rss_mb': round(int(fields['VmHWM'].split()[0]) / 1024, 1)}
+    except (OSError, KeyError, ValueError):
+        return {}
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def format_optional(value, spec):
+    # No /proc counters outside Linux, no latencies or per image values when nothing was saved
+    return 'n/a' if value is None else format(value, spec)
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def run_benchmark(server, n_images, n_inflight, limit=0, domain_rate=0, formats=('png',)):
+    download_path = tempfile.mkdtemp(prefix='autocrawler_bench_')
+    try:
+        crawler = AutoCrawler(download_path=download_path, n_inflight=n_inflight, limit=limit, domain_rate=domain_rate)
+        links = [server.url(i, formats[i % len(formats)]) for i in range(n_images)]
+
+        # Time every image, including retries of the same link
+        latencies = []
+        download_image = crawler.download_image
+
+        def timed_download_image(*args):
+            started = time.monotonic()
+            try:
+                return download_image(*args)
+            finally:
+                latencies.append(time.monotonic() - started)
+
+        crawler.download_image = timed_download_image
+
+        server1 = server.stats()
+        io1 = read_proc_io()
+        cpu1 = time.process_time()
+        t1 = time.time()
+        crawler.download_images('bench', links, 'bench', max_count=limit)
+        elapsed = time.time() - t1
+        cpu = time.process_time() - cpu1
+        io2 = read_proc_io()
+        server2 = server.stats()
+
+        stats = crawler.get_session().stats.summary()
+        saved = len([name for name in os.listdir(os.path.join(download_path, 'images_file', 'bench', 'bench'))
+                     if '.part' not in name])
+        result = {'inflight': n_inflight, 'images': saved, 'failed': len(links) - saved, 'seconds': elapsed,
+                  'images_per_sec': saved / elapsed,
+                  'latency_p50': percentile(latencies, 0.5), 'latency_p99': percentile(latencies, 0.99),
+                  'cpu_seconds': cpu, 'cpu_percent': 100 * cpu / elapsed, 'rss_mb': None, 'peak_rss_mb': None,
+                  'new_connections': stats['new_connections'], 'reused_connections': stats['reused_connections'],
+                  'throttled': server2['throttled'] - server1['throttled'],
+                  'server_errors': server2['errors'] - server1['errors'],
+                  'truncated': server2['truncated'] - server1['truncated'],
+                  'syscalls_per_image': None, 'bytes_read_per_image': None, 'bytes_written_per_image': None}
+        # The peak is for the whole benchmark process, not only this run
+        result.update(read_proc_memory())
+        if io1 and io2 and saved:
+            result['syscalls_per_image'] = (io2['syscr'] + io2['syscw'] - io1['syscr'] - io1['syscw']) / saved
+            result['bytes_read_per_image'] = (io2['rchar'] - io1['rchar']) / saved
+            result['bytes_written_per_image'] = (io2['wchar'] - io1['wchar']) / saved
+        return result
+    finally:
+        HttpSessionPool.close_worker()
+        shutil.rmtree(download_path, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--images', type=int, default=200, help='Number of images to download per run.')
+    parser.add_argument('--latency', type=float, default=0.1, help='Injected latency per request (seconds).')
+    parser.add_argument('--html-rate', type=float, default=0.0, help='Fraction of responses that are HTML error pages.')
+    parser.add_argument('--rate-limit', type=float, default=0.0,
+                        help='Requests per second the server allows before returning 429. (0: unlimited)')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of responses that are 502 errors.')
+    parser.add_argument('--truncate-rate', type=float, default=0.0,
+                        help='Fraction of image responses cut off after half of the body.')
+    parser.add_argument('--bandwidth', type=int, default=0,
+                        help='Maximum bytes per second the server sends for each response. (0: unlimited)')
+    parser.add_argument('--image-size', type=int, default=64, help='Width and height of the generated images.')
+    parser.add_argument('--formats', type=str, default='png',
+                        help='Comma separated image formats requested in turn: png, jpg, gif')
+    parser.add_argument('--json', type=str, default='',
+                        help='Append the configuration and results as one JSON line to this file, like: bench.jsonl')
+    parser.add_argument('--domain-rate', type=float, default=0, help='Client side requests per second per domain.')
+    parser.add_argument('--inflight', type=str, default='1,4,16,64',
+                        help='Comma separated concurrency levels to benchmark.')
+    parser.add_argument('--skew', type=str, default='',
+                        help='Compare do_crawling chunk sizes on a skewed keyword list instead, like: "0,50"')
+    args = parser.parse_args()
+
+    server_process = ServerProcess(latency=args.latency, html_rate=args.html_rate, rate_limit=args.rate_limit,
+                                   error_rate=args.error_rate, truncate_rate=args.truncate_rate,
+                                   bandwidth=args.bandwidth, image_size=args.image_size)
+    results = []
+    if args.skew:
+        with server_process as server:
+            for chunk_size in [int(x) for x in args.skew.split(',')]:
+                results.append(run_skew_benchmark(server, chunk_size))
+        for result in results:
+            print('chunk size:{chunk_size:>4}  images:{images:>5}  seconds:{seconds:7.2f}  '
+                  'first thread idle at:{first_idle:7.2f}s  tail:{tail:7.2f}s  '
+                  'utilization:{utilization:6.0%}'.format(**result))
+    else:
+        with server_process as server:
+            for level in [int(x) for x in args.inflight.split(',')]:
+                result = run_benchmark(server, args.images, level, domain_rate=args.domain_rate,
+                                       formats=args.formats.split(','))
+                results.append(result)
+                shown = dict(result)
+                for field, spec in (('latency_p50', '.3f'), ('latency_p99', '.3f'), ('syscalls_per_image', '.1f'),
+                                    ('bytes_read_per_image', '.0f'), ('bytes_written_per_image', '.0f')):
+                    shown[field] = format_optional(result[field], spec)
+                print('inflight:{inflight:>4}  images:{images:>6}  seconds:{seconds:8.2f}  '
+                      'images/sec:{images_per_sec:8.1f}  latency p50/p99:{latency_p50}/{latency_p99}s  '
+                      'cpu:{cpu_percent:5.1f}%  rss:{rss_mb}MB  '
+                      'connections new/reused:{new_connections}/{reused_connections}  429s:{throttled}  '
+                      '502s:{server_errors}  truncated:{truncated}  '
+                      'syscalls/image:{syscalls_per_image}  bytes read/image:{bytes_read_per_image}  '
+                      'bytes written/image:{bytes_written_per_image}'.format(**shown))
+
+    if args.json:
+        # One line per benchmark run, so results of different commits can be compared
+        record = {'time': time.time(), 'commit': git_commit(), 'config': vars(args), 'results': results}
+        with open(args.json, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record) + '\n')
+        print('Results appended to {}'.format(args.json))
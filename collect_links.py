@@ -15,60 +15,204 @@ Copyright 2018 YoongiKim
 """
 
 import time
-from selenium import webdriver
 from selenium.webdriver.common.keys import Keys
 from selenium.webdriver.common.by import By
 from selenium.common.exceptions import ElementNotVisibleException, StaleElementReferenceException, TimeoutException
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.chrome.service import Service
-from webdriver_manager.chrome import ChromeDriverManager
+import html
 import json
+import re
 from urllib.parse import urlparse, parse_qs, unquote, urlunparse
 
+from BrowserPool import BrowserPool
 from ElementMover import ElementMover
 from LinkFilter import LinkFilter
-from ScrollDetector import ScrollDetector
+from NetworkHarvester import NetworkHarvester
+from ScrollEngine import ScrollEngine, ScrollState
+
+# 在页面内一次取出所有结果节点的属性，代替逐个元素调用 get_attribute (每次调用都是一次 WebDriver 请求)
+EXTRACT_ATTRIBUTES_JS = '''
+var nodes = document.evaluate(arguments[0], document, null, XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null);
+var attribute = arguments[1], jsonKey = arguments[2], values = [];
+for (var i = 0; i < nodes.snapshotLength; i++) {
+    var node = nodes.snapshotItem(i);
+    // 与 get_attribute 一致: src 等同名属性取解析后的绝对 URL
+    var value = typeof node[attribute] === 'string' ? node[attribute] : node.getAttribute(attribute);
+    if (value && jsonKey) {
+        try { value = JSON.parse(value)[jsonKey]; } catch (e) { value = null; }
+    }
+    if (value) values.push(value);
+}
+return values;
+'''
+
+# 站点 -> (结果节点的 XPath, 属性, 属性是 JSON 时取出的键)
+RESULT_SELECTORS = {
+    'google': ('//*[@class="YQ4gaf"]', 'src', None),
+    'naver': ('//div[@class="tile_item _fe_image_tab_content_tile"]//img[@class="_fe_image_tab_content_thumbnail_image"]',
+              'src', None),
+    'bing': ('//a[@class="iusc"]', 'm', 'murl'),
+    'pexels': ('//a//img[@class="spacing_noMargin__F5u9R"]', 'src', None),
+}
+
+# 站点 -> 缩略图搜索页 (google 不使用 add_url)
+SEARCH_URLS = {
+    #'google': 'https://www.google.com/search?q={}&source=lnms&tbm=isch{}',
+    'google': 'https://www.google.com/search?q={}&source=lnms&udm=2&tbs=isz:l',
+    'naver': 'https://search.naver.com/search.naver?where=image&sm=tab_jum&query={}{}',
+    'bing': 'https://www.bing.com/images/search?first=1&q={}{}',
+    'pexels': 'https://www.pexels.com/search/{}{}',
+}
+
+# 没有新结果时点击的 "加载更多" 按钮
+LOAD_MORE_XPATHS = {
+    'google': '//input[@class="mye4qd"]',
+    'bing': '//a[contains(@class, "btn_seemore")]',
+}
+
+# 缩略图模式只需要结果节点的属性，图片、字体、媒体不必下载和解码 (Network.setBlockedURLs 的通配符)
+BLOCKED_EXTENSIONS = ['jpg', 'jpeg', 'png', 'gif', 'webp', 'avif', 'bmp', 'ico', 'svg',
+                      'woff', 'woff2', 'ttf', 'otf', 'eot', 'mp4', 'webm', 'm3u8', 'mp3']
+# 广告和统计脚本，与结果的加载无关
+THIRD_PARTY_SCRIPTS = ['*googletagmanager.com/*', '*google-analytics.com/*', '*doubleclick.net/*',
+                       '*googlesyndication.com/*', '*googleadservices.com/*', '*adservice.google.*',
+                       '*connect.facebook.net/*', '*scorecardresearch.com/*', '*hotjar.com/*', '*clarity.ms/*',
+                       '*bat.bing.com/*', '*browser.sentry-cdn.com/*', '*js-agent.newrelic.com/*']
+
+# 站点 -> 额外屏蔽的 URL: 缩略图服务器的地址通常不带扩展名
+# 结果节点由站点自己的脚本插入，所以第一方脚本和 XHR 不屏蔽，懒加载照常进行
+RESOURCE_POLICIES = {
+    'google': ['*encrypted-tbn*.gstatic.com/*', '*.googleusercontent.com/*'],
+    'naver': ['*search.pstatic.net/common/*'],
+    'bing': ['*.mm.bing.net/th*', '*th.bing.com/th*'],
+    'pexels': ['*images.pexels.com/*'],
+}
+
+
+def blocked_urls(site):
+    """返回 site 在缩略图模式下屏蔽的 URL 通配符，没有策略的站点不屏蔽"""
+    if site not in RESOURCE_POLICIES:
+        return []
+    urls = []
+    for ext in BLOCKED_EXTENSIONS:
+        urls += ['*.{}'.format(ext), '*.{}?*'.format(ext)]
+    return urls + THIRD_PARTY_SCRIPTS + RESOURCE_POLICIES[site]
+
+# 站点 -> (包含结果数据的响应 URL, 从响应正文中取出原图链接的正则)
+# 结果在渲染之前就以 JSON 或内嵌数据的形式到达，正文先经过 unescape_payload
+HARVEST_RULES = {
+    # 内嵌的 AF_initDataCallback 和 batchexecute 中的 ["原图", 高, 宽]
+    'google': (r'/search\?|/batchexecute', r'(https?://[^"\\\s]+)\\*",\s*\d+,\s*\d+\]'),
+    'naver': (r'search\.naver\?|/p/c/image/', r'"originalUrl\\*"\s*:\s*\\*"(https?://[^"\\]+)'),
+    # 结果页和 /images/async 的 HTML 中 m 属性的 JSON
+    'bing': (r'/images/(search|async)\?', r'"murl\\*"\s*:\s*\\*"(https?://[^"\\]+)'),
+    # __NEXT_DATA__ 和搜索 API 的 JSON，同一张图片有多个尺寸
+    'pexels': (r'/search/|/api/v\d+/search', r'(https://images\.pexels\.com/photos/\d+/[\w.-]+?\.(?:jpe?g|png|webp))'),
+}
+
+PEXELS_SIZE = '?auto=compress&cs=tinysrgb&dpr=1&w=1280&h=720'
+
+
+def unescape_payload(body):
+    """去掉 HTML 实体和 JS/JSON 字符串中的 \\uXXXX、\\/ 转义 (可能嵌套多层)"""
+    text = html.unescape(body)
+    text = re.sub(r'\\+u([0-9a-fA-F]{4})', lambda m: chr(int(m.group(1), 16)), text)
+    return re.sub(r'\\+/', '/', text)
+
+
+def harvest_links(site, body):
+    """从 site 的响应正文中取出原图链接"""
+    links = []
+    for link in re.findall(HARVEST_RULES[site][1], unescape_payload(body)):
+        if site == 'google' and urlparse(link).netloc.endswith('gstatic.com'):
+            # 缩略图
+            continue
+        if site == 'pexels':
+            link += PEXELS_SIZE
+        links.append(link)
+    return links
+
+
+# google_full: 在页面的脚本之前执行，保存 URL 匹配的 XHR 和 fetch 响应正文
+CAPTURE_RESPONSES_JS = '''
+(function () {
+    var pattern = new RegExp(%s), responses = window.__autocrawlerResponses = [];
+    var open = XMLHttpRequest.prototype.open;
+    XMLHttpRequest.prototype.open = function (method, url) {
+        if (pattern.test(String(url))) {
+            this.addEventListener('load', function () {
+                if (this.responseType === '' || this.responseType === 'text') responses.push(this.responseText);
+            });
+        }
+        return open.apply(this, arguments);
+    };
+    var fetch = window.fetch;
+    if (!fetch) return;
+    window.fetch = function (input) {
+        var promise = fetch.apply(this, arguments);
+        if (pattern.test(String(typeof input === 'string' ? input : input && input.url))) {
+            promise.then(function (response) { return response.clone().text(); })
+                .then(function (text) { responses.push(text); }, function () {});
+        }
+        return promise;
+    };
+})();
+'''
+
+# 返回还没读过的内嵌脚本和截获的响应正文
+INLINE_DATA_JS = '''
+var texts = [];
+for (var i = 0; i < document.scripts.length; i++) {
+    var script = document.scripts[i];
+    if (script.src || script.__autocrawlerRead) continue;
+    script.__autocrawlerRead = true;
+    texts.push(script.text);
+}
+var responses = window.__autocrawlerResponses || [];
+return texts.concat(responses.splice(0, responses.length));
+'''
+
+# collect_tabs: 导航前在旧页面上做标记，新页面没有标记且加载完成时开始滚动
+MARK_TAB_JS = 'window.__autocrawlerTab = true; window.location.href = arguments[0];'
+TAB_LOADED_JS = "return document.readyState === 'complete' && window.__autocrawlerTab === undefined;"
+
+# 一个窗口等待页面加载的最长时间 (秒)
+TAB_LOAD_TIMEOUT = 30
+
+
+class KeywordTab:
+    def __init__(self, handle, keyword):
+        """collect_tabs 中一个窗口正在采集的关键词"""
+        self.handle = handle
+        self.keyword = keyword
+        self.opened = time.time()
+        self.scroll = None  # 页面加载完成后开始滚动
+        self.seen = set()
+        self.found = set()
+        self.links = []
+        self.done = False
 
 
 class CollectLinks:
-    def __init__(self, no_gui=False, proxy=None):
-        chrome_options = Options()
-        chrome_options.add_argument('--no-sandbox')  # To maintain user cookies
-        chrome_options.add_argument('--disable-dev-shm-usage')
-        if no_gui:
-            chrome_options.add_argument('--headless')
-        if proxy:
-            chrome_options.add_argument("--proxy-server={}".format(proxy))
-        self.browser = webdriver.Chrome(service=Service(ChromeDriverManager().install()), options=chrome_options)
+    def __init__(self, no_gui=False, proxy=None, block_resources=True, collector='dom'):
+        # 浏览器由本进程的 BrowserPool 启动并在关键词之间复用
+        # block_resources: 缩略图模式按 RESOURCE_POLICIES 屏蔽图片、字体、媒体和第三方脚本
+        # collector: 'dom' 从渲染后的结果节点取链接，'network' 从结果数据的网络响应中取 (HARVEST_RULES)
+        self.resource_policies = RESOURCE_POLICIES if block_resources else {}
+        self.harvest = collector == 'network'
+        self.pool = BrowserPool.for_worker(no_gui, proxy, performance_log=self.harvest)
+        self.browser = self.pool.acquire()
         self.filter = LinkFilter()
         self.wait = WebDriverWait(self.browser, 5)  # 创建一个等待实例
         self.mover = ElementMover(self.browser)
-        self.scroll_detector = ScrollDetector(self.browser)
+        self.scroll_engine = ScrollEngine(self.browser)
 
-        browser_version = 'Failed to detect version'
-        chromedriver_version = 'Failed to detect version'
-        major_version_different = False
-
-        if 'browserVersion' in self.browser.capabilities:
-            browser_version = str(self.browser.capabilities['browserVersion'])
-
-        if 'chrome' in self.browser.capabilities:
-            if 'chromedriverVersion' in self.browser.capabilities['chrome']:
-                chromedriver_version = str(self.browser.capabilities['chrome']['chromedriverVersion']).split(' ')[0]
-
-        if browser_version.split('.')[0] != chromedriver_version.split('.')[0]:
-            major_version_different = True
-
-        print('_________________________________')
-        print('Current web-browser version:\t{}'.format(browser_version))
-        print('Current chrome-driver version:\t{}'.format(chromedriver_version))
-        if major_version_different:
-            print('warning: Version different')
-            print(
-                'Download correct version at "http://chromedriver.chromium.org/downloads" and place in "./chromedriver"')
-        print('_________________________________')
+    def release(self):
+        """把浏览器还给 BrowserPool，可以重复调用"""
+        if self.browser is not None:
+            self.pool.release(self.browser)
+            self.browser = None
 
     def get_scroll(self):
         pos = self.browser.execute_script("return window.pageYOffset;")
@@ -98,243 +242,236 @@ class CollectLinks:
     def remove_duplicates(_list):
         return list(dict.fromkeys(_list))
 
-    def google(self, keyword, add_url=""):
-        #self.browser.get("https://www.google.com/search?q={}&source=lnms&tbm=isch{}".format(keyword, add_url))
-        self.browser.get("https://www.google.com/search?q={}&source=lnms&udm=2&tbs=isz:l".format(keyword, add_url))
-
-        time.sleep(1)
-
-        print('Scrolling down')
-
-        elem = self.browser.find_element(By.TAG_NAME, "body")
-
-        last_scroll = 0
-        scroll_patience = 0
-        NUM_MAX_SCROLL_PATIENCE = 50
-
-        while True:
-            elem.send_keys(Keys.PAGE_DOWN)
-            time.sleep(0.2)
-
-            scroll = self.get_scroll()
-            if scroll == last_scroll:
-                scroll_patience += 1
+    def apply_resource_policy(self, site):
+        """通过 CDP 屏蔽 site 不需要的资源，放回 BrowserPool 时取消"""
+        if site not in self.resource_policies:
+            return
+        try:
+            self.browser.execute_cdp_cmd('Network.enable', {})
+            self.browser.execute_cdp_cmd('Network.setBlockedURLs', {'urls': blocked_urls(site)})
+        except Exception as e:
+            print('Failed to block resources of {} - {}'.format(site, e))
+
+    def extract_attributes(self, site):
+        """返回 site 所有结果节点的属性值列表，只需要一次 WebDriver 请求"""
+        xpath, attribute, json_key = RESULT_SELECTORS[site]
+        return self.browser.execute_script(EXTRACT_ATTRIBUTES_JS, xpath, attribute, json_key) or []
+
+    def normalize_link(self, site, src):
+        """把结果节点的属性转换为图片链接，不需要的返回 None"""
+        if site == 'naver':
+            if src[0] == 'd':
+                return None
+            new_url = unquote(src)
+            query = urlparse(new_url).query
+            # 解析查询参数
+            params = parse_qs(query)
+            # 解析 URL
+            parsed_url = urlparse(params['src'][0])
+            # 去掉查询参数和片段
+            new_url = urlunparse((parsed_url.scheme, parsed_url.netloc, parsed_url.path, '', '', ''))
+            is_subdomain = self.is_subdomain(new_url, 'pexels.com')
+            if is_subdomain:
+                new_url += '?auto=compress&cs=tinysrgb&dpr=1&w=1280&h=720'
+            return new_url
+        if site == 'pexels':
+            # 替换 w=500 为 w=640
+            return src.replace("w=500", "w=1280&h=720")
+        return src
+
+    def _new_links(self, site, seen, found, harvester=None):
+        # seen: 已处理的属性值或响应中的链接，found: 已返回的链接
+        try:
+            if harvester is not None:
+                values = [link for _, body in harvester.poll() for link in harvest_links(site, body)]
             else:
-                scroll_patience = 0
-                last_scroll = scroll
-
-            if scroll_patience >= NUM_MAX_SCROLL_PATIENCE:
-                break
-
-        print('Scraping links')
-
-        imgs = self.browser.find_elements(By.XPATH, '//*[@class="YQ4gaf"]')
-
-        links = []
-        for idx, img in enumerate(imgs):
+                values = self.extract_attributes(site)
+        except Exception as e:
+            print('[Exception occurred while collecting links from {}] {}'.format(site, e))
+            return
+        for src in values:
+            if src in seen:
+                continue
+            seen.add(src)
             try:
-                src = img.get_attribute("src")
-                links.append(src)
-
+                link = src if harvester is not None else self.normalize_link(site, src)
             except Exception as e:
-                print('[Exception occurred while collecting links from google] {}'.format(e))
-
-        links = self.remove_duplicates(links)
+                print('[Exception occurred while collecting links from {}] {}'.format(site, e))
+                continue
+            if link and link not in found and self.filter.check_link(link):
+                found.add(link)
+                yield link
+
+    def stream(self, site, keyword, add_url=""):
+        """
+        边滚动边返回新发现的链接 (生成器)，每滚动一步在页面内取一次结果
+        结束或被关闭 (close) 时把浏览器还给 BrowserPool
+        """
+        return self.stream_url(site, SEARCH_URLS[site].format(keyword, add_url))
+
+    def stream_url(self, site, url):
+        """打开 url (site 的搜索结果页或本地的测试页面) 并返回链接的生成器"""
+        try:
+            self.apply_resource_policy(site)
+            harvester = NetworkHarvester(self.browser, HARVEST_RULES[site][0]) if self.harvest else None
+            if harvester is not None:
+                harvester.drain()
+            self.browser.get(url)
+            print('Scrolling down')
+            seen, found = set(), set()
+            yield from self._new_links(site, seen, found, harvester)
+            for _ in self.scroll_engine.steps(RESULT_SELECTORS[site][0], load_more_xpath=LOAD_MORE_XPATHS.get(site)):
+                yield from self._new_links(site, seen, found, harvester)
+        finally:
+            self.release()
+
+    def collect(self, site, keyword, add_url=""):
+        links = list(self.stream(site, keyword, add_url))
+        print('Collect links done. Site: {}, Keyword: {}, Total: {}'.format(site, keyword, len(links)))
+        return links
+
+    def open_tab(self, site, handle, keyword, add_url=""):
+        """在窗口 handle 中打开 keyword 的结果页，不等待加载"""
+        self.browser.switch_to.window(handle)
+        # 资源屏蔽按窗口生效
+        self.apply_resource_policy(site)
+        self.browser.execute_script(MARK_TAB_JS, SEARCH_URLS[site].format(keyword, add_url))
+        return KeywordTab(handle, keyword)
+
+    def advance_tab(self, site, tab):
+        """推进当前窗口的采集: 页面加载完成时开始滚动，一步结束时取出新链接并开始下一步，有进展时返回 True"""
+        if tab.scroll is None:
+            if not self.browser.execute_script(TAB_LOADED_JS):
+                if time.time() - tab.opened > TAB_LOAD_TIMEOUT:
+                    print('Page load timed out. Site: {}, Keyword: {}'.format(site, tab.keyword))
+                    tab.done = True
+                    return True
+                return False
+            tab.scroll = ScrollState(RESULT_SELECTORS[site][0], load_more_xpath=LOAD_MORE_XPATHS.get(site))
+        elif not self.scroll_engine.poll_step(tab.scroll):
+            return False
 
-        print('Collect links done. Site: {}, Keyword: {}, Total: {}'.format('google', keyword, len(links)))
-        self.browser.close()
+        tab.links.extend(self._new_links(site, tab.seen, tab.found))
+        if tab.scroll.done:
+            tab.done = True
+        else:
+            self.scroll_engine.start_step(tab.scroll)
+        return True
+
+    def collect_tabs(self, site, keywords, add_url="", tabs=4):
+        """
+        在同一个浏览器的 tabs 个窗口中同时采集多个关键词，返回 {keyword: links}
+        各窗口轮流开始一步滚动、读取结果，一个窗口等待新结果时其他窗口继续滚动
+        只支持 dom 模式 (performance 日志不区分窗口)，结束时把浏览器还给 BrowserPool
+        """
+        pending = list(keywords)
+        results = {keyword: [] for keyword in keywords}
+        active = []
+        try:
+            handles = [self.browser.current_window_handle]
+            for _ in range(min(tabs, len(pending)) - 1):
+                # 用独立的窗口而不是标签页: 后台标签页不渲染，部分站点不会加载下一批结果
+                self.browser.switch_to.new_window('window')
+                handles.append(self.browser.current_window_handle)
+            for handle in handles:
+                active.append(self.open_tab(site, handle, pending.pop(0), add_url))
+
+            while active:
+                progressed = False
+                for tab in list(active):
+                    try:
+                        self.browser.switch_to.window(tab.handle)
+                        progressed = self.advance_tab(site, tab) or progressed
+                    except Exception as e:
+                        print('[Exception occurred while collecting links from {}] {}'.format(site, e))
+                        tab.done = True
+                    if not tab.done:
+                        continue
+                    results[tab.keyword] = tab.links
+                    print('Collect links done. Site: {}, Keyword: {}, Total: {}'.format(site, tab.keyword,
+                                                                                        len(tab.links)))
+                    active.remove(tab)
+                    if pending:
+                        # 窗口空出后接着采集下一个关键词
+                        try:
+                            active.append(self.open_tab(site, tab.handle, pending.pop(0), add_url))
+                        except Exception as e:
+                            print('[Exception occurred while collecting links from {}] {}'.format(site, e))
+                if not progressed:
+                    time.sleep(0.05)
+        finally:
+            self.release()
+        return results
 
-        filter = LinkFilter()
-        filtered_links = filter.filter_links(links)
-        return filtered_links
+    def google(self, keyword, add_url=""):
+        return self.collect('google', keyword, add_url)
 
     def naver(self, keyword, add_url=""):
-        self.browser.get(
-            "https://search.naver.com/search.naver?where=image&sm=tab_jum&query={}{}".format(keyword, add_url))
-
-        time.sleep(1)
-
-        print('Scrolling down')
-
-        elem = self.browser.find_element(By.TAG_NAME, "body")
-
-        for i in range(60):
-            elem.send_keys(Keys.PAGE_DOWN)
-            time.sleep(0.2)
-            if self.is_scroll_end:
-                # 如果触底了就暂停5秒
-                print('naver触底暂停')
-                time.sleep(5)
-
-        imgs = self.browser.find_elements(By.XPATH, '//div[@class="tile_item _fe_image_tab_content_tile"]//img[@class="_fe_image_tab_content_thumbnail_image"]')
-
-        print('Scraping links')
-
-        links = []
-
-        for img in imgs:
-            try:
-                src = img.get_attribute("src")
-                if src[0] != 'd':
-                    new_url = unquote(src)
-                    query = urlparse(new_url).query
-                    # 解析查询参数
-                    params = parse_qs(query)
-                    # 解析 URL
-                    parsed_url = urlparse(params['src'][0])
-                    # 去掉查询参数和片段
-                    new_url = urlunparse((parsed_url.scheme, parsed_url.netloc, parsed_url.path, '', '', ''))
-                    is_subdomain = self.is_subdomain(new_url, 'pexels.com')
-                    if is_subdomain:
-                        new_url += '?auto=compress&cs=tinysrgb&dpr=1&w=1280&h=720'
-                    links.append(new_url)
-            except Exception as e:
-                print('[Exception occurred while collecting links from naver] {}'.format(e))
-
-        links = self.remove_duplicates(links)
-
-        print('Collect links done. Site: {}, Keyword: {}, Total: {}'.format('naver', keyword, len(links)))
-        self.browser.close()
-
-        filter = LinkFilter()
-        filtered_links = filter.filter_links(links)
-        return filtered_links
+        return self.collect('naver', keyword, add_url)
 
     def bing(self, keyword, add_url=""):
-        self.browser.get(
-            "https://www.bing.com/images/search?first=1&q={}{}".format(keyword, add_url))
-
-        time.sleep(1)
-
-        print('Scrolling down')
-
-        elem = self.browser.find_element(By.TAG_NAME, "body")
-
-        for i in range(20):
-            elem.send_keys(Keys.PAGE_DOWN)
-            time.sleep(0.2)
-            #if i % 2 == 0 :
-                #elem.send_keys(Keys.PAGE_UP)
-
-            # 执行 JavaScript 获取页面滚动信息
-            scroll_info = self.browser.execute_script(
-                "return {"
-                "    scrollTop: document.documentElement.scrollTop || document.body.scrollTop,"
-                "    clientHeight: document.documentElement.clientHeight || window.innerHeight,"
-                "    scrollHeight: document.documentElement.scrollHeight || document.body.scrollHeight"
-                "};"
-            )
-            # 判断是否到底部
-            is_scroll_end = scroll_info['scrollTop'] + scroll_info['clientHeight'] >= scroll_info['scrollHeight']
-            # 判断是否到底部
-            if is_scroll_end :
-                print("已经滚动到底部")
-                elem.send_keys(Keys.PAGE_UP)
-                # 执行 JavaScript 获取页面滚动信息
-                scroll_info = self.browser.execute_script(
-                    "return {"
-                    "    scrollTop: document.documentElement.scrollTop || document.body.scrollTop,"
-                    "    clientHeight: document.documentElement.clientHeight || window.innerHeight,"
-                    "    scrollHeight: document.documentElement.scrollHeight || document.body.scrollHeight"
-                    "};"
-                )
-                # 判断是否到底部
-                is_scroll_end = scroll_info['scrollTop'] + scroll_info['clientHeight'] >= scroll_info['scrollHeight']
-                if is_scroll_end :
-                    time.sleep(2)
-                    elem.send_keys(Keys.PAGE_UP)
-                    #self.wait_and_click('//button[@class="Button_button__RDDf5 spacing_noMargin__F5u9R spacing_pr30__J0kZ7 spacing_pl30__01iHm Grid_loadMore__hTWju Button_clickable__DqoNe Button_color-white__Wmgol"]')
-
-        imgs = self.browser.find_elements(By.XPATH, '//a[@class="iusc"]')
-
-        print('Scraping links')
-
-        links = []
-
-        for img in imgs:
-            try:
-                attr_m = img.get_attribute("m")
-                if attr_m:
-                    json_m = json.loads(attr_m)
-                    links.append(json_m['murl'])
-            except Exception as e:
-                print('[Exception occurred while collecting links from bing] {}'.format(e))
-
-        links = self.remove_duplicates(links)
-
-        print('Collect links done. Site: {}, Keyword: {}, Total: {}'.format('bing', keyword, len(links)))
-        self.browser.close()
-
-        filtered_links = self.filter.filter_links(links)
-        return filtered_links
+        return self.collect('bing', keyword, add_url)
 
     def pexels(self, keyword, add_url=""):
-        self.browser.get(
-            "https://www.pexels.com/search/{}{}".format(keyword, add_url))
-
-        time.sleep(1)
-
-        print('Scrolling down')
-
-        elem = self.browser.find_element(By.TAG_NAME, "body")
-
-        count = 0
-        for i in range(300):
-            elem.send_keys(Keys.PAGE_DOWN)
-            time.sleep(1)
-            #if i % 3 == 0 :
-                #elem.send_keys(Keys.PAGE_UP)
-
-            # 判断是否到底部
-            is_scroll_end = self.is_scroll_end()
-            # 判断是否到底部
-            if is_scroll_end :
-                print("pexels 已经滚动到底部 {}".format(i))
-                for j in range(5):
-                    elem.send_keys(Keys.PAGE_UP)
-
-                # 判断是否到底部
-                is_scroll_end = self.is_scroll_end()
-                if is_scroll_end:
-                    print("pexels 二次滚动到底部 {}".format(i))
-                    for j in range(5):
-                        elem.send_keys(Keys.PAGE_UP)
-                        time.sleep(1)
-
-                    count += 0
-                    if count > 5:
-                        break
-                else:
-                    count = 0
-
-        imgs = self.browser.find_elements(By.XPATH, '//a//img[@class="spacing_noMargin__F5u9R"]')
-
-        print('Scraping links')
-
-        links = []
-
-        for img in imgs:
-            try:
-                src = img.get_attribute("src")
-                if src:
-                    # 替换 w=500 为 w=640
-                    new_url = src.replace("w=500", "w=1280&h=720")
-                    links.append(new_url)
-            except Exception as e:
-                print('[Exception occurred while collecting links from pexels] {}'.format(e))
-
-        links = self.remove_duplicates(links)
-
-        print('Collect links done. Site: {}, Keyword: {}, Total: {}'.format('pexels', keyword, len(links)))
-        self.browser.close()
-
-        filtered_links = self.filter.filter_links(links)
-        return filtered_links
+        return self.collect('pexels', keyword, add_url)
 
     def google_full(self, keyword, add_url="", limit=100):
-        print('[Full Resolution Mode]')
+        return self.google_full_url("https://www.google.com/search?q={}&tbm=isch{}".format(keyword, add_url), limit)
 
-        self.browser.get("https://www.google.com/search?q={}&tbm=isch{}".format(keyword, add_url))
+    def google_full_url(self, url, limit=100):
+        """
+        先从结果页内嵌的数据和滚动时加载的数据中批量取出原图链接 (google_full_inline)
+        页面中找不到结果数据时退回到逐张点击的 google_full_click
+        """
+        print('[Full Resolution Mode]')
+        limit = 10000 if limit == 0 else limit
+        try:
+            links = self.google_full_inline(url, limit)
+            if not links:
+                print('No inline result data found, clicking through the results')
+                links = self.google_full_click(url, limit)
+        finally:
+            self.release()
+
+        print('Collect links done. Site: {}, Url: {}, Total: {}'.format('google_full', url, len(links)))
+        return links
+
+    def _inline_links(self, found):
+        # found: 已取出的链接
+        for text in self.browser.execute_script(INLINE_DATA_JS):
+            for link in harvest_links('google', text):
+                if link not in found:
+                    found.add(link)
+                    if self.filter.check_link(link):
+                        yield link
+
+    def google_full_inline(self, url, limit):
+        """
+        从内嵌的 AF_initDataCallback 和滚动时 batchexecute 的响应中取出 ["原图", 高, 宽]，每滚动一步读取一次
+        响应由 CAPTURE_RESPONSES_JS 在页面中截获，不需要 performance 日志
+        """
+        source = CAPTURE_RESPONSES_JS % json.dumps(HARVEST_RULES['google'][0])
+        script = self.browser.execute_cdp_cmd('Page.addScriptToEvaluateOnNewDocument', {'source': source})
+        try:
+            self.browser.get(url)
+            found = set()
+            links = list(self._inline_links(found))
+            if not links:
+                return links
+            print('Scrolling down')
+            for _ in self.scroll_engine.steps(RESULT_SELECTORS['google'][0],
+                                              load_more_xpath=LOAD_MORE_XPATHS.get('google')):
+                if len(links) >= limit:
+                    break
+                links.extend(self._inline_links(found))
+            return links[:limit]
+        finally:
+            self.browser.execute_cdp_cmd('Page.removeScriptToEvaluateOnNewDocument',
+                                         {'identifier': script['identifier']})
+
+    def google_full_click(self, url, limit):
+        """点击第一个结果，按方向键逐张打开并读取原图，每张图片需要多次 WebDriver 请求"""
+        self.browser.get(url)
         time.sleep(1)
 
         # Click the first image to get full resolution images
@@ -346,7 +483,7 @@ class CollectLinks:
         print('Scraping links')
 
         links = []
-        limit = 10000 if limit == 0 else limit
+        seen = set()
         count = 1
         last_scroll = 0
         scroll_patience = 0
@@ -363,14 +500,13 @@ class CollectLinks:
                     imgs = body.find_elements(By.XPATH, xpath)
                     t2 = time.time()
                     if len(imgs) > 0:
-                        break_count += 1
+                        break_count = 0
                         break
                     if t2 - t1 > 5:
                         print(f"Failed to locate image by XPATH: {xpath}")
                         break_count += 1
                         break
                     time.sleep(0.1)
-                    break_count = 0
 
                 if break_count > 20:
                     break
@@ -379,7 +515,8 @@ class CollectLinks:
                     self.highlight(imgs[0])
                     src = imgs[0].get_attribute('src')
 
-                    if src is not None and src not in links:
+                    if src is not None and src not in seen:
+                        seen.add(src)
                         # 去掉查询参数和片段
                         is_subdomain = self.is_subdomain(src, 'pexels.com')
                         if is_subdomain:
@@ -412,11 +549,6 @@ class CollectLinks:
 
             body.send_keys(Keys.RIGHT)
 
-        links = self.remove_duplicates(links)
-
-        print('Collect links done. Site: {}, Keyword: {}, Total: {}'.format('google_full', keyword, len(links)))
-        self.browser.close()
-
         filter = LinkFilter()
         filtered_links = filter.filter_links(links)
         return filtered_links
@@ -481,7 +613,7 @@ class CollectLinks:
         links = self.remove_duplicates(links)
 
         print('Collect links done. Site: {}, Keyword: {}, Total: {}'.format('bing_full', keyword, len(links)))
-        self.browser.close()
+        self.release()
 
         filter = LinkFilter()
         filtered_links = filter.filter_links(links)
@@ -517,3 +649,4 @@ if __name__ == '__main__':
     collect = CollectLinks()
     links = collect.pexels('People watching phone screen')
     print(len(links), links)
+    BrowserPool.close_worker()
@@ -16,14 +16,29 @@ Copyright 2018 YoongiKim
 
 import argparse
 import base64
-import imghdr
+import hashlib
+import io
 import os
-import shutil
+import random
 import signal
-from multiprocessing import Pool
-from pathlib import Path
+import time
+from itertools import zip_longest
+from multiprocessing import Pool, util
+from urllib.parse import urlparse
 
-import requests
+from AsyncDownloader import AsyncDownloader
+from ContentStore import ContentStore
+from DomainScheduler import DomainScheduler, RetryLater, SchedulerManager
+from HttpCache import HttpCache
+from HttpSessionPool import HttpSessionPool
+from Metrics import Metrics, MetricsRun
+from ImageHeader import HEAD_SIZE, is_image_complete, is_image_content_type, sniff_image_format
+from PartFile import PartFile
+from RetryPolicy import CircuitBreaker, RetryPolicy, TransientError
+from RunState import RunStateStore, STAGE_COLLECT, STAGE_DOWNLOAD, STATUS_DONE, STATUS_FAILED
+from ShardWriter import ShardWriter
+from SizeFilter import ImageTooLarge, SizeFilter
+from Transcoder import TranscodeStage
 
 
 class Sites:
@@ -70,7 +85,14 @@ class Sites:
 class AutoCrawler:
     def __init__(self, skip_already_exist=True, n_threads=8, do_google=True, do_naver=True, do_bing=True,
                  do_pexels=True, download_path='download',
-                 full_resolution=False, face=False, no_gui=False, limit=0, proxy_list=None):
+                 full_resolution=False, face=False, no_gui=False, limit=0, proxy_list=None, n_inflight=16,
+                 pool_maxsize=0, host_pool_sizes=None, dedup=False, phash=None, phash_threshold=6,
+                 domain_rate=0, domain_concurrency=0, domain_config=None, retries=2, retry_delay=1.0,
+                 breaker_threshold=5, breaker_cooldown=60, http_cache=None, cache_max_age_days=30,
+                 cache_max_bytes=0, resume_min_size=512 * 1024, output='files', shard_size=1024 ** 3,
+                 min_width=0, min_height=0, max_image_bytes=0, transcode=None, max_edge=1024,
+                 transcode_quality=90, transcode_workers=2, transcode_queue=256, chunk_size=50, metrics_port=0,
+                 stream=False, stream_queue=256):
         """
         :param skip_already_exist: Skips keyword already downloaded before. This is needed when re-downloading.
         :param n_threads: Number of threads to download.
@@ -82,6 +104,38 @@ class AutoCrawler:
         :param no_gui: No GUI mode. Acceleration for full_resolution mode.
         :param limit: Maximum count of images to download. (0: infinite)
         :param proxy_list: The proxy list. Every thread will randomly choose one from the list.
+        :param n_inflight: Number of concurrent downloads in each thread. (1: sequential)
+        :param pool_maxsize: Keep-alive connections kept per host in each thread. (0: same as n_inflight)
+        :param host_pool_sizes: Per host override of pool_maxsize, like {'images.pexels.com': 32}
+        :param dedup: Store each unique image once under download_path/images_store and hardlink it into keyword folders
+        :param phash: Perceptual hash method used to find near duplicates after downloading. ('dhash', 'phash', None)
+        :param phash_threshold: Maximum hamming distance between near duplicates
+        :param domain_rate: Requests per second to each domain, shared by all threads. (0: unlimited)
+        :param domain_concurrency: Concurrent requests to each domain, shared by all threads. (0: unlimited)
+        :param domain_config: Per domain override of (domain_rate, domain_concurrency), like {'images.pexels.com': (5, 4)}
+        :param retries: Retries for timeouts, connection errors and 5xx responses, with exponential backoff and jitter
+        :param retry_delay: Maximum delay before the first retry in seconds. Doubled on every retry.
+        :param breaker_threshold: Consecutive failures after which a domain is skipped, shared by all threads. (0: never)
+        :param breaker_cooldown: Seconds a failing domain is skipped before it is tried again
+        :param http_cache: Directory of the HTTP cache used for If-None-Match/If-Modified-Since requests. (None: disabled)
+        :param cache_max_age_days: Cache entries not validated for this many days are evicted. (0: never)
+        :param cache_max_bytes: Least recently validated cache entries are evicted above this size. (0: unlimited)
+        :param resume_min_size: Images at least this large are written to .part files and resumed with Range requests
+        :param output: 'files' writes one file per image, 'tar' writes WebDataset tar shards under download_path/images_shards
+        :param shard_size: Maximum bytes per tar shard
+        :param min_width: Images narrower than this are cancelled after reading their header. (0: unlimited)
+        :param min_height: Images lower than this are cancelled after reading their header. (0: unlimited)
+        :param max_image_bytes: Larger images are skipped, before reading the body when Content-Length is known
+                                and once the limit is passed otherwise. (0: unlimited)
+        :param transcode: Resize and re-encode downloaded images to download_path/images_resized. ('webp', 'jpeg', None)
+        :param max_edge: Maximum width and height of transcoded images. (0: keep the size)
+        :param transcode_quality: WebP/JPEG quality of transcoded images
+        :param transcode_workers: Number of transcoding processes, running alongside the download threads
+        :param transcode_queue: Maximum images waiting to be transcoded. Downloads wait when the queue is full.
+        :param chunk_size: Links per pool task, so idle threads help with large keywords. (0: one task per keyword)
+        :param metrics_port: Serve Prometheus metrics of all threads on http://127.0.0.1:<port>/metrics (0: disabled)
+        :param stream: Collect links with Chrome and download them while scrolling, instead of reading collected links
+        :param stream_queue: Maximum collected links waiting to be downloaded. Scrolling waits when the queue is full.
         """
 
         self.skip = skip_already_exist
@@ -96,6 +150,42 @@ class AutoCrawler:
         self.no_gui = no_gui
         self.limit = limit
         self.proxy_list = proxy_list if proxy_list and len(proxy_list) > 0 else None
+        self.n_inflight = n_inflight
+        self.pool_maxsize = pool_maxsize if pool_maxsize > 0 else n_inflight
+        self.host_pool_sizes = host_pool_sizes or {}
+        self.dedup = dedup
+        self.phash = phash
+        self.phash_threshold = phash_threshold
+        self.domain_rate = domain_rate
+        self.domain_concurrency = domain_concurrency
+        self.domain_config = domain_config or {}
+        self.retry_policy = RetryPolicy(max_retries=retries, base_delay=retry_delay)
+        self.breaker_threshold = breaker_threshold
+        self.breaker_cooldown = breaker_cooldown
+        self.http_cache = http_cache
+        self.cache_max_age_days = cache_max_age_days
+        self.cache_max_bytes = cache_max_bytes
+        self.resume_min_size = resume_min_size
+        self.output = output
+        self.shard_size = shard_size
+        self.min_width = min_width
+        self.min_height = min_height
+        self.max_image_bytes = max_image_bytes
+        self.transcode = transcode
+        self.max_edge = max_edge
+        self.transcode_quality = transcode_quality
+        self.transcode_workers = transcode_workers
+        self.transcode_queue = transcode_queue
+        self.chunk_size = chunk_size
+        self.metrics_port = metrics_port
+        self.stream = stream
+        self.stream_queue = stream_queue
+        self.quota = None  # Shared between threads by do_crawling when keywords are split into chunks
+        if self.transcode and self.output != 'files':
+            print('Transcoding is only available with output files')
+            self.transcode = None
+        self.scheduler = None  # Shared between threads by do_crawling
+        self.breaker = None  # Shared between threads by do_crawling
 
         os.makedirs('./{}'.format(self.download_path), exist_ok=True)
 
@@ -135,10 +225,8 @@ class AutoCrawler:
 
     @staticmethod
     def validate_image(path):
-        ext = imghdr.what(path)
-        if ext == 'jpeg':
-            ext = 'jpg'
-        return ext  # returns None if not valid
+        with open(path, 'rb') as f:
+            return sniff_image_format(f.read(HEAD_SIZE))  # returns None if not valid
 
     @staticmethod
     def make_dir(dirname):
@@ -166,15 +254,80 @@ class AutoCrawler:
         return keywords
 
     @staticmethod
-    def save_object_to_file(object, file_path, is_base64=False):
+    def save_object_to_file(object, file_path, head=b'', hasher=None):
+        """
+        :param object: Readable stream of the rest of the image
+        :param head: Bytes already read from the stream to sniff the format
+        :param hasher: hashlib object updated while streaming, so the file is not read again
+        """
         try:
             with open('{}'.format(file_path), 'wb') as file:
-                if is_base64:
-                    file.write(object)
-                else:
-                    shutil.copyfileobj(object.raw, file)
+                chunk = head
+                while chunk:
+                    if hasher is not None:
+                        hasher.update(chunk)
+                    file.write(chunk)
+                    chunk = object.read(64 * 1024)
+            return True
+        except ImageTooLarge:
+            # Counted as skipped by the size filter
+            if os.path.exists(file_path):
+                os.remove(file_path)
+            return False
         except Exception as e:
+            if os.path.exists(file_path):
+                os.remove(file_path)
+            # Connection drops and read timeouts mid-body go to the retry policy and the circuit breaker
+            if RetryPolicy.is_transient(e):
+                raise
             print('Save failed - {}'.format(e))
+            return False
+
+    def get_session(self):
+        # Created lazily so that every pool worker has its own connections
+        return HttpSessionPool.for_worker(pool_maxsize=self.pool_maxsize, host_maxsize=self.host_pool_sizes)
+
+    def get_content_store(self):
+        return ContentStore.for_worker('{}/images_store'.format(self.download_path.replace('"', '')))
+
+    def get_http_cache(self):
+        if not self.http_cache:
+            return None
+        return HttpCache.for_worker(self.http_cache, self.cache_max_age_days, self.cache_max_bytes)
+
+    def get_shard_writer(self):
+        return ShardWriter.for_worker('{}/images_shards'.format(self.download_path.replace('"', '')), self.shard_size)
+
+    def get_size_filter(self):
+        return SizeFilter.for_worker(self.min_width, self.min_height, self.max_image_bytes)
+
+    def get_scheduler(self):
+        if self.scheduler is None:
+            # Not shared when download_images is called directly
+            return DomainScheduler(self.domain_rate, self.domain_concurrency, self.domain_config)
+        return self.scheduler
+
+    def get_breaker(self):
+        if self.breaker is None:
+            # Not shared when download_images is called directly
+            return CircuitBreaker(self.breaker_threshold, self.breaker_cooldown)
+        return self.breaker
+
+    @staticmethod
+    def get_domain(item):
+        return urlparse(str(item[1])).hostname  # None for data: links
+
+    def get_run_state(self):
+        return RunStateStore.for_worker('{}/run_state.sqlite'.format(self.download_path.replace('"', '')))
+
+    @staticmethod
+    def url_file_name(keyword):
+        return '{}.txt'.format(keyword.replace('"', '').replace(' ', '_'))
+
+    def list_url_files(self, site_name):
+        # Links collected before run_state.sqlite existed are only recorded as files
+        path = '{}/images_url/{}'.format(self.download_path, site_name)
+        return set(os.listdir(path)) if os.path.isdir(path) else set()
 
     @staticmethod
     def base64_to_object(src):
@@ -182,63 +335,277 @@ class AutoCrawler:
         data = base64.decodebytes(bytes(encoded, encoding='utf-8'))
         return data
 
-    def download_images(self, keyword, links, site_name, max_count=0):
-        self.make_dir(
-            '{}/images_file/{}/{}'.format(self.download_path, site_name, keyword.replace('"', '').replace(' ', '_').replace('-', '_')))
+    def plan_downloads(self, keyword, links, site_name, max_count=0):
+        """
+        Registers the links in the run state.
+        :return: ([(index, link), ...] not downloaded yet, count already downloaded, max_count)
+        """
         total = len(links)
-        success_count = 0
-
         if max_count == 0:
             max_count = total
 
-        for index, link in enumerate(links):
-            if success_count >= max_count:
-                break
+        # Resume at URL level: links downloaded by a previous run keep their index and count towards the limit
+        state = self.get_run_state()
+        # The index names the file, so it comes from the run state rather than the position in the links file
+        state.add_urls(site_name, keyword, links)
+        statuses = state.url_status(site_name, keyword)
+        todo = [(statuses[link][1], link) for link in links if statuses[link][0] != STATUS_DONE]
+        done_count = total - len(todo)
+        if done_count > 0:
+            print('Resuming {} from {}: {} already downloaded'.format(keyword, site_name, done_count))
+        return todo, done_count, max_count
 
-            try:
-                print('Downloading {} from {}: {} / {}'.format(keyword, site_name, success_count + 1, max_count))
-
-                if str(link).startswith('data:image/jpeg;base64'):
-                    response = self.base64_to_object(link)
-                    ext = 'jpg'
-                    is_base64 = True
-                elif str(link).startswith('data:image/png;base64'):
-                    response = self.base64_to_object(link)
-                    ext = 'png'
-                    is_base64 = True
-                else:
-                    response = requests.get(link, stream=True, timeout=10)
-                    ext = self.get_extension_from_link(link)
-                    is_base64 = False
-
-                no_ext_path = '{}/images_file/{}/{}/{}_{}_{}'.format(self.download_path.replace('"', ''), site_name,
-                                                                     keyword.replace('"', '').replace(' ', '_').replace('-', '_'),
-                                                                     site_name,
-                                                                     keyword.replace('"', '').replace(' ', '_').replace('-', '_'),
-                                                                     str(index).zfill(4))
-                path = no_ext_path + '.' + ext
-                self.save_object_to_file(response, path, is_base64=is_base64)
-
-                success_count += 1
-                del response
-
-                ext2 = self.validate_image(path)
-                if ext2 is None:
-                    print('Unreadable file - {}'.format(link))
-                    os.remove(path)
-                    success_count -= 1
-                else:
-                    if ext != ext2:
-                        path2 = no_ext_path + '.' + ext2
-                        os.rename(path, path2)
-                        print('Renamed extension {} -> {}'.format(ext, ext2))
+    def download_items(self, keyword, site_name, items, total, max_count=0, quota_key=None):
+        """
+        :param items: [(index, link), ...]
+        :param quota_key: Key of the shared KeywordQuota when the keyword is split into chunks
+        :return: Number of images downloaded, None when interrupted
+        """
+        keyword_dir = keyword.replace('"', '').replace(' ', '_').replace('-', '_')
+        self.make_dir('{}/images_file/{}/{}'.format(self.download_path, site_name, keyword_dir))
+        state = self.get_run_state()
+        metrics = Metrics.for_worker()
 
-            except KeyboardInterrupt:
-                break
+        def download_fn(item):
+            index, link = item
+            print('Downloading {} from {}: {} / {}'.format(keyword, site_name, index + 1, total))
+            with metrics.timer('download_seconds', site=site_name):
+                path = self.download_image(link, site_name, keyword_dir, index)
+            state.mark_url(site_name, keyword, link, STATUS_DONE if path else STATUS_FAILED, path)
+            return path
 
-            except Exception as e:
-                print('Download failed - ', e)
-                continue
+        try:
+            breaker = self.get_breaker()
+            downloader = AsyncDownloader(self.n_inflight, scheduler=self.get_scheduler(), key_fn=self.get_domain,
+                                         retry_policy=self.retry_policy, breaker=breaker,
+                                         quota=self.quota if quota_key is not None else None, quota_key=quota_key,
+                                         metrics=metrics)
+            count = downloader.run(items, download_fn, max_count=max_count)
+        except KeyboardInterrupt:
+            return None
+        if downloader.retried or downloader.short_circuited:
+            print('Retried {} links, skipped {} links of failing domains'.format(downloader.retried,
+                                                                                downloader.short_circuited))
+        if self.breaker is None:
+            breaker.print_summary()
+        return count
+
+    def download_images(self, keyword, links, site_name, max_count=0):
+        todo, done_count, max_count = self.plan_downloads(keyword, links, site_name, max_count)
+
+        success_count = done_count
+        if done_count < max_count:
+            count = self.download_items(keyword, site_name, todo, len(links), max_count=max_count - done_count)
+            if count is None:
+                return None
+            success_count += count
+
+        print('Downloaded {} from {}: {} / {}'.format(keyword, site_name, success_count, max_count))
+        return success_count
+
+    def download_image(self, link, site_name, keyword_dir, index):
+        path = self.fetch_image(link, site_name, keyword_dir, index)
+        # Without hardlink support the content store and the HTTP cache only record the image in manifest.jsonl
+        if path and os.path.isfile(path):
+            Metrics.for_worker().inc('download_bytes_total', os.path.getsize(path), site=site_name)
+        if path and self.transcode:
+            TranscodeStage.submit(path, self.transcoded_path(path))
+            Metrics.for_worker().gauge('transcode_queue_depth', TranscodeStage.queue_depth())
+        if path and self.output == 'tar':
+            return self.move_to_shard(path, link, site_name, keyword_dir, index)
+        return path
+
+    def transcoded_path(self, path):
+        download_path = self.download_path.replace('"', '')
+        relative = os.path.relpath(os.path.splitext(path)[0], '{}/images_file'.format(download_path))
+        return '{}/images_resized/{}.{}'.format(download_path, relative, TranscodeStage.extension(self.transcode))
+
+    def stored_path(self, path):
+        """
+        Path to read a saved image from.
+        Without hardlink support the content store and the HTTP cache only record it in manifest.jsonl,
+        then its blob is read instead. None when neither exists.
+        """
+        if os.path.isfile(path):
+            return path
+        stores = []
+        if self.dedup:
+            stores.append(self.get_content_store())
+        if self.http_cache:
+            stores.append(self.get_http_cache().store)
+        for store in stores:
+            blob = store.referenced_blob(path)
+            if blob is not None:
+                return blob
+        return None
+
+    @staticmethod
+    def remove_empty_dirs(path):
+        # Tar output moves every image into a shard, which leaves the keyword folders empty
+        for root, dirs, files in os.walk(path, topdown=False):
+            if root != path and not os.listdir(root):
+                os.rmdir(root)
+
+    def move_to_shard(self, path, link, site_name, keyword_dir, index):
+        # WebDataset splits the key from the extension at the first dot
+        key = '{}/{}/{}'.format(site_name, keyword_dir, str(index).zfill(4)).replace('.', '_')
+        ext = os.path.splitext(path)[1][1:]
+        meta = {'url': link if not str(link).startswith('data:') else 'data:', 'site': site_name,
+                'keyword': keyword_dir, 'index': index, 'format': ext}
+        source = self.stored_path(path)
+        if source is None:
+            raise FileNotFoundError(path)
+        location = self.get_shard_writer().add_file(key, ext, source, meta)
+        if source == path:
+            os.remove(path)
+        return location
+
+    def fetch_image(self, link, site_name, keyword_dir, index):
+        response = None
+        no_ext_path = '{}/images_file/{}/{}/{}_{}_{}'.format(self.download_path.replace('"', ''), site_name,
+                                                             keyword_dir, site_name, keyword_dir, str(index).zfill(4))
+        cache = self.get_http_cache()
+        size_filter = self.get_size_filter()
+        content_length = 0
+        try:
+            if str(link).startswith('data:image/'):
+                stream = io.BytesIO(self.base64_to_object(link))
+                head = size_filter.read_head(stream)
+                cache = None
+            else:
+                part = PartFile(no_ext_path)
+                offset, headers = part.resume_headers(link)
+                entry = None
+                if not offset:
+                    entry = cache.lookup(link) if cache is not None else None
+                    headers = HttpCache.conditional_headers(entry)
+                response = self.get_session().get(link, stream=True, timeout=10, headers=headers)
+                if response.status_code == 304 and entry is not None:
+                    # Not modified: link the cached copy instead of transferring it again
+                    path = no_ext_path + '.' + entry['ext']
+                    cache.hit(link, entry, path)
+                    return path
+                if response.status_code in (429, 503):
+                    # The domain is paused and the link is queued again
+                    raise RetryLater.from_response(response)
+                if response.status_code in (500, 502, 504):
+                    # Retried with backoff and counted by the circuit breaker
+                    raise TransientError('HTTP {} - {}'.format(response.status_code, link))
+                if response.status_code == 416:
+                    # The part file does not match the copy on the server any more
+                    part.remove()
+                    raise TransientError('HTTP 416 - {}'.format(link))
+                if response.status_code == 206 and offset:
+                    if not part.check_range(response, offset):
+                        part.remove()
+                        raise TransientError('Unexpected Content-Range - {}'.format(link))
+                    return self.save_part(link, response, part, offset, no_ext_path, cache)
+                content_type = response.headers.get('Content-Type')
+                if response.status_code != 200 or not is_image_content_type(content_type):
+                    # Abort error pages before reading the body
+                    print('Not an image - {} ({} {})'.format(link, response.status_code, content_type))
+                    return None
+                content_length = int(response.headers.get('Content-Length') or 0)
+                if size_filter.reject_length(link, content_length):
+                    return None
+                if PartFile.is_resumable(response, self.resume_min_size):
+                    return self.save_part(link, response, part, 0, no_ext_path, cache)
+                if offset:
+                    # The server ignored the Range request
+                    part.remove()
+                response.raw.decode_content = True
+                head, stream = size_filter.read_head(response.raw), response.raw
+
+            # Sniff the format from the first bytes so the file is written once with the right extension
+            ext = sniff_image_format(head)
+            if ext is None:
+                print('Unreadable file - {}'.format(link))
+                return None
+
+            # Cancel undersized images after the first few KB
+            if size_filter.reject_dimensions(link, head, content_length):
+                return None
+            # Responses without a Content-Length are cut off once they pass --max-image-bytes
+            stream = size_filter.limit_stream(link, stream, len(head))
+
+            if cache is not None and HttpCache.is_cacheable(response):
+                return self.save_cached(head, stream, no_ext_path + '.' + ext, cache, link, response, ext)
+
+            if self.dedup:
+                return self.save_deduplicated(head, stream, no_ext_path + '.' + ext)
+
+            path = no_ext_path + '.' + ext
+            return path if self.save_object_to_file(stream, path, head=head) else None
+
+        except RetryLater:
+            raise
+
+        except Exception as e:
+            if RetryPolicy.is_transient(e):
+                raise
+            print('Download failed - ', e)
+            return None
+
+        finally:
+            if response is not None:
+                response.close()
+
+    def save_deduplicated(self, head, stream, path):
+        store = self.get_content_store()
+        temp_path = store.temp_path()
+        hasher = hashlib.sha256()
+        if not self.save_object_to_file(stream, temp_path, head=head, hasher=hasher):
+            return None
+
+        store.commit(temp_path, hasher.hexdigest(), path)
+        return path
+
+    def save_part(self, link, response, part, offset, no_ext_path, cache):
+        """
+        Writes a large image to a .part file, which is kept when the download is interrupted
+        and continued with a Range request by the next attempt or the next run.
+        """
+        if offset == 0:
+            size_filter = self.get_size_filter()
+            head = size_filter.read_head(response.raw)
+            if size_filter.reject_dimensions(link, head, int(response.headers.get('Content-Length') or 0)):
+                return None
+            part.start(link, response)
+        else:
+            head = part.read_head()
+            print('Resuming download at {} bytes - {}'.format(offset, link))
+
+        ext = sniff_image_format(head)
+        if ext is None:
+            print('Unreadable file - {}'.format(link))
+            part.remove()
+            return None
+
+        # Errors propagate and keep the bytes written so far
+        part.append(head if offset == 0 else b'', response.raw)
+
+        if not part.is_complete() or not is_image_complete(part.path, ext):
+            part.remove()
+            raise TransientError('Incomplete download - {}'.format(link))
+
+        path = no_ext_path + '.' + ext
+        if cache is not None and HttpCache.is_cacheable(response):
+            cache.save(link, response, part.path, part.digest(), ext, path)
+        elif self.dedup:
+            self.get_content_store().commit(part.path, part.digest(), path)
+        else:
+            os.replace(part.path, path)
+        part.remove()
+        return path
+
+    def save_cached(self, head, stream, path, cache, link, response, ext):
+        temp_path = cache.store.temp_path()
+        hasher = hashlib.sha256()
+        if not self.save_object_to_file(stream, temp_path, head=head, hasher=hasher):
+            return None
+
+        cache.save(link, response, temp_path, hasher.hexdigest(), ext, path)
+        return path
 
     def download_from_site(self, keyword, site_code):
         site_name = Sites.get_text(site_code)
@@ -247,111 +614,362 @@ class AutoCrawler:
             print('Collecting links... {} from {}'.format(keyword, site_name))
 
             print('Downloading images from collected links... {} from {}'.format(keyword, site_name))
-            txt_file_path = '{}/{}/{}/{}.txt'.format(self.download_path, 'images_url', site_name,
-                                                     keyword.replace('"', '').replace(' ', '_'))
-            # 确保文件夹路径存在
-            os.makedirs(os.path.dirname(txt_file_path), exist_ok=True)
-            with open(txt_file_path.format(site_name), 'r', encoding='utf-8-sig') as f:
-                text = f.read()
-                lines = text.split('\n')
-                lines = filter(lambda x: x != '' and x is not None, lines)
-                links = sorted(set(lines))
+            links = self.read_links(keyword, site_name)
 
             print('Downloading images from collected links... {} from {}'.format(keyword, site_name))
-            self.download_images(keyword, links, site_name, max_count=self.limit)
-            Path('{}/{}/{}_done'.format(self.download_path, keyword.replace('"', ''), site_name)).touch()
+            if self.download_images(keyword, links, site_name, max_count=self.limit) is not None:
+                self.get_run_state().set_task_status(site_name, keyword, STAGE_DOWNLOAD, STATUS_DONE)
 
+            self.finish_task()
             print('Done write image url  {} : {}'.format(site_name, keyword))
 
         except Exception as e:
             print('Exception {}:{} - {}'.format(site_name, keyword, e))
             return
 
+    def stream_from_site(self, keyword, site_code):
+        """
+        Collects links of the keyword and downloads them in the same task.
+        Links are downloaded as soon as they are found while the page is still scrolling.
+        """
+        # Chrome is only needed in stream mode
+        from collect_links import CollectLinks
+        from LinkStream import LinkStream
+
+        site_name = Sites.get_text(site_code)
+        add_url = Sites.get_face_url(site_code) if self.face else ""
+        metrics = Metrics.for_worker()
+        state = self.get_run_state()
+
+        statuses = state.url_status(site_name, keyword)
+        done_count = sum(1 for status, _ in statuses.values() if status == STATUS_DONE)
+        if 0 < self.limit <= done_count:
+            print('Downloaded {} from {}: {} / {}'.format(keyword, site_name, done_count, self.limit))
+            state.set_task_status(site_name, keyword, STAGE_COLLECT, STATUS_DONE)
+            state.set_task_status(site_name, keyword, STAGE_DOWNLOAD, STATUS_DONE)
+            return
+        if done_count > 0:
+            print('Resuming {} from {}: {} already downloaded'.format(keyword, site_name, done_count))
+
+        try:
+            proxy = random.choice(self.proxy_list) if self.proxy_list else None
+            collect = CollectLinks(no_gui=self.no_gui, proxy=proxy)
+        except Exception as e:
+            print('Error occurred while initializing chromedriver - {}'.format(e))
+            metrics.inc('collect_errors_total', site=site_name)
+            return
+
+        print('Collecting and downloading... {} from {}'.format(keyword, site_name))
+        txt_file_path = '{}/{}/{}/{}'.format(self.download_path, 'images_url', site_name, self.url_file_name(keyword))
+        os.makedirs(os.path.dirname(txt_file_path), exist_ok=True)
+        started = time.time()
+        stream = LinkStream(collect.stream(site_name, keyword, add_url), self.stream_queue).start()
+        try:
+            with open(txt_file_path, 'a', encoding='utf-8') as url_file:
+                items = self.stream_items(stream, site_name, keyword, statuses, url_file)
+                count = self.download_items(keyword, site_name, items, '?',
+                                            max_count=max(0, self.limit - done_count) if self.limit else 0)
+        finally:
+            # Stops scrolling once the limit is reached
+            stream.close()
+            collect.release()
+        metrics.observe('collect_seconds', time.time() - started, site=site_name)
+
+        if count is None:
+            return
+        print('Collected {} links, downloaded {} from {}: {}'.format(stream.produced, keyword, site_name,
+                                                                     done_count + count))
+        state.set_task_status(site_name, keyword, STAGE_COLLECT, STATUS_DONE)
+        state.set_task_status(site_name, keyword, STAGE_DOWNLOAD, STATUS_DONE)
+
+    def stream_items(self, stream, site_name, keyword, statuses, url_file):
+        """
+        Registers every streamed link in the run state and the links file, then yields it for download.
+        :return: Generator of (index, link), AsyncDownloader.IDLE while waiting for the collector
+        """
+        state = self.get_run_state()
+        metrics = Metrics.for_worker()
+        for link in stream:
+            if link is AsyncDownloader.IDLE:
+                yield link
+                continue
+            if statuses.get(link, (None, None))[0] == STATUS_DONE:
+                continue
+            index = state.add_urls(site_name, keyword, [link])[link]
+            url_file.write(link + '\n')
+            url_file.flush()
+            metrics.inc('links_collected_total', site=site_name)
+            yield index, link
+
+    def stream_download(self, args):
+        keyword, site_code, collected = args
+        site_name = Sites.get_text(site_code)
+        started = time.time()
+        try:
+            if collected:
+                self.download_from_site(keyword, site_code)
+                return site_name, keyword, None, os.getpid(), started, time.time()
+            self.stream_from_site(keyword, site_code)
+            self.finish_task()
+        except Exception as e:
+            print('Exception {}:{} - {}'.format(site_name, keyword, e))
+        return site_name, keyword, None, os.getpid(), started, time.time()
+
+    def read_links(self, keyword, site_name):
+        txt_file_path = '{}/{}/{}/{}'.format(self.download_path, 'images_url', site_name,
+                                             self.url_file_name(keyword))
+        # 确保文件夹路径存在
+        os.makedirs(os.path.dirname(txt_file_path), exist_ok=True)
+        with open(txt_file_path.format(site_name), 'r', encoding='utf-8-sig') as f:
+            text = f.read()
+            lines = text.split('\n')
+            lines = filter(lambda x: x != '' and x is not None, lines)
+            return sorted(set(lines))
+
+    def finish_task(self):
+        self.get_session().stats.print_summary()
+        if self.dedup:
+            self.get_content_store().print_summary()
+        if self.http_cache:
+            self.get_http_cache().print_summary()
+        if self.output == 'tar':
+            # Terminates the tar so finished keywords are readable, the next keyword appends to it
+            self.get_shard_writer().close()
+            self.get_shard_writer().print_summary()
+        if self.min_width or self.min_height or self.max_image_bytes:
+            self.get_size_filter().print_summary()
+        Metrics.for_worker().flush()
+
     def download(self, args):
+        started = time.time()
         self.download_from_site(keyword=args[0], site_code=args[1])
+        return Sites.get_text(args[1]), args[0], None, os.getpid(), started, time.time()
+
+    def download_chunk(self, args):
+        keyword, site_code, items, total = args
+        site_name = Sites.get_text(site_code)
+        started = time.time()
+        try:
+            count = self.download_items(keyword, site_name, items, total, quota_key=(site_name, keyword))
+        except Exception as e:
+            print('Exception {}:{} - {}'.format(site_name, keyword, e))
+            count = None
+        return site_name, keyword, count, os.getpid(), started, time.time()
 
-    def init_worker(self):
+    def plan_chunks(self, tasks):
+        """
+        Splits the links of every keyword into chunks, interleaved across keywords.
+        :return: ([(keyword, site_code, [(index, link), ...], total), ...], {(site_name, keyword): chunk count})
+        """
+        keyword_chunks = []
+        remaining = {}
+        for keyword, site_code in tasks:
+            site_name = Sites.get_text(site_code)
+            try:
+                links = self.read_links(keyword, site_name)
+            except OSError as e:
+                print('Exception {}:{} - {}'.format(site_name, keyword, e))
+                continue
+
+            todo, done_count, max_count = self.plan_downloads(keyword, links, site_name, max_count=self.limit)
+            # The limit is shared by all chunks of the keyword
+            self.quota.set((site_name, keyword), max(0, max_count - done_count))
+            chunks = [(keyword, site_code, todo[i:i + self.chunk_size], len(links))
+                      for i in range(0, len(todo), self.chunk_size)] if done_count < max_count else []
+            if not chunks:
+                self.get_run_state().set_task_status(site_name, keyword, STAGE_DOWNLOAD, STATUS_DONE)
+                continue
+            remaining[(site_name, keyword)] = len(chunks)
+            keyword_chunks.append(chunks)
+
+        return [chunk for group in zip_longest(*keyword_chunks) for chunk in group if chunk], remaining
+
+    def print_worker_timeline(self, timings, started):
+        """
+        :param timings: [(pid, task started, task ended), ...]
+        :return: Run time, time until the first thread ran out of work, tail and utilization
+        """
+        ended = time.time()
+        last_end = {}
+        busy = 0
+        for pid, task_started, task_ended in timings:
+            last_end[pid] = max(last_end.get(pid, started), task_ended)
+            busy += task_ended - task_started
+        # A thread that never got a task was idle from the start
+        first_idle = min(last_end.values()) if len(last_end) >= self.n_threads else started
+        stats = {'seconds': ended - started, 'first_idle': first_idle - started, 'tail': ended - first_idle,
+                 'utilization': busy / max(1e-9, (ended - started) * self.n_threads)}
+        print('Workers - run: {seconds:.1f}s, first thread out of work at {first_idle:.1f}s, '
+              'tail: {tail:.1f}s, utilization: {utilization:.0%}'.format(**stats))
+        return stats
+
+    def init_worker(self, metrics_registry=None, transcode_tasks=None, transcode_counters=None, driver_path=None):
         signal.signal(signal.SIGINT, signal.SIG_IGN)
+        if metrics_registry is not None:
+            Metrics.for_worker().attach(metrics_registry)
+        if transcode_tasks is not None:
+            TranscodeStage.attach(transcode_tasks, transcode_counters)
+        if self.chunk_size > 0 and not self.stream:
+            # A keyword is split into many small chunks, so summaries are printed and the tar shard is
+            # terminated once when the thread exits instead of after every chunk
+            util.Finalize(None, self.finish_task, exitpriority=5)
+        if driver_path is not None:
+            from BrowserPool import BrowserPool
+
+            BrowserPool.set_driver_path(driver_path)
+            # Warm browsers of the thread are closed when it exits
+            util.Finalize(None, BrowserPool.close_worker, exitpriority=10)
+
+    def start_transcode_stage(self):
+        return TranscodeStage(self.transcode_workers, self.max_edge, self.transcode, self.transcode_quality,
+                              self.transcode_queue).start()
 
     def do_crawling(self):
         tasks = []
 
-        site_name = Sites.get_text(Sites.GOOGLE)
-        keywords = self.get_keywords(site_name=site_name)
-        if keywords:
-            for keyword in keywords:
-                dir_name = '{}/images_file/{}/{}'.format(self.download_path, site_name, keyword)
-                google_done = os.path.exists(os.path.join(os.getcwd(), dir_name, 'google_done'))
-                if google_done and self.skip:
-                    print('Skipping done task {}'.format(dir_name))
-                    continue
+        # One query each instead of probing the file system for every keyword
+        state = self.get_run_state()
+        collected = state.done_keywords(STAGE_COLLECT)
+        downloaded = state.done_keywords(STAGE_DOWNLOAD)
+        stream_done = set()
 
-                if self.do_google and not google_done:
-                    if self.full_resolution:
-                        tasks.append([keyword, Sites.GOOGLE_FULL])
-                    else:
-                        tasks.append([keyword, Sites.GOOGLE])
+        for site_code, site_full_code, enabled in [(Sites.GOOGLE, Sites.GOOGLE_FULL, self.do_google),
+                                                   (Sites.BING, Sites.BING_FULL, self.do_bing),
+                                                   (Sites.PEXELS, Sites.PEXELS_FULL, self.do_pexels),
+                                                   (Sites.NAVER, Sites.NAVER_FULL, self.do_naver)]:
+            site_name = Sites.get_text(site_code)
+            keywords = self.get_keywords(site_name=site_name)
+            if not enabled or not keywords:
+                continue
 
-        site_name = Sites.get_text(Sites.BING)
-        keywords = self.get_keywords(site_name=site_name)
-        if keywords:
+            url_files = self.list_url_files(site_name)
             for keyword in keywords:
-                dir_name = '{}/images_file/{}/{}'.format(self.download_path, site_name, keyword)
-                bing_done = os.path.exists(os.path.join(os.getcwd(), dir_name, 'bing_done'))
-                if bing_done and self.skip:
-                    print('Skipping done task {}'.format(dir_name))
+                if (site_name, keyword) in downloaded and self.skip:
+                    print('Skipping done task {} : {}'.format(site_name, keyword))
                     continue
 
-                if self.do_bing and not bing_done:
-                    if self.full_resolution:
-                        tasks.append([keyword, Sites.BING_FULL])
-                    else:
-                        tasks.append([keyword, Sites.BING])
-
-        site_name = Sites.get_text(Sites.PEXELS)
-        keywords = self.get_keywords(site_name=site_name)
-        if keywords:
-            for keyword in keywords:
-                dir_name = '{}/images_file/{}/{}'.format(self.download_path, site_name, keyword)
-                pexels_done = os.path.exists(os.path.join(os.getcwd(), dir_name, 'pexels_done'))
-                if pexels_done and self.skip:
-                    print('Skipping done task {}'.format(dir_name))
+                if self.stream:
+                    # The links file of an interrupted stream is incomplete, only finished collections are reused
+                    if (site_name, keyword) in collected:
+                        stream_done.add((site_name, keyword))
+                elif (site_name, keyword) not in collected and self.url_file_name(keyword) not in url_files:
+                    print('No collected links {} : {}'.format(site_name, keyword))
                     continue
 
-                if self.do_pexels and not pexels_done:
-                    if self.full_resolution:
-                        tasks.append([keyword, Sites.PEXELS_FULL])
-                    else:
-                        tasks.append([keyword, Sites.PEXELS])
+                if self.full_resolution and not self.stream:
+                    tasks.append([keyword, site_full_code])
+                else:
+                    tasks.append([keyword, site_code])
 
-        site_name = Sites.get_text(Sites.NAVER)
-        keywords = self.get_keywords(site_name=site_name)
-        if keywords:
-            for keyword in keywords:
-                dir_name = '{}/images_file/{}/{}'.format(self.download_path, site_name, keyword)
-                naver_done = os.path.exists(os.path.join(os.getcwd(), dir_name, 'naver_done'))
-                if naver_done and self.skip:
-                    print('Skipping done task {}'.format(dir_name))
-                    continue
+        if self.http_cache:
+            # Closed before the pool forks, a sqlite connection must not be inherited by the threads
+            cache = HttpCache(self.http_cache, self.cache_max_age_days, self.cache_max_bytes)
+            try:
+                count, freed = cache.evict()
+            finally:
+                cache.close()
+            print('HTTP cache - evicted {} entries, freed {} bytes'.format(count, freed))
 
-                if self.do_naver and not naver_done:
-                    if self.full_resolution:
-                        tasks.append([keyword, Sites.NAVER_FULL])
-                    else:
-                        tasks.append([keyword, Sites.NAVER])
+        # Rate limits and concurrency caps per domain are shared by all threads
+        manager = SchedulerManager()
+        manager.start(signal.signal, (signal.SIGINT, signal.SIG_IGN))
+        self.scheduler = manager.DomainScheduler(self.domain_rate, self.domain_concurrency, self.domain_config)
+        self.breaker = manager.CircuitBreaker(self.breaker_threshold, self.breaker_cooldown)
 
-        try:
-            pool = Pool(self.n_threads, initializer=self.init_worker)
-            pool.map(self.download, tasks)
-        except KeyboardInterrupt:
-            pool.terminate()
-            pool.join()
+        # Idle threads take the next chunk of links instead of waiting for the largest keyword to finish
+        remaining = {}
+        driver_path = None
+        if self.stream:
+            jobs = [(keyword, site_code, (Sites.get_text(site_code), keyword) in stream_done)
+                    for keyword, site_code in tasks]
+            download_fn = self.stream_download
+            if self.full_resolution:
+                print('Stream mode collects thumbnail links, full resolution is ignored')
+            if not all(collected_before for _, _, collected_before in jobs):
+                # Resolved once here instead of in every thread
+                from BrowserPool import BrowserPool
+                try:
+                    driver_path = BrowserPool.driver_path()
+                except Exception as e:
+                    print('Error occurred while installing chromedriver - {}'.format(e))
+        elif self.chunk_size > 0:
+            self.quota = manager.KeywordQuota()
+            jobs, remaining = self.plan_chunks(tasks)
+            download_fn = self.download_chunk
+            print('{} keywords split into {} chunks of up to {} links'.format(len(remaining), len(jobs),
+                                                                             self.chunk_size))
         else:
-            pool.terminate()
-            pool.join()
-        print('Task ended. Pool join.')
+            jobs, download_fn = tasks, self.download
+
+        # Pool workers are daemonic and cannot start processes, so the transcoding pool is started here
+        stage = self.start_transcode_stage() if self.transcode else None
+
+        timings = []
+        started = time.time()
+        # Counters of all threads are merged into one registry, summarized to a JSON file at exit
+        metrics_run = MetricsRun(self.metrics_port,
+                                 '{}/metrics_download.json'.format(self.download_path.replace('"', '')))
+        with metrics_run as metrics_registry:
+            initargs = (metrics_registry, stage.tasks if stage is not None else None,
+                        stage.counters if stage is not None else None, driver_path)
+            try:
+                pool = Pool(self.n_threads, initializer=self.init_worker, initargs=initargs)
+                for site_name, keyword, count, pid, task_started, task_ended in pool.imap_unordered(download_fn,
+                                                                                                    jobs):
+                    timings.append((pid, task_started, task_ended))
+                    if (site_name, keyword) not in remaining:
+                        continue
+                    if count is None:
+                        # Interrupted or failed chunks are downloaded again by the next run
+                        remaining.pop((site_name, keyword))
+                        continue
+                    remaining[(site_name, keyword)] -= 1
+                    if remaining[(site_name, keyword)] == 0:
+                        count = self.quota.success((site_name, keyword))
+                        print('Downloaded {} from {}: {}'.format(keyword, site_name, count))
+                        state.set_task_status(site_name, keyword, STAGE_DOWNLOAD, STATUS_DONE)
+            except KeyboardInterrupt:
+                pool.terminate()
+                pool.join()
+            else:
+                # Workers exit normally so their queued transcode tasks are flushed
+                pool.close()
+                pool.join()
+            print('Task ended. Pool join.')
+            timeline = self.print_worker_timeline(timings, started)
+
+            if stage is not None:
+                stage.stop()
+                stage.print_summary()
+
+        for domain, stats in sorted(self.scheduler.stats().items()):
+            if stats['throttled'] > 0:
+                print('Throttled domain {} - requests: {}, throttled: {}'.format(domain, stats['requests'],
+                                                                                 stats['throttled']))
+        CircuitBreaker.print_stats(self.breaker.stats())
+        self.scheduler = None
+        self.breaker = None
+        self.quota = None
+        manager.shutdown()
+
+        if self.output == 'tar':
+            self.remove_empty_dirs('{}/images_file'.format(self.download_path.replace('"', '')))
+
+        if self.phash:
+            self.near_duplicate_check()
 
         print('End Program')
+        return timeline
+
+    def near_duplicate_check(self):
+        # Imported here because numpy and Pillow are only needed for this stage
+        from PerceptualHash import NearDuplicateIndex
+
+        print('Near duplicate checking...')
+        download_path = self.download_path.replace('"', '')
+        index = NearDuplicateIndex('{}/{}_index.tsv'.format(download_path, self.phash), method=self.phash)
+        index.update('{}/images_file'.format(download_path))
+        index.write_report('{}/near_duplicates.txt'.format(download_path), threshold=self.phash_threshold)
 
 
 if __name__ == '__main__':
@@ -375,6 +993,64 @@ if __name__ == '__main__':
     parser.add_argument('--proxy-list', type=str, default='',
                         help='The comma separated proxy list like: "socks://127.0.0.1:1080,http://127.0.0.1:1081". '
                              'Every thread will randomly choose one from the list.')
+    parser.add_argument('--inflight', type=int, default=16,
+                        help='Number of concurrent downloads in each thread. (1: sequential)')
+    parser.add_argument('--pool-size', type=int, default=0,
+                        help='Keep-alive connections kept per host in each thread. (0: same as --inflight)')
+    parser.add_argument('--host-pool-sizes', type=str, default='',
+                        help='Per host connection pool sizes like: "images.pexels.com=32,cloudfront.net=16"')
+    parser.add_argument('--dedup', type=str, default='false',
+                        help='Store each unique image once and hardlink it into keyword folders (boolean)')
+    parser.add_argument('--domain-rate', type=float, default=0,
+                        help='Requests per second to each domain, shared by all threads. (0: unlimited)')
+    parser.add_argument('--domain-concurrency', type=int, default=0,
+                        help='Concurrent requests to each domain, shared by all threads. (0: unlimited)')
+    parser.add_argument('--domain-config', type=str, default='',
+                        help='Per domain "rate/concurrency" like: "images.pexels.com=5/4,cloudfront.net=20/8"')
+    parser.add_argument('--phash', type=str, default='false',
+                        help='Find near duplicate images after downloading: false, dhash or phash')
+    parser.add_argument('--phash-threshold', type=int, default=6,
+                        help='Maximum hamming distance between near duplicates.')
+    parser.add_argument('--retries', type=int, default=2,
+                        help='Retries for timeouts, connection errors and 5xx responses, with exponential backoff.')
+    parser.add_argument('--retry-delay', type=float, default=1.0,
+                        help='Maximum delay before the first retry in seconds. Doubled on every retry.')
+    parser.add_argument('--breaker-threshold', type=int, default=5,
+                        help='Consecutive failures after which a domain is skipped. (0: never)')
+    parser.add_argument('--breaker-cooldown', type=float, default=60,
+                        help='Seconds a failing domain is skipped before it is tried again.')
+    parser.add_argument('--http-cache', type=str, default='',
+                        help='Directory of the HTTP cache shared by repeated runs, like: "http_cache" (empty: disabled)')
+    parser.add_argument('--cache-max-age-days', type=float, default=30,
+                        help='Evict cache entries not validated for this many days. (0: never)')
+    parser.add_argument('--cache-max-bytes', type=int, default=0,
+                        help='Evict least recently validated cache entries above this size in bytes. (0: unlimited)')
+    parser.add_argument('--resume-min-size', type=int, default=512 * 1024,
+                        help='Images at least this many bytes are written to .part files and resumed after interruptions.')
+    parser.add_argument('--output', type=str, default='files',
+                        help='"files": one file per image, "tar": WebDataset tar shards under download/images_shards')
+    parser.add_argument('--shard-size', type=int, default=1024 ** 3, help='Maximum bytes per tar shard.')
+    parser.add_argument('--min-width', type=int, default=0,
+                        help='Skip images narrower than this, checked from the image header. (0: unlimited)')
+    parser.add_argument('--min-height', type=int, default=0,
+                        help='Skip images lower than this, checked from the image header. (0: unlimited)')
+    parser.add_argument('--max-image-bytes', type=int, default=0,
+                        help='Skip images larger than this many bytes. (0: unlimited)')
+    parser.add_argument('--transcode', type=str, default='false',
+                        help='Resize and re-encode images to download/images_resized while downloading: false, webp or jpeg')
+    parser.add_argument('--max-edge', type=int, default=1024, help='Maximum width and height of transcoded images.')
+    parser.add_argument('--transcode-quality', type=int, default=90, help='WebP/JPEG quality of transcoded images.')
+    parser.add_argument('--transcode-workers', type=int, default=2, help='Number of transcoding processes.')
+    parser.add_argument('--transcode-queue', type=int, default=256,
+                        help='Maximum images waiting to be transcoded. Downloads wait when the queue is full.')
+    parser.add_argument('--chunk-size', type=int, default=50,
+                        help='Links per pool task, so idle threads help with large keywords. (0: one task per keyword)')
+    parser.add_argument('--metrics-port', type=int, default=0,
+                        help='Serve Prometheus metrics on http://127.0.0.1:<port>/metrics while running. (0: disabled)')
+    parser.add_argument('--stream', type=str, default='false',
+                        help='Collect links with Chrome and download them while the page is still scrolling (boolean)')
+    parser.add_argument('--stream-queue', type=int, default=256,
+                        help='Maximum collected links waiting to be downloaded in stream mode.')
     args = parser.parse_args()
 
     _skip = False if str(args.skip).lower() == 'false' else True
@@ -387,6 +1063,37 @@ if __name__ == '__main__':
     _face = False if str(args.face).lower() == 'false' else True
     _limit = int(args.limit)
     _proxy_list = args.proxy_list.split(',')
+    _inflight = args.inflight
+    _pool_size = args.pool_size
+    _host_pool_sizes = HttpSessionPool.parse_host_sizes(args.host_pool_sizes)
+    _dedup = False if str(args.dedup).lower() == 'false' else True
+    _phash = None if str(args.phash).lower() == 'false' else str(args.phash).lower()
+    _phash_threshold = args.phash_threshold
+    _domain_rate = args.domain_rate
+    _domain_concurrency = args.domain_concurrency
+    _domain_config = DomainScheduler.parse_domain_config(args.domain_config)
+    _retries = args.retries
+    _retry_delay = args.retry_delay
+    _breaker_threshold = args.breaker_threshold
+    _breaker_cooldown = args.breaker_cooldown
+    _http_cache = args.http_cache or None
+    _cache_max_age_days = args.cache_max_age_days
+    _cache_max_bytes = args.cache_max_bytes
+    _resume_min_size = args.resume_min_size
+    _output = args.output
+    _shard_size = args.shard_size
+    _min_width = args.min_width
+    _min_height = args.min_height
+    _max_image_bytes = args.max_image_bytes
+    _transcode = None if str(args.transcode).lower() == 'false' else str(args.transcode).lower()
+    _max_edge = args.max_edge
+    _transcode_quality = args.transcode_quality
+    _transcode_workers = args.transcode_workers
+    _transcode_queue = args.transcode_queue
+    _chunk_size = args.chunk_size
+    _metrics_port = args.metrics_port
+    _stream = False if str(args.stream).lower() == 'false' else True
+    _stream_queue = args.stream_queue
 
     no_gui_input = str(args.no_gui).lower()
     if no_gui_input == 'auto':
@@ -397,10 +1104,22 @@ if __name__ == '__main__':
         _no_gui = False
 
     print(
-        'Options - skip:{}, threads:{}, google:{}, naver:{},  bing:{},  pexels:{}, full_resolution:{}, face:{}, no_gui:{}, limit:{}, _proxy_list:{}'
-        .format(_skip, _threads, _google, _naver, _bing, _pexels, _full, _face, _no_gui, _limit, _proxy_list))
+        'Options - skip:{}, threads:{}, google:{}, naver:{},  bing:{},  pexels:{}, full_resolution:{}, face:{}, no_gui:{}, limit:{}, _proxy_list:{}, inflight:{}'
+        .format(_skip, _threads, _google, _naver, _bing, _pexels, _full, _face, _no_gui, _limit, _proxy_list, _inflight))
 
     crawler = AutoCrawler(skip_already_exist=_skip, n_threads=_threads,
                           do_google=_google, do_naver=_naver, do_bing=_bing, do_pexels=_pexels, full_resolution=_full,
-                          face=_face, no_gui=_no_gui, limit=_limit, proxy_list=_proxy_list)
+                          face=_face, no_gui=_no_gui, limit=_limit, proxy_list=_proxy_list, n_inflight=_inflight,
+                          pool_maxsize=_pool_size, host_pool_sizes=_host_pool_sizes, dedup=_dedup,
+                          phash=_phash, phash_threshold=_phash_threshold, domain_rate=_domain_rate,
+                          domain_concurrency=_domain_concurrency, domain_config=_domain_config, retries=_retries,
+                          retry_delay=_retry_delay, breaker_threshold=_breaker_threshold,
+                          breaker_cooldown=_breaker_cooldown, http_cache=_http_cache,
+                          cache_max_age_days=_cache_max_age_days, cache_max_bytes=_cache_max_bytes,
+                          resume_min_size=_resume_min_size, output=_output, shard_size=_shard_size,
+                          min_width=_min_width, min_height=_min_height, max_image_bytes=_max_image_bytes,
+                          transcode=_transcode, max_edge=_max_edge, transcode_quality=_transcode_quality,
+                          transcode_workers=_transcode_workers, transcode_queue=_transcode_queue,
+                          chunk_size=_chunk_size, metrics_port=_metrics_port,
+                          stream=_stream, stream_queue=_stream_queue)
     crawler.do_crawling()
@@ -15,13 +15,19 @@ Copyright 2018 YoongiKim
 """
 
 import os
-import requests
 import shutil
-from multiprocessing import Pool
+from multiprocessing import Pool, util
+from multiprocessing.pool import ThreadPool
 import signal
+import time
 import argparse
+from BrowserPool import BrowserPool
 from collect_links import CollectLinks
-import imghdr
+from HttpCollector import HttpCollectLinks
+from HttpSessionPool import HttpSessionPool
+from ImageHeader import HEAD_SIZE, sniff_image_format
+from Metrics import Metrics, MetricsRun
+from RunState import RunStateStore, STAGE_COLLECT, STATUS_DONE
 import base64
 from pathlib import Path
 import random
@@ -71,7 +77,8 @@ class Sites:
 class AutoCrawler:
     def __init__(self, skip_already_exist=True, n_threads=8, do_google=True, do_naver=True, do_bing=True,
                  do_pexels=True, download_path='download',
-                 full_resolution=False, face=False, no_gui=False, limit=0, proxy_list=None):
+                 full_resolution=False, face=False, no_gui=False, limit=0, proxy_list=None, metrics_port=0,
+                 block_resources=True, collector='dom', http_threads=16, tabs=1):
         """
         :param skip_already_exist: Skips keyword already downloaded before. This is needed when re-downloading.
         :param n_threads: Number of threads to download.
@@ -83,6 +90,12 @@ class AutoCrawler:
         :param no_gui: No GUI mode. Acceleration for full_resolution mode.
         :param limit: Maximum count of images to download. (0: infinite)
         :param proxy_list: The proxy list. Every thread will randomly choose one from the list.
+        :param metrics_port: Serve Prometheus metrics of all threads on http://127.0.0.1:<port>/metrics (0: disabled)
+        :param block_resources: Skip images, fonts, media and ad scripts while collecting thumbnail links
+        :param collector: "dom" reads links from the rendered results, "network" from the result data responses,
+                          "http" fetches and parses bing and pexels result pages without a browser (others use "dom")
+        :param http_threads: Number of keywords collected at the same time with the "http" collector
+        :param tabs: Number of keywords collected at the same time in one browser ("dom" collector, thumbnail mode)
         """
 
         self.skip = skip_already_exist
@@ -97,6 +110,11 @@ class AutoCrawler:
         self.no_gui = no_gui
         self.limit = limit
         self.proxy_list = proxy_list if proxy_list and len(proxy_list) > 0 else None
+        self.metrics_port = metrics_port
+        self.block_resources = block_resources
+        self.collector = collector
+        self.http_threads = http_threads
+        self.tabs = tabs
 
         os.makedirs('./{}'.format(self.download_path), exist_ok=True)
 
@@ -136,10 +154,8 @@ class AutoCrawler:
 
     @staticmethod
     def validate_image(path):
-        ext = imghdr.what(path)
-        if ext == 'jpeg':
-            ext = 'jpg'
-        return ext  # returns None if not valid
+        with open(path, 'rb') as f:
+            return sniff_image_format(f.read(HEAD_SIZE))  # returns None if not valid
 
     @staticmethod
     def make_dir(dirname):
@@ -177,6 +193,18 @@ class AutoCrawler:
         except Exception as e:
             print('Save failed - {}'.format(e))
 
+    def get_run_state(self):
+        return RunStateStore.for_worker('{}/run_state.sqlite'.format(self.download_path.replace('"', '')))
+
+    @staticmethod
+    def url_file_name(keyword):
+        return '{}.txt'.format(keyword.replace('"', '').replace(' ', '_'))
+
+    def list_url_files(self, site_name):
+        # Links collected before run_state.sqlite existed are only recorded as files
+        path = '{}/images_url/{}'.format(self.download_path, site_name)
+        return set(os.listdir(path)) if os.path.isdir(path) else set()
+
     @staticmethod
     def base64_to_object(src):
         header, encoded = str(src).split(',', 1)
@@ -207,7 +235,7 @@ class AutoCrawler:
                     ext = 'png'
                     is_base64 = True
                 else:
-                    response = requests.get(link, stream=True, timeout=10)
+                    response = HttpSessionPool.for_worker().get(link, stream=True, timeout=10)
                     ext = self.get_extension_from_link(link)
                     is_base64 = False
 
@@ -215,6 +243,8 @@ class AutoCrawler:
                                                    str(index).zfill(4))
                 path = no_ext_path + '.' + ext
                 self.save_object_to_file(response, path.lower(), is_base64=is_base64)
+                if not is_base64:
+                    response.close()
 
                 success_count += 1
                 del response
@@ -237,21 +267,57 @@ class AutoCrawler:
                 print('Download failed - ', e)
                 continue
 
+    def uses_http(self, site_code):
+        # bing_full 需要在浏览器中点击结果
+        return (self.collector == 'http' and site_code != Sites.BING_FULL and
+                Sites.get_text(site_code) in HttpCollectLinks.SITES)
+
+    def uses_tabs(self, site_code):
+        # 只有缩略图模式的 dom 采集可以在多个窗口中同时滚动
+        return (self.tabs > 1 and self.collector == 'dom' and
+                site_code in (Sites.GOOGLE, Sites.NAVER, Sites.BING, Sites.PEXELS))
+
+    def save_links(self, keyword, site_name, links):
+        txt_file_path = '{}/{}/{}/{}'.format(self.download_path, 'images_url', site_name,
+                                             self.url_file_name(keyword))
+        # 确保文件夹路径存在
+        os.makedirs(os.path.dirname(txt_file_path), exist_ok=True)
+        # 打开文件，以追加模式（'a'）打开文件
+        with open(txt_file_path, "a", encoding="utf-8") as file:
+            for line in links:
+                file.write(line + "\n")  # 每行写入后加一个换行符
+
+        # print('Downloading images from collected links... {} from {}'.format(keyword, site_name))
+        # self.download_images(keyword, links, site_name, max_count=self.limit)
+        # Path('{}/{}/{}_done'.format(self.download_path, keyword.replace('"', ''), site_name)).touch()
+        self.get_run_state().set_task_status(site_name, keyword, STAGE_COLLECT, STATUS_DONE)
+
+        print('Done write image url  {} : {}'.format(site_name, keyword))
+
     def download_from_site(self, keyword, site_code):
         site_name = Sites.get_text(site_code)
         add_url = Sites.get_face_url(site_code) if self.face else ""
+        metrics = Metrics.for_worker()
 
         try:
             proxy = None
             if self.proxy_list:
                 proxy = random.choice(self.proxy_list)
-            collect = CollectLinks(no_gui=self.no_gui, proxy=proxy)  # initialize chrome driver
+            if self.uses_http(site_code):
+                collect = HttpCollectLinks(proxy=proxy)
+            else:
+                # takes a warm chrome driver from the pool
+                collect = CollectLinks(no_gui=self.no_gui, proxy=proxy, block_resources=self.block_resources,
+                                       collector=self.collector)
         except Exception as e:
             print('Error occurred while initializing chromedriver - {}'.format(e))
+            metrics.inc('collect_errors_total', site=site_name)
+            metrics.flush()
             return
 
         try:
             print('Collecting links... {} from {}'.format(keyword, site_name))
+            collect_started = time.time()
 
             if site_code == Sites.GOOGLE:
                 links = collect.google(keyword, add_url)
@@ -281,121 +347,146 @@ class AutoCrawler:
                 print('Invalid Site Code')
                 links = []
 
+            metrics.observe('collect_seconds', time.time() - collect_started, site=site_name)
+            metrics.inc('links_collected_total', len(links), site=site_name)
+
             print('Downloading images from collected links... {} from {}'.format(keyword, site_name))
-            txt_file_path = '{}/{}/{}/{}.txt'.format(self.download_path, 'images_url', site_name,
-                                                     keyword.replace('"', '').replace(' ', '_'))
-            # 确保文件夹路径存在
-            os.makedirs(os.path.dirname(txt_file_path), exist_ok=True)
-            # 打开文件，以追加模式（'a'）打开文件
-            with open(txt_file_path, "a", encoding="utf-8") as file:
-                for line in links:
-                    file.write(line + "\n")  # 每行写入后加一个换行符
+            self.save_links(keyword, site_name, links)
 
-            # print('Downloading images from collected links... {} from {}'.format(keyword, site_name))
-            # self.download_images(keyword, links, site_name, max_count=self.limit)
-            # Path('{}/{}/{}_done'.format(self.download_path, keyword.replace('"', ''), site_name)).touch()
+        except Exception as e:
+            print('Exception {}:{} - {}'.format(site_name, keyword, e))
+            metrics.inc('collect_errors_total', site=site_name)
+        finally:
+            collect.release()
+            metrics.flush()
 
-            print('Done write image url  {} : {}'.format(site_name, keyword))
+    def download_tabs(self, keywords, site_code):
+        """一个浏览器的多个窗口同时采集 keywords"""
+        site_name = Sites.get_text(site_code)
+        add_url = Sites.get_face_url(site_code) if self.face else ""
+        metrics = Metrics.for_worker()
 
+        try:
+            proxy = None
+            if self.proxy_list:
+                proxy = random.choice(self.proxy_list)
+            collect = CollectLinks(no_gui=self.no_gui, proxy=proxy, block_resources=self.block_resources,
+                                   collector=self.collector)
         except Exception as e:
-            print('Exception {}:{} - {}'.format(site_name, keyword, e))
+            print('Error occurred while initializing chromedriver - {}'.format(e))
+            metrics.inc('collect_errors_total', len(keywords), site=site_name)
+            metrics.flush()
             return
 
+        try:
+            print('Collecting links... {} from {} in {} windows'.format(keywords, site_name, self.tabs))
+            collect_started = time.time()
+            results = collect.collect_tabs(site_name, keywords, add_url, tabs=self.tabs)
+            metrics.observe('collect_seconds', time.time() - collect_started, site=site_name)
+
+            for keyword, links in results.items():
+                metrics.inc('links_collected_total', len(links), site=site_name)
+                self.save_links(keyword, site_name, links)
+
+        except Exception as e:
+            print('Exception {}:{} - {}'.format(site_name, keywords, e))
+            metrics.inc('collect_errors_total', site=site_name)
+        finally:
+            collect.release()
+            metrics.flush()
+
     def download(self, args):
-        self.download_from_site(keyword=args[0], site_code=args[1])
+        if isinstance(args[0], list):
+            self.download_tabs(keywords=args[0], site_code=args[1])
+        else:
+            self.download_from_site(keyword=args[0], site_code=args[1])
 
-    def init_worker(self):
+    def init_worker(self, metrics_registry=None, driver_path=None):
         signal.signal(signal.SIGINT, signal.SIG_IGN)
+        if metrics_registry is not None:
+            Metrics.for_worker().attach(metrics_registry)
+        if driver_path is not None:
+            BrowserPool.set_driver_path(driver_path)
+        # 工作进程正常退出时关闭常驻的浏览器
+        util.Finalize(None, BrowserPool.close_worker, exitpriority=10)
 
     def do_crawling(self):
         tasks = []
 
-        site_name = Sites.get_text(Sites.GOOGLE)
-        keywords = self.get_keywords(site_name=site_name)
-        if keywords:
-            for keyword in keywords:
-                dir_name = '{}/images_file/{}/{}'.format(self.download_path, site_name, keyword)
-                google_done = os.path.exists(os.path.join(os.getcwd(), dir_name, 'google_done'))
-                if google_done and self.skip:
-                    print('Skipping done task {}'.format(dir_name))
-                    continue
-
-                if self.is_keywords_skip(site_name, keyword):
-                    continue
-
-                if self.do_google and not google_done:
-                    if self.full_resolution:
-                        tasks.append([keyword, Sites.GOOGLE_FULL])
-                    else:
-                        tasks.append([keyword, Sites.GOOGLE])
-
-        site_name = Sites.get_text(Sites.BING)
-        keywords = self.get_keywords(site_name=site_name)
-        if keywords:
-            for keyword in keywords:
-                dir_name = '{}/images_file/{}/{}'.format(self.download_path, site_name, keyword)
-                bing_done = os.path.exists(os.path.join(os.getcwd(), dir_name, 'bing_done'))
-                if bing_done and self.skip:
-                    print('Skipping done task {}'.format(dir_name))
-                    continue
-
-                if self.is_keywords_skip(site_name, keyword):
-                    continue
-
-                if self.do_bing and not bing_done:
-                    if self.full_resolution:
-                        tasks.append([keyword, Sites.BING_FULL])
-                    else:
-                        tasks.append([keyword, Sites.BING])
-
-        site_name = Sites.get_text(Sites.PEXELS)
-        keywords = self.get_keywords(site_name=site_name)
-        if keywords:
-            for keyword in keywords:
-                dir_name = '{}/images_file/{}/{}'.format(self.download_path, site_name, keyword)
-                pexels_done = os.path.exists(os.path.join(os.getcwd(), dir_name, 'pexels_done'))
-                if pexels_done and self.skip:
-                    print('Skipping done task {}'.format(dir_name))
-                    continue
-
-                if self.is_keywords_skip(site_name, keyword):
-                    continue
+        # One query instead of probing the file system for every keyword
+        collected = self.get_run_state().done_keywords(STAGE_COLLECT)
 
-                if self.do_pexels and not pexels_done:
-                    if self.full_resolution:
-                        tasks.append([keyword, Sites.PEXELS_FULL])
-                    else:
-                        tasks.append([keyword, Sites.PEXELS])
+        for site_code, site_full_code, enabled in [(Sites.GOOGLE, Sites.GOOGLE_FULL, self.do_google),
+                                                   (Sites.BING, Sites.BING_FULL, self.do_bing),
+                                                   (Sites.PEXELS, Sites.PEXELS_FULL, self.do_pexels),
+                                                   (Sites.NAVER, Sites.NAVER_FULL, self.do_naver)]:
+            site_name = Sites.get_text(site_code)
+            keywords = self.get_keywords(site_name=site_name)
+            if not enabled or not keywords:
+                continue
 
-        site_name = Sites.get_text(Sites.NAVER)
-        keywords = self.get_keywords(site_name=site_name)
-        if keywords:
+            url_files = self.list_url_files(site_name)
             for keyword in keywords:
-                dir_name = '{}/images_file/{}/{}'.format(self.download_path, site_name, keyword)
-                naver_done = os.path.exists(os.path.join(os.getcwd(), dir_name, 'naver_done'))
-                if naver_done and self.skip:
-                    print('Skipping done task {}'.format(dir_name))
-                    continue
-
-                if self.is_keywords_skip(site_name, keyword):
+                if (site_name, keyword) in collected or self.url_file_name(keyword) in url_files:
+                    print('Skipping done task {} : {}'.format(site_name, keyword))
                     continue
 
-                if self.do_naver and not naver_done:
-                    if self.full_resolution:
-                        tasks.append([keyword, Sites.NAVER_FULL])
-                    else:
-                        tasks.append([keyword, Sites.NAVER])
-
+                if self.full_resolution:
+                    tasks.append([keyword, site_full_code])
+                else:
+                    tasks.append([keyword, site_code])
+
+        # 不需要浏览器的关键词在本进程的线程中采集
+        http_tasks = [task for task in tasks if self.uses_http(task[1])]
+        tasks = [task for task in tasks if not self.uses_http(task[1])]
+
+        # 多窗口采集: 同一站点的关键词每 tabs 个合成一个任务，由一个浏览器同时采集
+        if self.tabs > 1:
+            grouped = {}
+            for keyword, site_code in tasks:
+                if self.uses_tabs(site_code):
+                    grouped.setdefault(site_code, []).append(keyword)
+            tasks = [task for task in tasks if not self.uses_tabs(task[1])]
+            for site_code, keywords in grouped.items():
+                for i in range(0, len(keywords), self.tabs):
+                    tasks.append([keywords[i:i + self.tabs], site_code])
+
+        # chromedriver 只在这里解析一次，工作进程直接使用
         try:
-            pool = Pool(self.n_threads, initializer=self.init_worker)
-            pool.map(self.download, tasks)
-        except KeyboardInterrupt:
-            pool.terminate()
-            pool.join()
-        else:
-            pool.terminate()
-            pool.join()
-        print('Task ended. Pool join.')
+            driver_path = BrowserPool.driver_path() if tasks else None
+        except Exception as e:
+            print('Error occurred while installing chromedriver - {}'.format(e))
+            driver_path = None
+
+        # 所有进程的指标汇总到一起，结束时写入 JSON
+        metrics_run = MetricsRun(self.metrics_port,
+                                 '{}/metrics_collect.json'.format(self.download_path.replace('"', '')))
+        with metrics_run as metrics_registry:
+            if http_tasks:
+                metrics = Metrics.for_worker()
+                metrics.attach(metrics_registry)
+                try:
+                    thread_pool = ThreadPool(self.http_threads)
+                    thread_pool.map(self.download, http_tasks)
+                except KeyboardInterrupt:
+                    thread_pool.terminate()
+                else:
+                    thread_pool.close()
+                thread_pool.join()
+                metrics.flush()
+                print('HTTP collection ended. {} keywords.'.format(len(http_tasks)))
+
+            try:
+                pool = Pool(self.n_threads, initializer=self.init_worker, initargs=(metrics_registry, driver_path))
+                pool.map(self.download, tasks)
+            except KeyboardInterrupt:
+                pool.terminate()
+                pool.join()
+            else:
+                # 工作进程正常退出，常驻的浏览器随之关闭
+                pool.close()
+                pool.join()
+            print('Task ended. Pool join.')
 
         # 指定文件夹路径
         folder_path = '{}\{}'.format(self.download_path, 'images_url')  # 替换为你的文件夹路径
@@ -481,11 +572,6 @@ class AutoCrawler:
         else:
             print('Data imbalance not detected.')
 
-    def is_keywords_skip(self, site_name, keyword):
-        txt_file_path = '{}/{}/{}/{}.txt'.format(self.download_path, 'images_url', site_name,
-                                                 keyword.replace('"', '').replace(' ', '_'))
-        return os.path.exists(txt_file_path)
-
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('--skip', type=str, default='true',
@@ -507,6 +593,19 @@ if __name__ == '__main__':
     parser.add_argument('--proxy-list', type=str, default='',
                         help='The comma separated proxy list like: "socks://127.0.0.1:1080,http://127.0.0.1:1081". '
                              'Every thread will randomly choose one from the list.')
+    parser.add_argument('--metrics-port', type=int, default=0,
+                        help='Serve Prometheus metrics on http://127.0.0.1:<port>/metrics while running. (0: disabled)')
+    parser.add_argument('--block-resources', type=str, default='true',
+                        help='Skip images, fonts, media and ad scripts while collecting thumbnail links (boolean)')
+    parser.add_argument('--collector', type=str, default='dom', choices=['dom', 'network', 'http'],
+                        help='Thumbnail mode: read links from the rendered results (dom), '
+                             'from the result data responses (network), '
+                             'or fetch bing and pexels result pages without a browser (http)')
+    parser.add_argument('--http-threads', type=int, default=16,
+                        help='Number of keywords collected at the same time with --collector http.')
+    parser.add_argument('--tabs', type=int, default=1,
+                        help='Number of keywords collected at the same time in every browser, '
+                             'each in its own window. (--collector dom, thumbnail mode)')
     args = parser.parse_args()
 
     _skip = False if str(args.skip).lower() == 'false' else True
@@ -519,6 +618,11 @@ if __name__ == '__main__':
     _face = False if str(args.face).lower() == 'false' else True
     _limit = int(args.limit)
     _proxy_list = args.proxy_list.split(',')
+    _metrics_port = args.metrics_port
+    _block_resources = False if str(args.block_resources).lower() == 'false' else True
+    _collector = args.collector
+    _http_threads = args.http_threads
+    _tabs = args.tabs
 
     no_gui_input = str(args.no_gui).lower()
     if no_gui_input == 'auto':
@@ -534,5 +638,7 @@ if __name__ == '__main__':
 
     crawler = AutoCrawler(skip_already_exist=_skip, n_threads=_threads,
                           do_google=_google, do_naver=_naver, do_bing=_bing, do_pexels=_pexels, full_resolution=_full,
-                          face=_face, no_gui=_no_gui, limit=_limit, proxy_list=_proxy_list)
+                          face=_face, no_gui=_no_gui, limit=_limit, proxy_list=_proxy_list,
+                          metrics_port=_metrics_port, block_resources=_block_resources,
+                          collector=_collector, http_threads=_http_threads, tabs=_tabs)
     crawler.do_crawling()
@@ -0,0 +1,46 @@
+import threading
+import unittest
+
+from AsyncDownloader import AsyncDownloader
+from DomainScheduler import DomainScheduler, KeywordQuota
+from RetryPolicy import CircuitBreaker, RetryPolicy, TransientError
+
+
+class ProbeReleaseTest(unittest.TestCase):
+    def test_probe_deferred_by_scheduler_is_released(self):
+        # 熔断冷却结束后放行的试探请求被限速暂缓，之后仍然要能再次试探，而不是一直跳过该域名
+        breaker = CircuitBreaker(failure_threshold=1, cooldown=0.1)
+        calls = []
+
+        def download_fn(item):
+            calls.append(item)
+            if len(calls) == 1:
+                raise TransientError('HTTP 502')
+            return True
+
+        downloader = AsyncDownloader(4, scheduler=DomainScheduler(rate=1), key_fn=lambda item: 'example.com',
+                                     retry_policy=RetryPolicy(max_retries=2, base_delay=0.2), breaker=breaker)
+        count = downloader.run(range(3), download_fn)
+
+        self.assertGreater(count, 0)
+        self.assertFalse(breaker.domains['example.com']['probing'])
+
+    def test_probe_deferred_by_busy_quota_is_released(self):
+        # 另一个进程占用了关键词的最后一个名额时，试探请求被暂缓，名额归还后应该能正常下载
+        breaker = CircuitBreaker(failure_threshold=1, cooldown=0.0)
+        breaker.record_failure('example.com', 1.0)
+        quota = KeywordQuota()
+        quota.set('keyword', 1)
+        quota.acquire('keyword')
+        threading.Timer(0.5, quota.finish, ('keyword', False)).start()
+
+        downloader = AsyncDownloader(4, key_fn=lambda item: 'example.com', breaker=breaker, quota=quota,
+                                     quota_key='keyword')
+        count = downloader.run(range(3), lambda item: True)
+
+        self.assertEqual(count, 1)
+        self.assertFalse(breaker.domains['example.com']['probing'])
+
+
+if __name__ == '__main__':
+    unittest.main()